@@ -16,6 +16,7 @@ from routes.tenants import tenants_bp
 from routes.vision import vision_bp
 from routes.voice import voice_bp
 from routes.ai import ai_bp
+from routes.metrics import metrics_bp
 
 
 # Importar configuração
@@ -55,6 +56,7 @@ app.register_blueprint(tenants_bp)
 app.register_blueprint(vision_bp)
 app.register_blueprint(voice_bp)
 app.register_blueprint(ai_bp)
+app.register_blueprint(metrics_bp)
 
 
 # Error handlers
@@ -0,0 +1,19 @@
+"""
+App mínimo para o benchmark de modos de worker (ver benchmarks/load_test.py).
+
+Usa o mesmo caminho de código das rotas de chat até o provedor
+(utils.groq_client + cliente HTTP compartilhado), sem Supabase nem auth.
+"""
+from flask import Flask, jsonify
+from utils.groq_client import get_groq_response
+
+app = Flask(__name__)
+
+@app.route('/bench/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/bench/chat', methods=['POST'])
+def chat():
+    text = get_groq_response([{'role': 'user', 'content': 'ping'}], model='bench-model')
+    return jsonify({'message': text}), 200
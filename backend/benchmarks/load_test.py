@@ -0,0 +1,158 @@
+"""
+Benchmark de carga: workers gunicorn 'sync' x 'gevent' com um LLM simulado.
+
+Sobe um upstream falso compatível com a API da Groq (responde após
+--upstream-latency segundos), inicia o gunicorn com gunicorn.conf.py em
+cada modo apontando GROQ_BASE_URL para ele e dispara requisições
+concorrentes em /bench/chat.
+
+Uso (a partir de backend/):
+    python benchmarks/load_test.py --modes sync gevent --concurrency 100 --requests 500
+
+Requer gunicorn e gevent instalados (requirements.txt).
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_fake_upstream(latency):
+    """Servidor que imita /chat/completions da Groq com latência fixa"""
+    body = json.dumps({
+        'choices': [{'message': {'role': 'assistant', 'content': 'pong'}}]
+    }).encode('utf-8')
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', _free_port()), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_gunicorn(mode, port, upstream_url, workers):
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_MODE=mode,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        GROQ_API_KEY='bench',
+        GROQ_BASE_URL=upstream_url,
+        HTTP_CLIENT_HTTP2='false',
+        GUNICORN_LOG_LEVEL='warning',
+    )
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'benchmarks.bench_app:app'],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn ({mode}) encerrou com código {proc.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/bench/health', timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'gunicorn ({mode}) não respondeu a tempo')
+
+def _request(url, timeout):
+    started = time.perf_counter()
+    try:
+        req = urllib.request.Request(url, data=b'{}', headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req, timeout=timeout).read()
+        return time.perf_counter() - started, True
+    except Exception:
+        return time.perf_counter() - started, False
+
+def run_load(port, total, concurrency, timeout):
+    url = f'http://127.0.0.1:{port}/bench/chat'
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: _request(url, timeout), range(total)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(lat for lat, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+
+    def pct(q):
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))] * 1000
+
+    return {
+        'requests': total,
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(pct(0.5), 1),
+        'p95_ms': round(pct(0.95), 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1) if latencies else float('nan'),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'gevent'], choices=['sync', 'gevent'])
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--upstream-latency', type=float, default=1.0)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    upstream = start_fake_upstream(args.upstream_latency)
+    upstream_url = f'http://127.0.0.1:{upstream.server_address[1]}'
+    rows = []
+    try:
+        for mode in args.modes:
+            port = _free_port()
+            proc = start_gunicorn(mode, port, upstream_url, args.workers)
+            try:
+                # Aquecimento (clientes HTTP e imports em cada worker)
+                run_load(port, args.workers * 2, args.workers, args.timeout)
+                result = run_load(port, args.requests, args.concurrency, args.timeout)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            result['mode'] = mode
+            rows.append(result)
+    finally:
+        upstream.shutdown()
+
+    print(f'\nworkers={args.workers} concurrency={args.concurrency} upstream_latency={args.upstream_latency}s')
+    header = ('mode', 'requests', 'errors', 'seconds', 'throughput', 'p50_ms', 'p95_ms', 'mean_ms')
+    print(' | '.join(f'{h:>10}' for h in header))
+    for row in rows:
+        print(' | '.join(f'{str(row[h]):>10}' for h in header))
+
+if __name__ == '__main__':
+    main()
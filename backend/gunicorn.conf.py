@@ -0,0 +1,36 @@
+import os
+
+# Modo dos workers:
+# - 'sync': um request por worker; cada chamada a um LLM prende o worker
+#   durante toda a geração
+# - 'gevent': I/O cooperativo; um processo mantém centenas de chamadas aos
+#   provedores em andamento (httpx, SDK da Anthropic e Supabase cooperam
+#   após o monkey patching feito pelo worker)
+WORKER_MODE = os.getenv('GUNICORN_WORKER_MODE', 'sync').strip().lower()
+
+if WORKER_MODE not in ('sync', 'gevent'):
+    raise ValueError(f'GUNICORN_WORKER_MODE inválido: {WORKER_MODE}')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+
+# Gerações longas e streams SSE passam facilmente dos 30s padrão
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Sem preload: o app precisa ser importado depois do monkey patching do
+# gevent, e clientes/threads são criados por worker (ver utils/http_clients.py)
+preload_app = False
+
+if WORKER_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500'))
+    # O SDK do Gemini usa gRPC por padrão, que bloquearia o processo inteiro
+    os.environ.setdefault('GEMINI_TRANSPORT', 'rest')
+    # Pool da Groq proporcional às conexões do worker
+    os.environ.setdefault('GROQ_MAX_CONNECTIONS', str(worker_connections))
+else:
+    worker_class = 'sync'
@@ -0,0 +1,7 @@
+-- Resumo acumulado das mensagens antigas de cada conversa (usado pelo context builder)
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id UUID PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    covered_messages INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL
+);
@@ -0,0 +1,16 @@
+-- Lotes assíncronos das operações de texto (POST /api/v1/ai/batch com mode=async)
+-- Guarda só o hash do texto de cada item; o texto vai apenas para a Message Batches API
+CREATE TABLE IF NOT EXISTS ai_batches (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id UUID REFERENCES tenants(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    provider_batch_id TEXT,
+    model TEXT NOT NULL,
+    items JSONB NOT NULL DEFAULT '[]'::jsonb,
+    status TEXT NOT NULL DEFAULT 'processing',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL,
+    completed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_batches_tenant ON ai_batches(tenant_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_ai_batches_user ON ai_batches(user_id, created_at DESC);
@@ -0,0 +1,4 @@
+-- Estado das mensagens do assistente: 'complete' ou 'cancelled' (cliente
+-- desconectou durante a geração; `content`/`conteudo` guarda o texto parcial)
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'complete';
+ALTER TABLE custom_ai_messages ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'complete';
@@ -0,0 +1,3 @@
+-- Opt-in por IA personalizada: com temperatura 0, mensagens idênticas
+-- enviadas ao mesmo tempo compartilham uma única chamada ao modelo
+ALTER TABLE custom_ais ADD COLUMN IF NOT EXISTS coalesce_requests BOOLEAN NOT NULL DEFAULT false;
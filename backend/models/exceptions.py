@@ -108,6 +108,17 @@ class SSRFError(KairosException):
             400
         )
 
+class ClientDisconnectedError(KairosException):
+    """Cliente fechou a conexão antes da resposta ficar pronta"""
+    def __init__(self, partial: str = ''):
+        super().__init__(
+            'Cliente encerrou a requisição',
+            'CLIENT_CLOSED_REQUEST',
+            499
+        )
+        # Texto gerado até o cancelamento
+        self.partial = partial
+
 class InternalError(KairosException):
     """Erro interno do servidor"""
     def __init__(self, message: str = 'Erro interno do servidor'):
@@ -1,11 +1,175 @@
-from datetime import datetime, date
-from typing import Dict
+from datetime import datetime, date, timedelta
+from typing import Dict, Optional
 from config.supabase_config import supabase
 from models.exceptions import QuotaExceededError
+from utils.cache import TTLCache
+from utils.write_behind import write_behind
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+class InMemoryCounterBackend:
+    """
+    Contadores de quota na memória do processo (padrão).
+
+    Cada worker mantém seus próprios contadores, por isso as chaves expiram
+    após `resync_seconds` e são semeadas de novo a partir de `quota_logs`,
+    limitando a divergência entre workers sem backend compartilhado.
+    """
+
+    def __init__(self, resync_seconds: Optional[int] = 60):
+        self.resync_seconds = resync_seconds
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _alive(self, key, now):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._values[key]
+            return None
+        return item
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            item = self._alive(key, time.monotonic())
+            return item[0] if item else None
+
+    def seed(self, key: str, value: int, ttl: int) -> int:
+        """Define o valor se a chave não existir e retorna o valor atual"""
+        if self.resync_seconds:
+            ttl = min(ttl, self.resync_seconds)
+        with self._lock:
+            now = time.monotonic()
+            item = self._alive(key, now)
+            if item:
+                return item[0]
+            self._values[key] = (int(value), now + ttl)
+            self._purge(now)
+            return int(value)
+
+    def incr(self, key: str, amount: int = 1) -> Optional[int]:
+        """Incrementa a chave somente se ela já foi semeada"""
+        with self._lock:
+            item = self._alive(key, time.monotonic())
+            if not item:
+                return None
+            value = item[0] + amount
+            self._values[key] = (value, item[1])
+            return value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def _purge(self, now):
+        expired = [k for k, (_, exp) in self._values.items() if exp is not None and exp <= now]
+        for k in expired:
+            del self._values[k]
+
+# INCRBY apenas se a chave existir, em uma única operação: com EXISTS e
+# INCRBY separados a chave podia expirar entre os dois comandos, e o INCRBY
+# a recriava sem TTL e sem a semeadura a partir de `quota_logs`
+INCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+class RedisCounterBackend:
+    """Contadores compartilhados entre workers via Redis (ou cliente compatível)"""
+
+    def __init__(self, client, prefix: str = 'kairos:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[int]:
+        value = self.client.get(self.prefix + key)
+        return int(value) if value is not None else None
+
+    def seed(self, key: str, value: int, ttl: int) -> int:
+        self.client.set(self.prefix + key, int(value), ex=ttl, nx=True)
+        current = self.get(key)
+        return current if current is not None else int(value)
+
+    def incr(self, key: str, amount: int = 1) -> Optional[int]:
+        """Incrementa a chave somente se ela já foi semeada (mantém o TTL)"""
+        value = self.client.eval(INCR_IF_EXISTS, 1, self.prefix + key, int(amount))
+        return int(value) if value is not None else None
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+class LocalRedis:
+    """
+    Stand-in local compatível com o subconjunto da API do redis-py usado
+    por RedisCounterBackend. Útil em testes e desenvolvimento sem Redis.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _entry(self, name):
+        item = self._data.get(name)
+        if item and item[1] is not None and item[1] <= time.monotonic():
+            del self._data[name]
+            return None
+        return item
+
+    def get(self, name):
+        with self._lock:
+            item = self._entry(name)
+            return item[0] if item else None
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._entry(name):
+                return None
+            expires_at = time.monotonic() + ex if ex else None
+            self._data[name] = (str(value).encode(), expires_at)
+            return True
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for n in names if self._entry(n))
+
+    def eval(self, script, numkeys, *keys_and_args):
+        """Executa apenas INCR_IF_EXISTS, o único script de RedisCounterBackend"""
+        if script != INCR_IF_EXISTS:
+            raise NotImplementedError('LocalRedis executa apenas INCR_IF_EXISTS')
+        name, amount = keys_and_args[0], int(keys_and_args[1])
+        with self._lock:
+            item = self._entry(name)
+            if not item:
+                return None
+            value = int(item[0]) + amount
+            self._data[name] = (str(value).encode(), item[1])
+            return value
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for n in names if self._data.pop(n, None) is not None)
+
+def create_counter_backend():
+    """Escolhe o backend de contadores a partir do ambiente (QUOTA_REDIS_URL)"""
+    redis_url = os.getenv('QUOTA_REDIS_URL')
+    if redis_url:
+        try:
+            import redis
+            return RedisCounterBackend(redis.Redis.from_url(redis_url))
+        except ImportError:
+            logger.warning('Pacote redis não instalado; usando contadores de quota em memória')
+    return InMemoryCounterBackend(
+        resync_seconds=int(os.getenv('QUOTA_COUNTER_RESYNC_SECONDS', '60'))
+    )
+
 class QuotaManager:
     """Gerenciador de quotas por tenant e plano"""
 
@@ -36,9 +200,85 @@ class QuotaManager:
         }
     }
 
+    # Contadores diários por tenant/ação (ver create_counter_backend)
+    counters = create_counter_backend()
+
+    # Planos mudam raramente; invalidados explicitamente em routes/tenants.py
+    plan_cache = TTLCache(
+        maxsize=int(os.getenv('PLAN_CACHE_SIZE', '4096')),
+        ttl=int(os.getenv('PLAN_CACHE_TTL', '300')),
+        name='tenant_plan'
+    )
+
+    @classmethod
+    def set_counter_backend(cls, backend) -> None:
+        """Substitui o backend de contadores (ex.: RedisCounterBackend(LocalRedis()))"""
+        cls.counters = backend
+
+    @staticmethod
+    def _counter_key(tenant_id: str, action: str, day: date) -> str:
+        return f'quota:{tenant_id}:{action}:{day.isoformat()}'
+
+    @staticmethod
+    def _seconds_until_rollover() -> int:
+        now = datetime.now()
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return max(1, int((tomorrow - now).total_seconds()))
+
+    @classmethod
+    def _count_usage_today(cls, tenant_id: str, action: str, day: date) -> int:
+        result = supabase.table('quota_logs') \
+            .select('count', count='exact') \
+            .eq('tenant_id', tenant_id) \
+            .eq('action', action) \
+            .gte('created_at', f'{day.isoformat()}T00:00:00') \
+            .execute()
+        return result.count or 0
+
+    @staticmethod
+    def _pending_usage(tenant_id: str, action: str, day: date) -> int:
+        """Linhas de `quota_logs` do dia ainda no buffer do write-behind"""
+        day_start = f'{day.isoformat()}T00:00:00'
+        return write_behind.pending_rows(
+            'quota_logs',
+            lambda r: r.get('tenant_id') == tenant_id and r.get('action') == action
+            and str(r.get('created_at') or '') >= day_start
+        )
+
+    @classmethod
+    def get_usage(cls, tenant_id: str, action: str) -> int:
+        """
+        Retorna o uso diário de uma ação.
+
+        Lê o contador em cache; na primeira consulta do dia (ou após expirar)
+        o contador é semeado uma vez a partir de `quota_logs`.
+        """
+        day = date.today()
+        key = cls._counter_key(tenant_id, action, day)
+        try:
+            usage = cls.counters.get(key)
+            if usage is not None:
+                return usage
+        except Exception as e:
+            logger.error(f'Error reading quota counter: {str(e)}')
+            return cls._count_usage_today(tenant_id, action, day)
+
+        # Linhas ainda no buffer de escrita não aparecem na contagem do banco
+        with write_behind.paused():
+            usage = cls._count_usage_today(tenant_id, action, day) + cls._pending_usage(tenant_id, action, day)
+        try:
+            return cls.counters.seed(key, usage, cls._seconds_until_rollover())
+        except Exception as e:
+            logger.error(f'Error seeding quota counter: {str(e)}')
+            return usage
+
     @classmethod
     def get_tenant_plan(cls, tenant_id: str) -> str:
-        """Obtém o plano do tenant"""
+        """Obtém o plano do tenant (cacheado por PLAN_CACHE_TTL segundos)"""
+        plan = cls.plan_cache.get(str(tenant_id))
+        if plan is not None:
+            return plan
+
         try:
             result = supabase.table('tenants') \
                 .select('plano') \
@@ -50,19 +290,27 @@ class QuotaManager:
                 logger.warning(f'Tenant {tenant_id} not found')
                 return 'free'
 
-            return result.data[0].get('plano', 'free')
+            plan = result.data[0].get('plano') or 'free'
+            cls.plan_cache.set(str(tenant_id), plan)
+            return plan
         except Exception as e:
             logger.error(f'Error getting tenant plan: {str(e)}')
             return 'free'
 
     @classmethod
-    def check_quota(cls, tenant_id: str, action: str) -> bool:
+    def invalidate_plan(cls, tenant_id: str) -> None:
+        """Descarta o plano cacheado (chamar após alterar ou remover o tenant)"""
+        cls.plan_cache.invalidate(str(tenant_id))
+
+    @classmethod
+    def check_quota(cls, tenant_id: str, action: str, amount: int = 1) -> bool:
         """
         Verifica se tenant pode realizar ação.
 
         Args:
             tenant_id: ID do tenant
             action: Ação a verificar (ex: 'api_calls_per_day')
+            amount: Quantidade que será consumida (ex: itens de um lote)
 
         Returns:
             True se dentro do limite, False caso contrário
@@ -93,19 +341,10 @@ class QuotaManager:
                 
                 return True
             
-            # For other actions, count usage today from quota_logs
-            today = date.today().isoformat()
-            
-            result = supabase.table('quota_logs') \
-                .select('count', count='exact') \
-                .eq('tenant_id', tenant_id) \
-                .eq('action', action) \
-                .gte('created_at', f'{today}T00:00:00') \
-                .execute()
-
-            usage = result.count or 0
+            # For other actions, use the cached daily counter
+            usage = cls.get_usage(tenant_id, action)
 
-            if usage >= limit:
+            if usage + amount > limit:
                 logger.warning(
                     f'Quota exceeded for {tenant_id}: {action}',
                     extra={'usage': usage, 'limit': limit}
@@ -121,19 +360,33 @@ class QuotaManager:
             return True  # Permitir em caso de erro
 
     @classmethod
-    def log_usage(cls, tenant_id: str, action: str, user_id: str) -> None:
+    def log_usage(cls, tenant_id: str, action: str, user_id: str, amount: int = 1) -> None:
         """
         Registra uso de quota.
+
+        O contador é incrementado na hora; as linhas em `quota_logs` (uma por
+        unidade de `amount`) são gravadas em lote pelo write-behind, fora do
+        caminho da resposta.
         """
+        if amount <= 0:
+            return
+        created_at = datetime.now().isoformat()
         try:
-            supabase.table('quota_logs').insert({
-                'tenant_id': tenant_id,
-                'user_id': user_id,
-                'action': action,
-                'created_at': datetime.now().isoformat()
-            }).execute()
+            for _ in range(amount):
+                write_behind.insert('quota_logs', {
+                    'tenant_id': tenant_id,
+                    'user_id': user_id,
+                    'action': action,
+                    'created_at': created_at
+                })
         except Exception as e:
             logger.error(f'Error logging quota: {str(e)}')
+            return
+
+        try:
+            cls.counters.incr(cls._counter_key(tenant_id, action, date.today()), amount)
+        except Exception as e:
+            logger.error(f'Error incrementing quota counter: {str(e)}')
 
     @classmethod
     def get_usage_stats(cls, tenant_id: str) -> Dict:
@@ -143,7 +396,8 @@ class QuotaManager:
         plan = cls.get_tenant_plan(tenant_id)
         limits = cls.LIMITS_BY_PLAN.get(plan, {})
         
-        today = date.today().isoformat()
+        day = date.today()
+        today = day.isoformat()
         stats = {
             'plan': plan,
             'usage': {},
@@ -151,19 +405,26 @@ class QuotaManager:
         }
 
         try:
-            # Buscar uso de ações diárias (api_calls_per_day, conversations)
-            result = supabase.table('quota_logs') \
-                .select('action') \
-                .eq('tenant_id', tenant_id) \
-                .gte('created_at', f'{today}T00:00:00') \
-                .execute()
+            # Linhas ainda no buffer de escrita não aparecem na consulta (ver get_usage)
+            with write_behind.paused():
+                # Buscar uso de ações diárias (api_calls_per_day, conversations)
+                result = supabase.table('quota_logs') \
+                    .select('action') \
+                    .eq('tenant_id', tenant_id) \
+                    .gte('created_at', f'{today}T00:00:00') \
+                    .execute()
+
+                # Contar ocorrências por ação
+                usage_counts = {}
+                if result.data:
+                    for log in result.data:
+                        action = log['action']
+                        usage_counts[action] = usage_counts.get(action, 0) + 1
 
-            # Contar ocorrências por ação
-            usage_counts = {}
-            if result.data:
-                for log in result.data:
-                    action = log['action']
-                    usage_counts[action] = usage_counts.get(action, 0) + 1
+                for action in set(usage_counts) | set(limits):
+                    pending = cls._pending_usage(tenant_id, action, day)
+                    if pending:
+                        usage_counts[action] = usage_counts.get(action, 0) + pending
 
             # Adicionar contagem de agentes ativos
             agents_result = supabase.table('custom_ais') \
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field, validator, EmailStr
 from typing import Optional, List
 from datetime import datetime
+from utils.model_registry import MODEL_REGISTRY, AUTO_MODELS as ROUTER_AUTO_MODELS
 
 # ========== AUTH SCHEMAS ==========
 class RegisterRequest(BaseModel):
@@ -25,13 +26,15 @@ class SendMessageRequest(BaseModel):
     tenant_id: Optional[str] = None
     messages: Optional[List[dict]] = []
     model: Optional[str] = None
+    stream: bool = False
+    server_history: bool = False
 
     @validator('model')
     def validate_model(cls, v):
         if v is None:
             return v
-        if v not in VALID_MODELS:
-            raise ValueError(f'Modelo deve ser um de: {VALID_MODELS}')
+        if v not in VALID_MODELS and v not in AUTO_MODELS:
+            raise ValueError(f'Modelo deve ser um de: {VALID_MODELS | AUTO_MODELS}')
         return v
 
 class PaginationParams(BaseModel):
@@ -39,14 +42,10 @@ class PaginationParams(BaseModel):
     limit: int = Field(default=50, ge=1, le=100)
 
 # ========== CUSTOM AI SCHEMAS ==========
-VALID_MODELS = {
-    'claude-opus-4-1', 
-    'claude-sonnet-4-5', 
-    'gemini-1.5-pro', 
-    'gemini-1.5-flash',
-    'gemini-3-pro-preview',
-    'llama-3.3-70b-versatile'
-}
+VALID_MODELS = set(MODEL_REGISTRY)
+
+# Roteamento automático para o modelo saudável mais rápido do tier (ver utils.llm_router)
+AUTO_MODELS = set(ROUTER_AUTO_MODELS)
 
 class CreateCustomAIRequest(BaseModel):
     tenant_id: str
@@ -56,6 +55,8 @@ class CreateCustomAIRequest(BaseModel):
     modelo: str = Field(default='claude-opus-4-1')
     temperatura: float = Field(default=0.7, ge=0, le=2.0)
     max_tokens: int = Field(default=2048, ge=256, le=4096)
+    # Com temperatura 0, mensagens idênticas simultâneas compartilham a chamada ao modelo
+    coalesce_requests: bool = Field(default=False)
 
     @validator('modelo')
     def validate_modelo(cls, v):
@@ -116,6 +117,39 @@ class AddUserByEmailRequest(BaseModel):
             raise ValueError(f'Role deve ser um de: {VALID_ROLES}')
         return v
 
+# ========== AI TEXT SCHEMAS ==========
+AI_OPERATIONS = {'improve-text', 'continue-writing', 'summarize', 'translate'}
+BATCH_MODES = {'sync', 'async'}
+
+class AIBatchItem(BaseModel):
+    text: str = Field(..., min_length=1, max_length=20000)
+    operation: Optional[str] = None
+    target_language: Optional[str] = Field(default=None, max_length=50)
+
+    @validator('operation')
+    def validate_operation(cls, v):
+        if v is not None and v not in AI_OPERATIONS:
+            raise ValueError(f'Operação deve ser uma de: {AI_OPERATIONS}')
+        return v
+
+class AIBatchRequest(BaseModel):
+    items: List[AIBatchItem] = Field(..., min_length=1, max_length=1000)
+    operation: Optional[str] = None
+    target_language: Optional[str] = Field(default=None, max_length=50)
+    mode: str = Field(default='sync')
+
+    @validator('operation')
+    def validate_operation(cls, v):
+        if v is not None and v not in AI_OPERATIONS:
+            raise ValueError(f'Operação deve ser uma de: {AI_OPERATIONS}')
+        return v
+
+    @validator('mode')
+    def validate_mode(cls, v):
+        if v not in BATCH_MODES:
+            raise ValueError(f'Modo deve ser um de: {BATCH_MODES}')
+        return v
+
 # ========== VISION SCHEMAS ==========
 class AnalyzeImageRequest(BaseModel):
     image_url: str = Field(..., min_length=10, max_length=2048)
@@ -1,32 +1,38 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, has_request_context
+from pydantic import ValidationError as PydanticValidationError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from utils.decorators import token_required, handle_exceptions
-from utils.claude_client import client
+from utils import llm_router
+from utils.cache import TTLCache
+from utils.sse import sse_event, sse_response
+from utils.cancellation import collect, client_disconnected
+from utils.claude_client import (
+    create_message_batch, cancel_message_batch, get_message_batch, message_batch_results
+)
+from config.supabase_config import supabase
 from models.quota_manager import QuotaManager
+from models.schemas import AIBatchRequest
+from models.exceptions import KairosException, ValidationError, NotFoundError, ClientDisconnectedError
+import hashlib
 import logging
+import os
+import re
 
 logger = logging.getLogger(__name__)
 
+# Modelo das operações de texto (aceita "auto" / "auto:<tier>")
+AI_TEXT_MODEL = os.getenv('AI_TEXT_MODEL', 'claude-sonnet-4-5')
+
+# Lotes: itens por requisição síncrona, chamadas simultâneas ao provedor e
+# modelo do modo assíncrono (Message Batches API, só Claude)
+AI_BATCH_MAX_ITEMS = int(os.getenv('AI_BATCH_MAX_ITEMS', '50'))
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', '4'))
+AI_BATCH_MODEL = os.getenv('AI_BATCH_MODEL', 'claude-sonnet-4-5')
+
 ai_bp = Blueprint('ai', __name__, url_prefix='/api/v1/ai')
 
-@ai_bp.route('/improve-text', methods=['POST'])
-@token_required
-@handle_exceptions
-def improve_text():
-    """Melhora o texto selecionado usando IA"""
-    data = request.json
-    text = data.get('text', '').strip()
-    
-    if not text:
-        return jsonify({'error': 'Texto é obrigatório'}), 400
-    
-    tenant_id = g.tenant_id
-    user_id = g.user_id
-    
-    # Verificar quota
-    QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
-    
-    try:
-        prompt = f"""Melhore o seguinte texto, tornando-o mais claro, conciso e profissional. 
+IMPROVE_PROMPT = """Melhore o seguinte texto, tornando-o mais claro, conciso e profissional.
 Mantenha o tom e o significado original, mas aprimore a escrita.
 
 Texto original:
@@ -34,85 +40,15 @@ Texto original:
 
 Texto melhorado:"""
 
-        response = client.messages.create(
-            model="claude-sonnet-4-5",
-            max_tokens=2048,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        improved_text = response.content[0].text
-        
-        # Registrar uso de quota
-        QuotaManager.log_usage(tenant_id, user_id, 'api_calls_per_day')
-        
-        return jsonify({'improved_text': improved_text}), 200
-        
-    except Exception as e:
-        logger.error(f'Error improving text: {str(e)}')
-        return jsonify({'error': 'Erro ao melhorar texto'}), 500
-
-@ai_bp.route('/continue-writing', methods=['POST'])
-@token_required
-@handle_exceptions
-def continue_writing():
-    """Continua escrevendo baseado no contexto"""
-    data = request.json
-    context = data.get('context', '').strip()
-    
-    if not context:
-        return jsonify({'error': 'Contexto é obrigatório'}), 400
-    
-    tenant_id = g.tenant_id
-    user_id = g.user_id
-    
-    # Verificar quota
-    QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
-    
-    try:
-        prompt = f"""Continue escrevendo o texto a seguir de forma natural e coerente. 
+CONTINUE_PROMPT = """Continue escrevendo o texto a seguir de forma natural e coerente.
 Escreva aproximadamente 2-3 parágrafos que deem continuidade ao conteúdo.
 
 Texto atual:
-{context}
+{text}
 
 Continuação:"""
 
-        response = client.messages.create(
-            model="claude-sonnet-4-5",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        continuation = response.content[0].text
-        
-        # Registrar uso de quota
-        QuotaManager.log_usage(tenant_id, user_id, 'api_calls_per_day')
-        
-        return jsonify({'continuation': continuation}), 200
-        
-    except Exception as e:
-        logger.error(f'Error continuing writing: {str(e)}')
-        return jsonify({'error': 'Erro ao continuar escrevendo'}), 500
-
-@ai_bp.route('/summarize', methods=['POST'])
-@token_required
-@handle_exceptions
-def summarize_text():
-    """Resume o texto selecionado"""
-    data = request.json
-    text = data.get('text', '').strip()
-    
-    if not text:
-        return jsonify({'error': 'Texto é obrigatório'}), 400
-    
-    tenant_id = g.tenant_id
-    user_id = g.user_id
-    
-    # Verificar quota
-    QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
-    
-    try:
-        prompt = f"""Crie um resumo conciso e objetivo do seguinte texto, 
+SUMMARIZE_PROMPT = """Crie um resumo conciso e objetivo do seguinte texto,
 mantendo os pontos principais e informações essenciais.
 
 Texto:
@@ -120,63 +56,518 @@ Texto:
 
 Resumo:"""
 
-        response = client.messages.create(
-            model="claude-sonnet-4-5",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
+TRANSLATE_PROMPT = """Traduza o seguinte texto para {target_language},
+mantendo o tom e o significado original.
+
+Texto original:
+{text}
+
+Tradução para {target_language}:"""
+
+# Operação -> campo de entrada, chave da resposta, prompt, max_tokens e mensagens de erro
+OPERATIONS = {
+    'improve-text': {
+        'field': 'text',
+        'result_key': 'improved_text',
+        'prompt': IMPROVE_PROMPT,
+        'max_tokens': 2048,
+        'required_error': 'Texto é obrigatório',
+        'error': 'Erro ao melhorar texto',
+        'log': 'Error improving text'
+    },
+    'continue-writing': {
+        'field': 'context',
+        'result_key': 'continuation',
+        'prompt': CONTINUE_PROMPT,
+        'max_tokens': 1024,
+        'required_error': 'Contexto é obrigatório',
+        'error': 'Erro ao continuar escrevendo',
+        'log': 'Error continuing writing'
+    },
+    'summarize': {
+        'field': 'text',
+        'result_key': 'summary',
+        'prompt': SUMMARIZE_PROMPT,
+        'max_tokens': 1024,
+        'required_error': 'Texto é obrigatório',
+        'error': 'Erro ao resumir texto',
+        'log': 'Error summarizing text'
+    },
+    'translate': {
+        'field': 'text',
+        'result_key': 'translation',
+        'prompt': TRANSLATE_PROMPT,
+        'max_tokens': 2048,
+        'required_error': 'Texto é obrigatório',
+        'error': 'Erro ao traduzir texto',
+        'log': 'Error translating text'
+    },
+}
+
+DEFAULT_TARGET_LANGUAGE = 'inglês'
+
+# Resultados por (namespace do tenant, operação, modelo, hash do texto normalizado).
+# Um acerto responde sem chamar o modelo e sem consumir `api_calls_per_day`.
+_result_cache = TTLCache(
+    maxsize=int(os.getenv('AI_CACHE_SIZE', '2048')),
+    ttl=int(os.getenv('AI_CACHE_TTL', '86400')),
+    name='ai_results'
+)
+
+_SPACES = re.compile(r'[ \t\f\v]+')
+
+def normalize_text(text):
+    """Remove diferenças de espaçamento que não mudam o resultado (quebras de linha são mantidas)"""
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(_SPACES.sub(' ', line).strip() for line in lines).strip()
+
+def _cache_namespace(tenant_id, user_id):
+    return f'tenant:{tenant_id}' if tenant_id else f'user:{user_id}'
+
+def _text_digest(text, target_language=None):
+    digest = hashlib.sha256()
+    digest.update(normalize_text(text).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((target_language or '').strip().casefold().encode('utf-8'))
+    return digest.hexdigest()
+
+def _cache_key(namespace, operation, model, text, target_language=None):
+    return (namespace, operation, model, _text_digest(text, target_language))
+
+def _text_model():
+    """Modelo concreto das operações de texto (AI_TEXT_MODEL pode ser "auto")"""
+    return llm_router.resolve_model(AI_TEXT_MODEL)
+
+def _stream_operation(operation, text, target_language, key, cached=None, tenant_id=None, user_id=None):
+    """
+    Eventos SSE da operação: start, trechos de texto e done (ou error)
+
+    Se o cliente desconectar, o gerador é fechado e o fechamento chega até a
+    requisição ao provedor, que para de gerar tokens. O resultado só vai para
+    o cache quando o stream termina. O modelo é o da chave (ver _cache_key).
+    """
+    spec = OPERATIONS[operation]
+    model = key[2]
+    yield sse_event({'operation': operation, 'model': model, 'cached': cached is not None}, event='start')
+    if cached is not None:
+        yield sse_event({'text': cached})
+        yield sse_event({spec['result_key']: cached, 'cached': True}, event='done')
+        return
+
+    parts = []
+    chunks = None
+    failed = False
+    try:
+        chunks = llm_router.stream(
+            [{"role": "user", "content": _prompt(operation, text, target_language)}],
+            model=model,
+            max_tokens=spec['max_tokens'],
+            plain=True
         )
-        
-        summary = response.content[0].text
-        
-        # Registrar uso de quota
-        QuotaManager.log_usage(tenant_id, user_id, 'api_calls_per_day')
-        
-        return jsonify({'summary': summary}), 200
-        
+        for chunk in chunks:
+            parts.append(chunk)
+            yield sse_event({'text': chunk})
     except Exception as e:
-        logger.error(f'Error summarizing text: {str(e)}')
-        return jsonify({'error': 'Erro ao resumir texto'}), 500
+        failed = True
+        logger.error(f"{spec['log']} (stream): {str(e)}")
+    finally:
+        if chunks is not None:
+            chunks.close()
+        # Registrar uso de quota (também quando o cliente desiste no meio)
+        if tenant_id and not failed:
+            QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id)
+
+    if failed:
+        yield sse_event({'error': spec['error'], 'code': 'STREAM_ERROR'}, event='error')
+        return
+
+    result = ''.join(parts)
+    if result:
+        _result_cache.set(key, result)
+    yield sse_event({spec['result_key']: result, 'cached': False}, event='done')
+
+def _parse_input(operation, data):
+    """Retorna (texto, idioma de destino) da requisição"""
+    spec = OPERATIONS[operation]
+    text = (data.get(spec['field']) or '').strip()
+    target_language = None
+    if operation == 'translate':
+        target_language = (data.get('target_language') or DEFAULT_TARGET_LANGUAGE).strip()
+    return text, target_language
+
+def _prompt(operation, text, target_language=None):
+    return OPERATIONS[operation]['prompt'].format(text=text, target_language=target_language)
+
+def _generate(operation, text, target_language, key, disconnected=client_disconnected):
+    """
+    Chama o modelo da chave (ver _cache_key) e guarda o resultado no cache. A
+    geração é interrompida (ClientDisconnectedError) se `disconnected()`
+    indicar que o cliente desistiu.
+    """
+    result = collect(llm_router.stream(
+        [{"role": "user", "content": _prompt(operation, text, target_language)}],
+        model=key[2],
+        max_tokens=OPERATIONS[operation]['max_tokens'],
+        plain=True
+    ), disconnected)
+    if result:
+        _result_cache.set(key, result)
+    return result
+
+def run_operation(operation, text, target_language=None, tenant_id=None, user_id=None):
+    """
+    Executa a operação de texto, usando o cache de resultados do tenant
+
+    Returns:
+        (resultado, cache_hit)
+
+    Raises:
+        QuotaExceededError se o texto não estiver em cache e a quota acabou
+    """
+    key = _cache_key(_cache_namespace(tenant_id, user_id), operation, _text_model(), text, target_language)
+    cached = _result_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    if tenant_id:
+        QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
+
+    try:
+        result = _generate(operation, text, target_language, key)
+    except ClientDisconnectedError:
+        # Os tokens gerados até o cancelamento também contam
+        if tenant_id:
+            QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id)
+        raise
+
+    # Registrar uso de quota
+    if tenant_id:
+        QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id)
+    return result, False
+
+def run_batch(items, tenant_id=None, user_id=None):
+    """
+    Executa vários itens (operation, text, target_language) com no máximo
+    AI_BATCH_CONCURRENCY chamadas simultâneas ao provedor.
+
+    Acertos de cache e itens repetidos no lote não são cobrados; a quota é
+    verificada e registrada uma vez, pela quantidade de itens gerados.
+
+    Returns:
+        (resultados na ordem dos itens, itens cobrados)
+    """
+    namespace = _cache_namespace(tenant_id, user_id)
+    model = _text_model()
+    keys = [_cache_key(namespace, op, model, text, lang) for op, text, lang in items]
+    results = [None] * len(items)
+
+    # Uma chamada por chave distinta que não está em cache
+    pending = {}
+    for index, key in enumerate(keys):
+        if key in pending:
+            pending[key].append(index)
+            continue
+        cached = _result_cache.get(key)
+        if cached is not None:
+            results[index] = {'result': cached, 'cached': True}
+        else:
+            pending[key] = [index]
+
+    if pending and tenant_id:
+        QuotaManager.check_quota(tenant_id, 'api_calls_per_day', amount=len(pending))
+
+    # As threads do pool não têm o contexto da requisição: o socket é verificado pelo environ
+    environ = request.environ if has_request_context() else None
+    disconnected = (lambda: client_disconnected(environ)) if environ else None
+
+    def work(key):
+        operation, text, target_language = items[pending[key][0]]
+        try:
+            if disconnected and disconnected():
+                raise ClientDisconnectedError()
+            return {'result': _generate(operation, text, target_language, key, disconnected), 'cached': False}
+        except ClientDisconnectedError:
+            return {'error': 'Cliente encerrou a requisição', 'cancelled': True, 'cached': False}
+        except Exception as e:
+            logger.error(f"{OPERATIONS[operation]['log']} (batch): {str(e)}")
+            return {'error': OPERATIONS[operation]['error'], 'cached': False}
+
+    charged = 0
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(len(pending), AI_BATCH_CONCURRENCY)) as pool:
+            outcomes = list(pool.map(work, list(pending)))
+        for key, outcome in zip(pending, outcomes):
+            charged += 1 if 'result' in outcome else 0
+            for index in pending[key]:
+                results[index] = dict(outcome)
+
+    if charged and tenant_id:
+        QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id, amount=charged)
+    return results, charged
+
+def submit_async_batch(items, tenant_id=None, user_id=None):
+    """
+    Envia os itens que não estão em cache para a Message Batches API e grava
+    o lote em `ai_batches`. A quota é cobrada no envio, pelos itens enviados.
+
+    A linha é criada antes do lote no provedor (status `submitting`), para
+    que um lote criado na Anthropic sempre tenha registro; se a linha não
+    puder ser atualizada, o lote é cancelado e nada é cobrado.
+
+    Returns:
+        Linha criada em `ai_batches`
+    """
+    namespace = _cache_namespace(tenant_id, user_id)
+    entries = []
+    requests = []
+    for index, (operation, text, target_language) in enumerate(items):
+        digest = _text_digest(text, target_language)
+        entry = {'operation': operation, 'digest': digest}
+        cached = _result_cache.get((namespace, operation, AI_BATCH_MODEL, digest))
+        if cached is not None:
+            entry.update(result=cached, cached=True)
+        else:
+            requests.append({
+                'custom_id': str(index),
+                'params': {
+                    'model': AI_BATCH_MODEL,
+                    'max_tokens': OPERATIONS[operation]['max_tokens'],
+                    'messages': [{'role': 'user', 'content': _prompt(operation, text, target_language)}]
+                }
+            })
+        entries.append(entry)
+
+    if requests and tenant_id:
+        QuotaManager.check_quota(tenant_id, 'api_calls_per_day', amount=len(requests))
+
+    now = datetime.now(timezone.utc).isoformat()
+    row = supabase.table('ai_batches').insert({
+        'tenant_id': tenant_id,
+        'user_id': user_id,
+        'provider_batch_id': None,
+        'model': AI_BATCH_MODEL,
+        'items': entries,
+        'status': 'submitting' if requests else 'ended',
+        'completed_at': None if requests else now
+    }).execute().data[0]
+    if not requests:
+        return row
+
+    try:
+        provider_batch_id = create_message_batch(requests)
+    except Exception:
+        _discard_batch_row(row['id'])
+        raise
+
+    updates = {'provider_batch_id': provider_batch_id, 'status': 'processing'}
+    try:
+        supabase.table('ai_batches').update(updates).eq('id', row['id']).execute()
+    except Exception:
+        # Sem o id do provedor na linha o resultado nunca seria lido
+        logger.error(f"Failed to record provider batch {provider_batch_id}, canceling it")
+        try:
+            cancel_message_batch(provider_batch_id)
+        except Exception as e:
+            logger.error(f"Error canceling provider batch {provider_batch_id}: {str(e)}")
+        _discard_batch_row(row['id'])
+        raise
+
+    if tenant_id:
+        QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id, amount=len(requests))
+    return dict(row, **updates)
+
+def _discard_batch_row(batch_id):
+    try:
+        supabase.table('ai_batches').delete().eq('id', batch_id).execute()
+    except Exception as e:
+        logger.error(f"Error removing batch {batch_id}: {str(e)}")
+
+def refresh_async_batch(row):
+    """
+    Consulta a Anthropic e, se o lote terminou, grava os resultados (e os
+    coloca no cache do tenant)
+
+    Returns:
+        (linha atualizada, contagens do provedor ou None)
+    """
+    # `submitting`: o lote ainda está sendo criado no provedor
+    if row.get('status') in ('ended', 'submitting') or not row.get('provider_batch_id'):
+        return row, None
+
+    info = get_message_batch(row['provider_batch_id'])
+    if info['status'] != 'ended':
+        return row, info['counts']
+
+    outcomes = message_batch_results(row['provider_batch_id'])
+    namespace = _cache_namespace(row.get('tenant_id'), row.get('user_id'))
+    entries = [dict(entry) for entry in row.get('items') or []]
+    for index, entry in enumerate(entries):
+        if 'result' in entry:
+            continue
+        text, error = outcomes.get(str(index), (None, 'missing'))
+        if text:
+            entry.update(result=text, cached=False)
+            _result_cache.set((namespace, entry['operation'], row['model'], entry['digest']), text)
+        else:
+            logger.warning(f"Batch item {index} of {row['id']} failed: {error}")
+            entry.update(error=OPERATIONS[entry['operation']]['error'], cached=False)
+
+    updates = {
+        'items': entries,
+        'status': 'ended',
+        'completed_at': datetime.now(timezone.utc).isoformat()
+    }
+    supabase.table('ai_batches').update(updates).eq('id', row['id']).execute()
+    return dict(row, **updates), info['counts']
+
+def _batch_items(data):
+    """Lista de (operation, text, target_language) com os padrões do lote aplicados"""
+    items = []
+    for index, item in enumerate(data.items):
+        operation = item.operation or data.operation
+        if not operation:
+            raise ValidationError(f'Operação é obrigatória (item {index})')
+        target_language = None
+        if operation == 'translate':
+            target_language = (item.target_language or data.target_language or DEFAULT_TARGET_LANGUAGE).strip()
+        text = item.text.strip()
+        if not text:
+            raise ValidationError(f'Texto é obrigatório (item {index})')
+        items.append((operation, text, target_language))
+    return items
+
+def _item_response(index, operation, outcome):
+    item = {'index': index, 'operation': operation}
+    item.update({k: v for k, v in outcome.items() if k in ('result', 'error', 'cached')})
+    return item
+
+def _batch_response(row, counts=None):
+    body = {
+        'id': row['id'],
+        'mode': 'async',
+        'status': row['status'],
+        'created_at': row.get('created_at'),
+        'completed_at': row.get('completed_at')
+    }
+    if counts is not None:
+        body['counts'] = counts
+    if row['status'] == 'ended':
+        body['results'] = [
+            _item_response(index, entry['operation'], entry)
+            for index, entry in enumerate(row.get('items') or [])
+        ]
+    return body
+
+def _handle(operation):
+    spec = OPERATIONS[operation]
+    data = request.json or {}
+    text, target_language = _parse_input(operation, data)
+
+    if not text:
+        return jsonify({'error': spec['required_error']}), 400
+
+    tenant_id = getattr(g, 'tenant_id', None)
+    user_id = g.user_id
+
+    # Modo streaming (SSE): o texto aparece no editor conforme é gerado
+    if data.get('stream'):
+        key = _cache_key(_cache_namespace(tenant_id, user_id), operation, _text_model(), text, target_language)
+        cached = _result_cache.get(key)
+        if tenant_id and cached is None:
+            QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
+        response = sse_response(_stream_operation(operation, text, target_language, key, cached, tenant_id, user_id))
+        response.headers['X-Cache'] = 'MISS' if cached is None else 'HIT'
+        return response
+
+    try:
+        result, cache_hit = run_operation(operation, text, target_language, tenant_id, user_id)
+    except KairosException:
+        # Quota excedida etc. seguem para o handle_exceptions
+        raise
+    except Exception as e:
+        logger.error(f"{spec['log']}: {str(e)}")
+        return jsonify({'error': spec['error']}), 500
+
+    return jsonify({spec['result_key']: result}), 200, {'X-Cache': 'HIT' if cache_hit else 'MISS'}
+
+@ai_bp.route('/improve-text', methods=['POST'])
+@token_required
+@handle_exceptions
+def improve_text():
+    """Melhora o texto selecionado usando IA"""
+    return _handle('improve-text')
+
+@ai_bp.route('/continue-writing', methods=['POST'])
+@token_required
+@handle_exceptions
+def continue_writing():
+    """Continua escrevendo baseado no contexto"""
+    return _handle('continue-writing')
+
+@ai_bp.route('/summarize', methods=['POST'])
+@token_required
+@handle_exceptions
+def summarize_text():
+    """Resume o texto selecionado"""
+    return _handle('summarize')
 
 @ai_bp.route('/translate', methods=['POST'])
 @token_required
 @handle_exceptions
 def translate_text():
     """Traduz o texto para outro idioma"""
-    data = request.json
-    text = data.get('text', '').strip()
-    target_language = data.get('target_language', 'inglês').strip()
-    
-    if not text:
-        return jsonify({'error': 'Texto é obrigatório'}), 400
-    
-    tenant_id = g.tenant_id
-    user_id = g.user_id
-    
-    # Verificar quota
-    QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
-    
+    return _handle('translate')
+
+@ai_bp.route('/batch', methods=['POST'])
+@token_required
+@handle_exceptions
+def batch():
+    """
+    Executa várias operações de texto em uma requisição
+
+    mode=sync: executa na hora (até AI_BATCH_MAX_ITEMS itens) e devolve os
+    resultados na ordem dos itens. mode=async: envia para a Message Batches
+    API e devolve o id do lote para consulta em GET /batch/<id>.
+    """
     try:
-        prompt = f"""Traduza o seguinte texto para {target_language}, 
-mantendo o tom e o significado original.
+        data = AIBatchRequest(**(request.json or {}))
+    except PydanticValidationError as e:
+        raise ValidationError('Validação falhou', details=e.errors())
 
-Texto original:
-{text}
+    items = _batch_items(data)
+    tenant_id = getattr(g, 'tenant_id', None)
+    user_id = g.user_id
 
-Tradução para {target_language}:"""
+    if data.mode == 'async':
+        row = submit_async_batch(items, tenant_id, user_id)
+        return jsonify(_batch_response(row)), 202
 
-        response = client.messages.create(
-            model="claude-sonnet-4-5",
-            max_tokens=2048,
-            messages=[{"role": "user", "content": prompt}]
+    if len(items) > AI_BATCH_MAX_ITEMS:
+        raise ValidationError(
+            f'Lotes síncronos aceitam até {AI_BATCH_MAX_ITEMS} itens; use mode=async para lotes maiores'
         )
-        
-        translation = response.content[0].text
-        
-        # Registrar uso de quota
-        QuotaManager.log_usage(tenant_id, user_id, 'api_calls_per_day')
-        
-        return jsonify({'translation': translation}), 200
-        
-    except Exception as e:
-        logger.error(f'Error translating text: {str(e)}')
-        return jsonify({'error': 'Erro ao traduzir texto'}), 500
+
+    results, charged = run_batch(items, tenant_id, user_id)
+    return jsonify({
+        'mode': 'sync',
+        'results': [_item_response(i, items[i][0], outcome) for i, outcome in enumerate(results)],
+        'charged': charged
+    }), 200
+
+@ai_bp.route('/batch/<batch_id>', methods=['GET'])
+@token_required
+@handle_exceptions
+def get_batch(batch_id):
+    """Estado e (quando encerrado) resultados de um lote assíncrono"""
+    tenant_id = getattr(g, 'tenant_id', None)
+    query = supabase.table('ai_batches').select('*').eq('id', batch_id)
+    query = query.eq('tenant_id', tenant_id) if tenant_id else query.eq('user_id', g.user_id)
+    res = query.limit(1).execute()
+    if not res.data:
+        raise NotFoundError('Lote')
+
+    row, counts = refresh_async_batch(res.data[0])
+    return jsonify(_batch_response(row, counts)), 200
+
+def ai_cache_stats():
+    return _result_cache.stats()
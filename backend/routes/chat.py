@@ -8,32 +8,210 @@ from utils.decorators import (
     require_tenant_membership
 )
 from utils.auth_utils import user_role_in_tenant
-from utils.claude_client import get_claude_response
-from utils.groq_client import get_groq_response
-from utils.google_client import get_google_response
-from models.schemas import VALID_MODELS
 from models.schemas import SendMessageRequest, PaginationParams
 from models.exceptions import (
     NotFoundError,
     AuthorizationError,
     ValidationError,
-    QuotaExceededError
+    QuotaExceededError,
+    ClientDisconnectedError
 )
 from models.quota_manager import QuotaManager
 from utils.summary_generator import generate_conversation_title
+from utils.sse import sse_event, sse_response
+from utils.background import background_tasks
+from utils.write_behind import write_behind
+from utils.conversation_history import load_history, append_history, invalidate_history
+from utils import llm_router
+from utils.memory_store import memory_namespace
+from utils.cache import TTLCache
+from utils.timing import StepTimer
+from utils.parallel import run_parallel, submit
+from utils.cancellation import collect
+from utils.pagination import (
+    encode_cursor,
+    decode_cursor,
+    keyset_filter,
+    parse_bool_arg,
+    fetch_message_window,
+    message_window_args
+)
+from datetime import datetime, timezone
 import logging
-import threading
+import os
 
 logger = logging.getLogger(__name__)
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/api/v1/chat')
 
+def _update_title(conversation_id, messages):
+    """Gera e salva o título da conversa (executado no pool de background)"""
+    try:
+        new_title = generate_conversation_title(messages)
+        if new_title:
+            supabase.table('conversations') \
+                .update({'titulo': new_title}) \
+                .eq('id', conversation_id) \
+                .execute()
+    except Exception as e:
+        logger.error(f"Erro ao atualizar título: {e}")
+
+def _check_conversation_owner(conversation_id, user_id):
+    """Garante que a conversa existe e pertence ao usuário"""
+    conv = supabase.table('conversations') \
+        .select('id, user_id') \
+        .eq('id', conversation_id) \
+        .limit(1) \
+        .execute()
+    if not conv.data:
+        raise NotFoundError('Conversa')
+    if str(conv.data[0]['user_id']) != str(user_id):
+        raise AuthorizationError()
+
+def _finalize_exchange(conversation_id, tenant_id, user_id, messages_history):
+    """Trabalho pós-resposta: timestamp da conversa, quota e título"""
+    # Atualizar conversa (gravado em lote pelo write-behind)
+    write_behind.touch('conversations', conversation_id)
+
+    # Logar uso da API
+    if tenant_id:
+        logger.info(f"Logging API usage for tenant {tenant_id}")
+        QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id)
+
+    # Gerar título em background se for nova conversa ou tiver poucas mensagens
+    if len(messages_history) <= 2:
+        background_tasks.submit(
+            _update_title, conversation_id, list(messages_history),
+            key=('conversation_title', conversation_id)
+        )
+
+def _cancelled_row(conversation_id, partial):
+    """Resposta parcial de uma geração interrompida pelo cliente (None se nada foi gerado)"""
+    if not partial:
+        return None
+    return {
+        'conversation_id': conversation_id,
+        'role': 'assistant',
+        'content': partial,
+        'status': 'cancelled',
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+
+def _persist_cancelled(conversation_id, tenant_id, user_id, rows, saved_rows=None):
+    """
+    Grava o turno interrompido porque o cliente desconectou (mensagem do
+    usuário e resposta parcial com status 'cancelled'). O provedor já foi
+    interrompido; a quota é registrada porque os tokens gerados são cobrados.
+    """
+    saved = list(saved_rows or [])
+    try:
+        if rows:
+            saved += supabase.table('messages').insert(rows).execute().data or []
+        append_history(conversation_id, saved)
+        write_behind.touch('conversations', conversation_id)
+        if tenant_id:
+            QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id)
+    except Exception as e:
+        logger.error(f'Error persisting cancelled message: {str(e)}', extra={
+            'conversation_id': conversation_id,
+            'user_id': user_id
+        })
+    logger.info('Message cancelled by client', extra={
+        'conversation_id': conversation_id,
+        'user_id': user_id
+    })
+
+def _stream_message(conversation_id, tenant_id, user_id, model, user_message, messages_history, summary_id=None):
+    """
+    Gera os eventos SSE da resposta do modelo.
+
+    A mensagem do usuário e a resposta final são persistidas em `messages`
+    quando o stream termina, com timestamps explícitos para manter a ordem.
+    """
+    user_row = {
+        'conversation_id': conversation_id,
+        'role': 'user',
+        'content': user_message,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+
+    yield sse_event({'conversation_id': conversation_id, 'tenant_id': tenant_id, 'model': model}, event='start')
+
+    parts = []
+    chunks = None
+    served = {}
+    try:
+        context = llm_router.prepare_context(messages_history, model, summary_id)
+        chunks = llm_router.stream(context, model=model, memory_namespace=memory_namespace(tenant_id, user_id),
+                                   served=served)
+        for text in chunks:
+            parts.append(text)
+            yield sse_event({'text': text})
+    except GeneratorExit:
+        # Cliente desconectou: encerra a requisição ao provedor e grava o que foi gerado
+        if chunks is not None:
+            chunks.close()
+        partial = _cancelled_row(conversation_id, ''.join(parts))
+        # Insert em lote exige as mesmas colunas em todas as linhas
+        rows = [dict(user_row, status='complete')] + ([partial] if partial else [])
+        _persist_cancelled(conversation_id, tenant_id, user_id, rows)
+        raise
+    except Exception as e:
+        logger.error(f'Error streaming message: {str(e)}', extra={
+            'conversation_id': conversation_id,
+            'user_id': user_id
+        })
+        try:
+            supabase.table('messages').insert(user_row).execute()
+        except Exception as save_error:
+            logger.error(f'Error saving user message: {str(save_error)}')
+        yield sse_event({'error': 'Erro ao gerar resposta', 'code': 'STREAM_ERROR'}, event='error')
+        return
+
+    assistant_message = ''.join(parts)
+    messages_history.append({
+        "role": "assistant",
+        "content": assistant_message
+    })
+
+    try:
+        saved = supabase.table('messages').insert([
+            user_row,
+            {
+                'conversation_id': conversation_id,
+                'role': 'assistant',
+                'content': assistant_message,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }
+        ]).execute()
+        append_history(conversation_id, saved.data)
+        _finalize_exchange(conversation_id, tenant_id, user_id, messages_history)
+    except Exception as e:
+        logger.error(f'Error persisting streamed message: {str(e)}', extra={
+            'conversation_id': conversation_id,
+            'user_id': user_id
+        })
+        yield sse_event({'error': 'Erro ao salvar resposta', 'code': 'PERSIST_ERROR'}, event='error')
+        return
+
+    logger.info('Message streamed', extra={
+        'conversation_id': conversation_id,
+        'user_id': user_id
+    })
+
+    yield sse_event({
+        'message': assistant_message,
+        'conversation_id': conversation_id,
+        'tenant_id': tenant_id,
+        'model': served.get('model', model)
+    }, event='done')
+
 @chat_bp.route('/message', methods=['POST'])
 @token_required
 @require_json
 @handle_exceptions
 def send_message():
-    """Envia mensagem e obtém resposta da IA"""
+    """Envia mensagem e obtém resposta da IA (JSON ou SSE com stream=true)"""
     try:
         data = SendMessageRequest(**request.json)
     except PydanticValidationError as e:
@@ -44,25 +222,36 @@ def send_message():
         tenant_id = getattr(g, 'tenant_id', None)
         user_id = g.user_id
         message = data.message
-        model = data.model
-
-        # Validar quota se tenant estiver definido
-        if tenant_id:
-            QuotaManager.check_quota(tenant_id, 'api_calls_per_day')
+        # "auto" vira o modelo concreto (o orçamento de contexto depende dele)
+        model = llm_router.resolve_model(data.model)
 
-        messages_history = data.messages or []
+        conversation_id = data.conversation_id
+        timer = StepTimer()
+
+        def load_server_history():
+            _check_conversation_owner(conversation_id, user_id)
+            return load_history(conversation_id)
+
+        # Etapas independentes em paralelo: quotas (se tenant estiver definido)
+        # e histórico reconstruído no servidor (server_history)
+        quota_api = timer.timed('quota', QuotaManager.check_quota, tenant_id, 'api_calls_per_day') \
+            if tenant_id else None
+        quota_conversations = timer.timed('quota_conversations', QuotaManager.check_quota, tenant_id, 'conversations') \
+            if tenant_id and not conversation_id else None
+        server_history = timer.timed('history', load_server_history) \
+            if data.server_history and conversation_id else None
+        with timer.step('prepare'):
+            _, loaded_history, _ = run_parallel([quota_api, server_history, quota_conversations])
+
+        # Histórico: reconstruído no servidor (server_history) ou enviado pelo cliente
+        messages_history = loaded_history if server_history else (data.messages or [])
         messages_history.append({
             "role": "user",
             "content": data.message
         })
 
         # Criar conversa se necessário
-        conversation_id = data.conversation_id
         if not conversation_id:
-            # Verificar quota de conversas antes de criar
-            if tenant_id:
-                QuotaManager.check_quota(tenant_id, 'conversations')
-            
             # Gerar título inicial
             title = message[:50] + "..."
             
@@ -72,34 +261,55 @@ def send_message():
                 'tenant_id': tenant_id  # Associar ao tenant atual
             }
             
-            conv_res = supabase.table('conversations').insert(conv_data).execute()
+            with timer.step('conversation'):
+                conv_res = supabase.table('conversations').insert(conv_data).execute()
             
             if not conv_res.data:
                 raise Exception('Erro ao criar conversa')
 
             conversation_id = conv_res.data[0]['id']
+            invalidate_conversation_count(user_id, tenant_id)
             
             # Logar criação de conversa na quota
             if tenant_id:
                 QuotaManager.log_usage(tenant_id, 'conversations', user_id)
 
-
-        # Salvar mensagem do usuário
-        supabase.table('messages').insert({
+        # Resumo das mensagens antigas só com histórico do servidor: o resumo
+        # salvo cobre as N primeiras mensagens, e um histórico enviado pelo
+        # cliente pode ter sido editado ou truncado
+        summary_id = conversation_id if server_history else None
+
+        # Modo streaming: tokens são enviados conforme chegam do provedor
+        if data.stream:
+            response = sse_response(_stream_message(
+                conversation_id, tenant_id, user_id, model, message, messages_history, summary_id
+            ))
+            response.headers['Server-Timing'] = timer.server_timing()
+            return response
+
+        # Salvar mensagem do usuário enquanto o modelo gera a resposta
+        user_insert = submit(timer.timed('user_insert', supabase.table('messages').insert({
             'conversation_id': conversation_id,
             'role': 'user',
             'content': data.message
-        }).execute()
+        }).execute))
 
         # Obter resposta do modelo
-        # Roteamento correto: Gemini -> Google, Llama -> Groq, Claude -> Anthropic
-        if data.model and 'gemini' in data.model:
-            claude_response = get_google_response(messages_history, model=data.model)
-        elif data.model and 'llama' in data.model:
-            claude_response = get_groq_response(messages_history, model=data.model)
-        else:
-            # Claude models (opus, sonnet)
-            claude_response = get_claude_response(messages_history, model=data.model)
+        served = {}
+        with timer.step('context'):
+            context = llm_router.prepare_context(messages_history, model, summary_id)
+        with timer.step('llm'):
+            try:
+                # Em stream internamente, para interromper o provedor se o cliente desistir
+                claude_response = collect(llm_router.stream(
+                    context, model=model, memory_namespace=memory_namespace(tenant_id, user_id), served=served
+                ))
+            except ClientDisconnectedError as e:
+                partial = _cancelled_row(conversation_id, e.partial)
+                _persist_cancelled(conversation_id, tenant_id, user_id, [partial] if partial else [],
+                                   saved_rows=user_insert.result().data)
+                raise
+        user_res = user_insert.result()
 
         # Adicionar ao histórico
         messages_history.append({
@@ -108,51 +318,35 @@ def send_message():
         })
 
         # Salvar resposta
-        supabase.table('messages').insert({
-            'conversation_id': conversation_id,
-            'role': 'assistant',
-            'content': claude_response
-        }).execute()
+        with timer.step('assistant_insert'):
+            assistant_res = supabase.table('messages').insert({
+                'conversation_id': conversation_id,
+                'role': 'assistant',
+                'content': claude_response
+            }).execute()
+        append_history(conversation_id, (user_res.data or []) + (assistant_res.data or []))
 
-        # Atualizar conversa
-        supabase.table('conversations') \
-            .update({'updated_at': 'now()'}) \
-            .eq('id', conversation_id) \
-            .execute()
-
-        # Logar uso da API
-        if tenant_id:
-            logger.info(f"Logging API usage for tenant {tenant_id}")
-            QuotaManager.log_usage(tenant_id, 'api_calls_per_day', g.user_id)
-
-        # Gerar título assincronamente se for nova conversa ou tiver poucas mensagens
-        if len(messages_history) <= 2:
-            def update_title(conv_id, msgs):
-                try:
-                    new_title = generate_conversation_title(msgs)
-                    if new_title:
-                        supabase.table('conversations') \
-                            .update({'titulo': new_title}) \
-                            .eq('id', conv_id) \
-                            .execute()
-                except Exception as e:
-                    logger.error(f"Erro ao atualizar título: {e}")
-
-            threading.Thread(target=update_title, args=(conversation_id, messages_history)).start()
+        _finalize_exchange(conversation_id, tenant_id, user_id, messages_history)
 
         logger.info('Message processed', extra={
             'conversation_id': conversation_id,
-            'user_id': g.user_id
+            'user_id': g.user_id,
+            'timing_ms': timer.as_dict()
         })
 
-        return jsonify({
+        response = {
             'message': claude_response,
             'conversation_id': conversation_id,
             'tenant_id': tenant_id,
-            'messages': messages_history
-        }), 200
+            'model': served.get('model', model)
+        }
+        # Com server_history só o novo turno volta ao cliente
+        if not data.server_history:
+            response['messages'] = messages_history
 
-    except (ValidationError, AuthorizationError, QuotaExceededError):
+        return jsonify(response), 200, {'Server-Timing': timer.server_timing()}
+
+    except (ValidationError, AuthorizationError, NotFoundError, QuotaExceededError, ClientDisconnectedError):
         raise
     except Exception as e:
         logger.error(f'Error in send_message: {str(e)}', extra={
@@ -160,16 +354,51 @@ def send_message():
         })
         raise
 
+# Total de conversas por (user_id, tenant_id), para não repetir o count='exact'
+_conversation_counts = TTLCache(
+    maxsize=4096,
+    ttl=int(os.getenv('CONVERSATION_COUNT_TTL', '30')),
+    name='conversation_counts'
+)
+
+def invalidate_conversation_count(user_id, tenant_id):
+    # A listagem sem X-Tenant-ID conta todas as conversas do usuário
+    _conversation_counts.invalidate((str(user_id), str(tenant_id)))
+    _conversation_counts.invalidate((str(user_id), str(None)))
+
+def _count_conversations(user_id, tenant_id):
+    key = (str(user_id), str(tenant_id))
+    total = _conversation_counts.get(key)
+    if total is not None:
+        return total
+    query = supabase.table('conversations') \
+        .select('id', count='exact', head=True) \
+        .eq('user_id', user_id)
+    if tenant_id:
+        query = query.eq('tenant_id', tenant_id)
+    total = query.execute().count or 0
+    _conversation_counts.set(key, total)
+    return total
+
 @chat_bp.route('/conversations', methods=['GET'])
 @token_required
 @handle_exceptions
 def list_conversations():
-    """Lista conversas do usuário com paginação"""
+    """
+    Lista conversas do usuário com paginação.
+
+    Modo offset (padrão): `offset` e `limit`, com `total` incluído.
+    Modo keyset: `cursor` (recebido em `next_cursor`) ou `pagination=cursor`
+    para a primeira página; `include_total=true` para obter o total.
+    """
     try:
         logger.info(f"list_conversations called by user_id: {g.user_id}, tenant_id: {getattr(g, 'tenant_id', None)}")
         
         offset = request.args.get('offset', 0, type=int)
         limit = request.args.get('limit', 50, type=int)
+        cursor = request.args.get('cursor')
+        keyset_mode = bool(cursor) or request.args.get('pagination') == 'cursor'
+        include_total = parse_bool_arg(request.args.get('include_total'), default=not keyset_mode)
         
         # Validar ranges
         offset = max(0, offset)
@@ -178,42 +407,66 @@ def list_conversations():
         user_id = g.user_id
         tenant_id = getattr(g, 'tenant_id', None)
 
-        # Base query
+        # Uma única query: count='exact' só quando o total não está em cache
+        cached_total = _conversation_counts.get((str(user_id), str(tenant_id))) if include_total else None
+        count_mode = 'exact' if include_total and cached_total is None and not keyset_mode else None
+
         query = supabase.table('conversations') \
-            .select('id, titulo, created_at, updated_at', count='exact') \
+            .select('id, titulo, created_at, updated_at', count=count_mode) \
             .eq('user_id', user_id)
-            
+
         # Apply tenant_id filter if present
         if tenant_id:
             query = query.eq('tenant_id', tenant_id)
-            
-        # Execute count query
-        total_res = query.execute()
-        total_count = total_res.count
 
-        # Execute data query with pagination
-        convs_query = supabase.table('conversations') \
-            .select('id, titulo, created_at, updated_at') \
-            .eq('user_id', user_id)
-        
-        if tenant_id:
-            convs_query = convs_query.eq('tenant_id', tenant_id)
+        if cursor:
+            position = decode_cursor(cursor)
+            query = query.or_(keyset_filter('updated_at', position.get('u'), position.get('i'), desc=True))
 
-        convs = convs_query \
+        query = query \
             .order('updated_at', desc=True) \
-            .range(offset, offset + limit - 1) \
-            .execute()
-            
+            .order('id', desc=True)
+
+        # Busca um item a mais para saber se há próxima página
+        if keyset_mode:
+            convs = query.limit(limit + 1).execute()
+        else:
+            convs = query.range(offset, offset + limit).execute()
+
+        rows = convs.data or []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        total_count = None
+        if include_total:
+            if count_mode:
+                # O total veio na mesma resposta da página
+                total_count = convs.count
+                _conversation_counts.set((str(user_id), str(tenant_id)), total_count)
+            else:
+                total_count = cached_total if cached_total is not None else _count_conversations(user_id, tenant_id)
+
+        next_cursor = None
+        if has_more and rows:
+            last = rows[-1]
+            next_cursor = encode_cursor({'u': last.get('updated_at'), 'i': last.get('id')})
+
+        pagination = {
+            'limit': limit,
+            'total': total_count,
+            'has_more': has_more,
+            'next_cursor': next_cursor
+        }
+        if not keyset_mode:
+            pagination['offset'] = offset
+
         return jsonify({
-            'conversations': convs.data or [],
-            'pagination': {
-                'offset': offset,
-                'limit': limit,
-                'total': total_count,
-                'has_more': (offset + limit) < (total_count or 0)
-            }
+            'conversations': rows,
+            'pagination': pagination
         }), 200
 
+    except ValidationError:
+        raise
     except Exception as e:
         logger.error(f'Error listing conversations: {str(e)}')
         raise
@@ -222,7 +475,12 @@ def list_conversations():
 @token_required
 @handle_exceptions
 def get_conversation(conversation_id):
-    """Obtém conversa específica com mensagens"""
+    """
+    Obtém conversa específica com mensagens.
+
+    Query params opcionais: `limit` (últimas N), `before` (cursor para
+    mensagens mais antigas) e `after` (id ou timestamp; só as novas).
+    """
     try:
         conv = supabase.table('conversations') \
             .select('id, tenant_id, user_id, titulo, created_at, updated_at') \
@@ -241,19 +499,24 @@ def get_conversation(conversation_id):
             if role not in ('admin', 'owner'):
                 raise AuthorizationError()
 
-        # Buscar mensagens
-        msgs = supabase.table('messages') \
-            .select('id, role, content, image_url, created_at') \
-            .eq('conversation_id', conversation_id) \
-            .order('created_at', desc=False) \
-            .execute()
+        # Buscar mensagens (todas, ou em janelas com limit/before/after)
+        messages, pagination = fetch_message_window(
+            'messages',
+            conversation_id,
+            'id, role, content, image_url, created_at',
+            **message_window_args(request.args)
+        )
 
-        return jsonify({
+        response = {
             'conversation': conversation,
-            'messages': msgs.data or []
-        }), 200
+            'messages': messages
+        }
+        if pagination is not None:
+            response['pagination'] = pagination
 
-    except (NotFoundError, AuthorizationError):
+        return jsonify(response), 200
+
+    except (NotFoundError, AuthorizationError, ValidationError):
         raise
     except Exception as e:
         logger.error(f'Error getting conversation: {str(e)}')
@@ -292,6 +555,8 @@ def delete_conversation(conversation_id):
             .delete() \
             .eq('id', conversation_id) \
             .execute()
+        invalidate_conversation_count(conversation['user_id'], conversation['tenant_id'])
+        invalidate_history(conversation_id)
 
         logger.info('Conversation deleted', extra={
             'conversation_id': conversation_id,
@@ -7,17 +7,21 @@ from utils.decorators import (
     handle_exceptions,
     require_tenant_membership
 )
-from utils.claude_client import get_claude_response
-from utils.groq_client import get_groq_response
-from models.schemas import VALID_MODELS
+from utils import llm_router
+from utils.memory_store import memory_namespace
 from models.schemas import CreateCustomAIRequest
 from models.exceptions import (
     NotFoundError,
     AuthorizationError,
     ValidationError,
-    QuotaExceededError
+    QuotaExceededError,
+    ClientDisconnectedError
 )
 from models.quota_manager import QuotaManager
+from utils.pagination import fetch_message_window, message_window_args
+from utils.sse import sse_event, sse_response
+from utils.cancellation import collect
+from utils.custom_ai_config import get_conversation_with_config, invalidate_custom_ai
 import logging
 
 logger = logging.getLogger(__name__)
@@ -60,6 +64,7 @@ def create_custom_ai():
             'modelo': data.modelo,
             'temperatura': data.temperatura,
             'max_tokens': data.max_tokens,
+            'coalesce_requests': data.coalesce_requests,
             'ativo': True
         }).execute()
 
@@ -138,7 +143,7 @@ def update_custom_ai(custom_ai_id):
             raise AuthorizationError()
 
         # Campos permitidos para atualização
-        allowed_fields = ['nome', 'descricao', 'sistema_prompt', 'modelo', 'temperatura', 'max_tokens', 'ativo']
+        allowed_fields = ['nome', 'descricao', 'sistema_prompt', 'modelo', 'temperatura', 'max_tokens', 'ativo', 'coalesce_requests']
         update_data = {k: v for k, v in data.items() if k in allowed_fields}
         
         if not update_data:
@@ -152,6 +157,8 @@ def update_custom_ai(custom_ai_id):
             
         if not updated.data:
             raise Exception('Erro ao atualizar IA personalizada')
+
+        invalidate_custom_ai(custom_ai_id)
             
         return jsonify({
             'message': 'IA personalizada atualizada com sucesso',
@@ -192,6 +199,7 @@ def delete_custom_ai(custom_ai_id):
             .update({'ativo': False}) \
             .eq('id', custom_ai_id) \
             .execute()
+        invalidate_custom_ai(custom_ai_id)
             
         return jsonify({'message': 'IA personalizada removida com sucesso'}), 200
 
@@ -303,6 +311,58 @@ def create_custom_ai_conversation(custom_ai_id):
         logger.error(f'Error creating AI conversation: {str(e)}')
         raise
 
+def _save_reply(conversation_id, tenant_id, user_id, content, status=None):
+    """
+    Grava a resposta do agente e registra a quota. Com status 'cancelled'
+    (cliente desconectou), grava só o texto parcial, se houver.
+    """
+    if content:
+        row = {
+            'conversation_id': conversation_id,
+            'role': 'assistant',
+            'conteudo': content
+        }
+        if status:
+            row['status'] = status
+        supabase.table('custom_ai_messages').insert(row).execute()
+
+    QuotaManager.log_usage(tenant_id, 'api_calls_per_day', user_id)
+
+def _stream_custom_ai_message(conversation_id, tenant_id, user_id, user_message, chunks):
+    """Eventos SSE da resposta do agente (start, trechos, done ou error)"""
+    yield sse_event({'conversation_id': conversation_id}, event='start')
+
+    parts = []
+    try:
+        for text in chunks:
+            parts.append(text)
+            yield sse_event({'text': text})
+    except GeneratorExit:
+        # Cliente desconectou: encerra a requisição ao provedor e grava o parcial
+        chunks.close()
+        try:
+            _save_reply(conversation_id, tenant_id, user_id, ''.join(parts), status='cancelled')
+        except Exception as e:
+            logger.error(f'Error persisting cancelled AI message: {str(e)}')
+        raise
+    except Exception as e:
+        logger.error(f'Error streaming AI message: {str(e)}')
+        yield sse_event({'error': 'Erro ao gerar resposta', 'code': 'STREAM_ERROR'}, event='error')
+        return
+
+    assistant_message = ''.join(parts)
+    try:
+        _save_reply(conversation_id, tenant_id, user_id, assistant_message)
+    except Exception as e:
+        logger.error(f'Error persisting streamed AI message: {str(e)}')
+        yield sse_event({'error': 'Erro ao salvar resposta', 'code': 'PERSIST_ERROR'}, event='error')
+        return
+
+    yield sse_event({
+        'user_message': user_message,
+        'assistant_message': assistant_message
+    }, event='done')
+
 @custom_ais_bp.route('/conversations/<conversation_id>/send', methods=['POST'])
 @token_required
 @require_json
@@ -322,18 +382,13 @@ def send_custom_ai_message(conversation_id):
         raise ValidationError('custom_ai_id é obrigatório')
 
     try:
-        # Validar conversa
-        conv = supabase.table('custom_ai_conversations') \
-            .select('id, custom_ai_id, tenant_id') \
-            .eq('id', conversation_id) \
-            .limit(1) \
-            .execute()
+        # Validar conversa (a configuração do agente vem na mesma leitura e
+        # fica em cache para o llm_router)
+        conversation, _ = get_conversation_with_config(conversation_id)
 
-        if not conv.data:
+        if not conversation:
             raise NotFoundError('Conversa de agente')
 
-        conversation = conv.data[0]
-
         if str(conversation.get('custom_ai_id')) != str(custom_ai_id):
             raise ValidationError('Conversa não pertence ao agente')
 
@@ -347,50 +402,35 @@ def send_custom_ai_message(conversation_id):
             'conteudo': user_message
         }).execute()
 
-        # Obter resposta da IA
-        if model and 'gemini' in model:
-            ai_conf = supabase.table('custom_ais').select('sistema_prompt').eq('id', custom_ai_id).limit(1).execute()
-            sys_prompt = (ai_conf.data and ai_conf.data[0].get('sistema_prompt')) or None
-            assistant_message = get_google_response(
-                [{"role": "user", "content": user_message}],
-                system_prompt=sys_prompt,
-                model=model
-            )
-        elif model and model not in VALID_MODELS:
-            ai_conf = supabase.table('custom_ais').select('sistema_prompt').eq('id', custom_ai_id).limit(1).execute()
-            sys_prompt = (ai_conf.data and ai_conf.data[0].get('sistema_prompt')) or None
-            assistant_message = get_groq_response(
-                [{"role": "user", "content": user_message}],
-                system_prompt=sys_prompt,
-                model=model
-            )
-        else:
-            assistant_message = get_claude_response(
-                [{"role": "user", "content": user_message}],
-                custom_ai_id=custom_ai_id,
-                model=model
-            )
-
-        # Salvar resposta
-        supabase.table('custom_ai_messages').insert({
-            'conversation_id': conversation_id,
-            'role': 'assistant',
-            'conteudo': assistant_message
-        }).execute()
-
-        # Registrar quota
-        QuotaManager.log_usage(
-            conversation['tenant_id'],
-            'api_calls_per_day',
-            g.user_id
+        # Obter resposta da IA (prompt, modelo e parâmetros da IA personalizada)
+        chunks = llm_router.stream(
+            [{"role": "user", "content": user_message}],
+            model=model,
+            custom_ai_id=custom_ai_id,
+            memory_namespace=memory_namespace(conversation['tenant_id'], g.user_id)
         )
 
+        if stream:
+            return sse_response(_stream_custom_ai_message(
+                conversation_id, conversation['tenant_id'], g.user_id, user_message, chunks
+            ))
+
+        try:
+            # Em stream internamente, para interromper o provedor se o cliente desistir
+            assistant_message = collect(chunks)
+        except ClientDisconnectedError as e:
+            _save_reply(conversation_id, conversation['tenant_id'], g.user_id, e.partial, status='cancelled')
+            raise
+
+        # Salvar resposta e registrar quota
+        _save_reply(conversation_id, conversation['tenant_id'], g.user_id, assistant_message)
+
         return jsonify({
             'user_message': user_message,
             'assistant_message': assistant_message
         }), 200
 
-    except (NotFoundError, ValidationError, QuotaExceededError):
+    except (NotFoundError, ValidationError, QuotaExceededError, ClientDisconnectedError):
         raise
     except Exception as e:
         logger.error(f'Error sending AI message: {str(e)}')
@@ -400,16 +440,30 @@ def send_custom_ai_message(conversation_id):
 @token_required
 @handle_exceptions
 def get_custom_ai_history(conversation_id):
-    """Obtém histórico de mensagens da conversa"""
+    """
+    Obtém histórico de mensagens da conversa.
+
+    Sem parâmetros retorna a lista completa. Com `limit`, `before` ou `after`
+    retorna `{messages, pagination}` com a janela pedida.
+    """
     try:
-        messages = supabase.table('custom_ai_messages') \
-            .select('*') \
-            .eq('conversation_id', conversation_id) \
-            .order('created_at', desc=False) \
-            .execute()
+        messages, pagination = fetch_message_window(
+            'custom_ai_messages',
+            conversation_id,
+            '*',
+            **message_window_args(request.args)
+        )
 
-        return jsonify(messages.data or []), 200
+        if pagination is None:
+            return jsonify(messages), 200
 
+        return jsonify({
+            'messages': messages,
+            'pagination': pagination
+        }), 200
+
+    except ValidationError:
+        raise
     except Exception as e:
         logger.error(f'Error getting AI history: {str(e)}')
         raise
@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify
 import os
-import httpx
 from dotenv import load_dotenv
 from utils.auth_utils import token_required
+from utils.http_clients import get_http_client
 
 images_bp = Blueprint('images', __name__, url_prefix='/api/v1/images')
 
@@ -37,7 +37,7 @@ def create_image():
                 
             model_owner = 'black-forest-labs'
             model_name = 'flux-1.1-pro'
-            url = f'https://api.replicate.com/v1/models/{model_owner}/{model_name}/predictions'
+            path = f'/models/{model_owner}/{model_name}/predictions'
             headers = {
                 'Authorization': f'Bearer {REPLICATE_API_TOKEN}',
                 'Content-Type': 'application/json',
@@ -50,23 +50,22 @@ def create_image():
             }
             payload = { 'input': input_payload }
 
-            with httpx.Client(timeout=60) as client:
-                resp = client.post(url, headers=headers, json=payload)
-                if resp.status_code >= 400:
-                    return jsonify({'error': resp.text}), 400
-                body = resp.json()
-                output = body.get('output')
-                image_url = None
-                if isinstance(output, dict) and 'url' in output:
-                    image_url = output['url']
-                elif isinstance(output, list) and output and isinstance(output[0], str):
-                    image_url = output[0]
+            resp = get_http_client('replicate').post(path, headers=headers, json=payload)
+            if resp.status_code >= 400:
+                return jsonify({'error': resp.text}), 400
+            body = resp.json()
+            output = body.get('output')
+            image_url = None
+            if isinstance(output, dict) and 'url' in output:
+                image_url = output['url']
+            elif isinstance(output, list) and output and isinstance(output[0], str):
+                image_url = output[0]
 
-                return jsonify({
-                    'prediction': body,
-                    'image_url': image_url,
-                    'provider': 'replicate'
-                }), 200
+            return jsonify({
+                'prediction': body,
+                'image_url': image_url,
+                'provider': 'replicate'
+            }), 200
         else:
             return jsonify({'error': 'Provedor inválido'}), 400
 
@@ -0,0 +1,71 @@
+from functools import wraps
+from flask import Blueprint, jsonify, request, g
+from utils.decorators import token_required, handle_exceptions
+from utils.auth_utils import membership_cache_stats, user_role_in_tenant
+from models.exceptions import AuthorizationError
+from models.quota_manager import QuotaManager
+from utils.google_client import model_cache_stats
+from utils.background import background_tasks
+from utils.write_behind import write_behind
+from utils.conversation_history import history_cache_stats
+from utils.context_builder import summary_cache_stats
+from utils.claude_client import prompt_cache_stats, tool_loop_stats
+from utils.model_health import model_health
+from utils.llm_router import router_stats
+from routes.ai import ai_cache_stats
+from utils.custom_ai_config import custom_ai_cache_stats
+import hmac
+import os
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api/v1/metrics')
+
+# Token dos coletores internos, enviado em X-Metrics-Token (sem JWT)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def _has_metrics_token():
+    supplied = request.headers.get('X-Metrics-Token')
+    if not METRICS_TOKEN or not supplied:
+        return False
+    return hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode())
+
+def metrics_access_required(f):
+    """
+    Decorator das métricas: as estatísticas são do processo inteiro (todos os
+    tenants), então exige o token interno ou um admin/owner do tenant atual
+    """
+    @token_required
+    def admin_only(*args, **kwargs):
+        tenant_id = getattr(g, 'tenant_id', None)
+        if not tenant_id or user_role_in_tenant(g.user_id, tenant_id) not in ('admin', 'owner'):
+            raise AuthorizationError('Métricas restritas a administradores')
+        return f(*args, **kwargs)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if _has_metrics_token():
+            return f(*args, **kwargs)
+        return admin_only(*args, **kwargs)
+    return decorated_function
+
+@metrics_bp.route('', methods=['GET'])
+@metrics_access_required
+@handle_exceptions
+def get_metrics():
+    """Métricas internas do processo (caches, filas, provedores)"""
+    return jsonify({
+        'caches': {
+            'tenant_membership': membership_cache_stats(),
+            'tenant_plan': QuotaManager.plan_cache.stats(),
+            'gemini_models': model_cache_stats(),
+            'conversation_history': history_cache_stats(),
+            'conversation_summaries': summary_cache_stats(),
+            'ai_results': ai_cache_stats(),
+            'custom_ai_config': custom_ai_cache_stats()
+        },
+        'prompt_cache': prompt_cache_stats(),
+        'claude_tools': tool_loop_stats(),
+        'model_health': model_health.snapshot(),
+        'router': router_stats(),
+        'background': background_tasks.stats(),
+        'write_behind': write_behind.stats()
+    }), 200
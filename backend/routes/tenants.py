@@ -1,7 +1,6 @@
 from flask import Blueprint, request, jsonify
 from config.supabase_config import supabase
-from utils.auth_utils import token_required, require_tenant_membership, require_tenant_admin
-from datetime import date
+from utils.auth_utils import token_required, require_tenant_membership, require_tenant_admin, invalidate_membership
 from models.quota_manager import QuotaManager
 
 tenants_bp = Blueprint('tenants', __name__, url_prefix='/api/v1/tenants')
@@ -53,19 +52,11 @@ def get_tenant(tenant_id):
 @require_tenant_membership('tenant_id')
 def get_tenant_quota(tenant_id):
     try:
-        tenant_res = supabase.table('tenants').select('plano').eq('id', tenant_id).limit(1).execute()
-        plan = (tenant_res.data and tenant_res.data[0].get('plano')) or 'free'
+        plan = QuotaManager.get_tenant_plan(tenant_id)
 
         limit = QuotaManager.LIMITS_BY_PLAN.get(plan, {}).get('api_calls_per_day', 100)
 
-        today = date.today().isoformat()
-        usage_res = supabase.table('quota_logs') \
-            .select('count', count='exact') \
-            .eq('tenant_id', tenant_id) \
-            .eq('action', 'api_calls_per_day') \
-            .gte('created_at', f"{today}T00:00:00") \
-            .execute()
-        usage = usage_res.count or 0
+        usage = QuotaManager.get_usage(tenant_id, 'api_calls_per_day')
         remaining = max(0, int(limit) - int(usage))
         percentage = round((usage / limit) * 100, 2) if limit else 0.0
 
@@ -135,6 +126,7 @@ def add_user_to_tenant(tenant_id):
             'user_id': user_id,
             'role': role
         }).execute()
+        invalidate_membership(user_id, tenant_id)
         
         return jsonify({
             'message': 'Usuário adicionado ao tenant',
@@ -169,6 +161,7 @@ def add_user_by_email(tenant_id):
             'user_id': user_id,
             'role': role
         }).execute()
+        invalidate_membership(user_id, tenant_id)
         return jsonify({'message': 'Usuário adicionado ao tenant', 'tenant_user': tenant_user.data[0]}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -190,6 +183,7 @@ def remove_user_by_email(tenant_id):
         user_id = user.data[0]['id']
 
         supabase.table('tenant_users').delete().eq('tenant_id', tenant_id).eq('user_id', user_id).execute()
+        invalidate_membership(user_id, tenant_id)
         return jsonify({'message': 'Usuário removido do tenant'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -202,6 +196,7 @@ def update_tenant(tenant_id):
     
     try:
         tenant = supabase.table('tenants').update(data).eq('id', tenant_id).execute()
+        QuotaManager.invalidate_plan(tenant_id)
         return jsonify(tenant.data[0]), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -212,6 +207,8 @@ def update_tenant(tenant_id):
 def delete_tenant(tenant_id):
     try:
         supabase.table('tenants').delete().eq('id', tenant_id).execute()
+        invalidate_membership(tenant_id=tenant_id)
+        QuotaManager.invalidate_plan(tenant_id)
         return jsonify({'message': 'Tenant deletado'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
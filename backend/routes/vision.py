@@ -1,7 +1,6 @@
 from flask import Blueprint, request, jsonify, g
 from pydantic import ValidationError as PydanticValidationError
 import os
-import httpx
 from dotenv import load_dotenv
 from utils.decorators import token_required, require_json, handle_exceptions
 from config.supabase_config import supabase
@@ -9,6 +8,7 @@ from models.schemas import AnalyzeImageRequest
 from models.exceptions import ValidationError, SSRFError, QuotaExceededError
 from models.ssrf_validator import SSRFValidator
 from models.quota_manager import QuotaManager
+from utils.http_clients import get_http_client
 import logging
 
 logger = logging.getLogger(__name__)
@@ -81,24 +81,23 @@ def analyze_image():
             'Content-Type': 'application/json'
         }
 
-        # Fazer request para Groq
-        with httpx.Client(timeout=120) as client:
-            resp = client.post(
-                'https://api.groq.com/openai/v1/chat/completions',
-                json=payload,
-                headers=headers
-            )
-
-            if resp.status_code >= 400:
-                logger.error(f'Groq API error: {resp.text}')
-                raise Exception(f'Erro ao analisar imagem: {resp.status_code}')
-
-            j = resp.json()
-            content = (
-                (j.get('choices') or [{}])[0]
-                .get('message', {})
-                .get('content', '')
-            )
+        # Fazer request para Groq (cliente compartilhado com keep-alive)
+        resp = get_http_client('groq').post(
+            '/chat/completions',
+            json=payload,
+            headers=headers
+        )
+
+        if resp.status_code >= 400:
+            logger.error(f'Groq API error: {resp.text}')
+            raise Exception(f'Erro ao analisar imagem: {resp.status_code}')
+
+        j = resp.json()
+        content = (
+            (j.get('choices') or [{}])[0]
+            .get('message', {})
+            .get('content', '')
+        )
 
         # Persistir conversa se solicitado
         conversation_id = None
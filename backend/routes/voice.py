@@ -1,11 +1,11 @@
 from flask import Blueprint, request, jsonify, g
 import os
-import httpx
 from dotenv import load_dotenv
 from utils.decorators import token_required, handle_exceptions
 from models.schemas import TranscribeAudioRequest
 from models.exceptions import ValidationError, QuotaExceededError
 from models.quota_manager import QuotaManager
+from utils.http_clients import get_http_client, provider_timeout
 import logging
 
 logger = logging.getLogger(__name__)
@@ -64,20 +64,20 @@ def transcribe_audio():
         else:
             data['url'] = url
 
-        # Fazer request para Groq
-        with httpx.Client(timeout=60) as client:
-            resp = client.post(
-                'https://api.groq.com/openai/v1/audio/transcriptions',
-                headers=headers,
-                data=data,
-                files=files
-            )
+        # Fazer request para Groq (cliente compartilhado com keep-alive)
+        resp = get_http_client('groq').post(
+            '/audio/transcriptions',
+            headers=headers,
+            data=data,
+            files=files,
+            timeout=provider_timeout('groq', read=60)
+        )
 
-            if resp.status_code >= 400:
-                logger.error(f'Groq transcription error: {resp.text}')
-                raise Exception(f'Erro ao transcrever: {resp.status_code}')
+        if resp.status_code >= 400:
+            logger.error(f'Groq transcription error: {resp.text}')
+            raise Exception(f'Erro ao transcrever: {resp.status_code}')
 
-            text = resp.text or ''
+        text = resp.text or ''
 
         logger.info('Audio transcribed', extra={'user_id': g.user_id})
 
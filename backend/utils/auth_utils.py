@@ -1,10 +1,15 @@
 from functools import wraps
 from flask import request, jsonify
 import jwt
+import logging
 import os
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from config.supabase_config import supabase
+from models.quota_manager import QuotaManager
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 if not SECRET_KEY:
@@ -51,16 +56,80 @@ def token_required(f):
     
     return decorated
 
+# Cache (user_id, tenant_id) -> associação em tenant_users, compartilhado por
+# utils.auth_utils e utils.decorators. Só associações existentes são cacheadas,
+# para que um usuário recém-adicionado não fique bloqueado até o TTL expirar.
+_membership_cache = TTLCache(
+    maxsize=int(os.getenv('MEMBERSHIP_CACHE_SIZE', '4096')),
+    ttl=int(os.getenv('MEMBERSHIP_CACHE_TTL', '30')),
+    name='tenant_membership'
+)
+
+# Versão das associações no backend de contadores da quota (Redis quando
+# QUOTA_REDIS_URL está definida). Cada entrada guarda a versão em que foi lida;
+# invalidate_membership incrementa a versão e todos os workers relêem do banco.
+MEMBERSHIP_VERSION_KEY = 'membership_version'
+MEMBERSHIP_VERSION_TTL = 86400
+
+def _membership_version():
+    try:
+        return QuotaManager.counters.get(MEMBERSHIP_VERSION_KEY) or 0
+    except Exception as e:
+        logger.error(f'Error reading membership version: {str(e)}')
+        return None
+
+def _bump_membership_version():
+    try:
+        if QuotaManager.counters.incr(MEMBERSHIP_VERSION_KEY) is None:
+            QuotaManager.counters.seed(MEMBERSHIP_VERSION_KEY, 1, MEMBERSHIP_VERSION_TTL)
+    except Exception as e:
+        logger.error(f'Error bumping membership version: {str(e)}')
+
+def _get_membership(user_id, tenant_id):
+    key = (str(user_id), str(tenant_id))
+    # Lê a versão antes do banco: uma invalidação no meio da consulta deixa
+    # a entrada com versão antiga, e ela é descartada na próxima leitura
+    version = _membership_version()
+    cached = _membership_cache.get(key)
+    if cached is not None and version is not None and cached[0] == version:
+        return cached[1]
+    res = supabase.table('tenant_users').select('role').eq('tenant_id', tenant_id).eq('user_id', user_id).limit(1).execute()
+    membership = {'role': res.data[0].get('role')} if res.data else None
+    if membership is not None and version is not None:
+        _membership_cache.set(key, (version, membership))
+    else:
+        _membership_cache.invalidate(key)
+    return membership
+
 def user_belongs_to_tenant(user_id, tenant_id):
-    res = supabase.table('tenant_users').select('id').eq('tenant_id', tenant_id).eq('user_id', user_id).limit(1).execute()
-    return bool(res.data)
+    return _get_membership(user_id, tenant_id) is not None
 
 def user_role_in_tenant(user_id, tenant_id):
-    res = supabase.table('tenant_users').select('role').eq('tenant_id', tenant_id).eq('user_id', user_id).limit(1).execute()
-    if res.data:
-        return res.data[0].get('role')
+    membership = _get_membership(user_id, tenant_id)
+    if membership:
+        return membership.get('role')
     return None
 
+def invalidate_membership(user_id=None, tenant_id=None):
+    """
+    Remove associações do cache (por usuário, por tenant ou ambos).
+
+    O cache local é limpo na hora; nos demais workers a troca de versão
+    invalida todas as entradas, já que mudanças de associação são raras.
+    """
+    if user_id is not None and tenant_id is not None:
+        _membership_cache.invalidate((str(user_id), str(tenant_id)))
+    elif tenant_id is not None:
+        _membership_cache.invalidate_where(lambda k: k[1] == str(tenant_id))
+    elif user_id is not None:
+        _membership_cache.invalidate_where(lambda k: k[0] == str(user_id))
+    else:
+        _membership_cache.clear()
+    _bump_membership_version()
+
+def membership_cache_stats():
+    return _membership_cache.stats()
+
 def require_tenant_membership(param_name='tenant_id'):
     def decorator(f):
         @wraps(f)
@@ -0,0 +1,174 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class BackgroundExecutor:
+    """
+    Pool limitado de threads para trabalho pós-resposta.
+
+    Args:
+        name: Nome usado em logs e métricas
+        workers: Número de threads
+        queue_size: Tamanho máximo da fila
+        policy: 'drop' descarta a tarefa nova quando a fila está cheia,
+            'drop_oldest' descarta a tarefa mais antiga da fila
+
+    Tarefas enviadas com `key` são coalescidas: enquanto uma tarefa com a
+    mesma chave estiver na fila, novos envios são ignorados.
+    """
+
+    POLICIES = ('drop', 'drop_oldest')
+
+    def __init__(self, name, workers=2, queue_size=100, policy='drop'):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Política inválida: {policy}')
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.policy = policy
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pending_keys = set()
+        self._pid = None
+        self._closed = False
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'coalesced': 0,
+            'total_wait_seconds': 0.0,
+            'total_run_seconds': 0.0,
+            'max_latency_seconds': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Threads não sobrevivem a um fork: (re)inicia no processo atual
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        Enfileira uma tarefa
+
+        Returns:
+            True se a tarefa foi aceita (ou coalescida), False se descartada
+        """
+        with self._lock:
+            if self._closed:
+                self._stats['dropped'] += 1
+                return False
+            self._ensure_started()
+            if key is not None and key in self._pending_keys:
+                self._stats['coalesced'] += 1
+                return True
+
+            item = (fn, args, kwargs, key, time.monotonic())
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self.policy == 'drop':
+                    self._stats['dropped'] += 1
+                    logger.warning(f'Background queue {self.name} full, task dropped')
+                    return False
+                try:
+                    oldest = self._queue.get_nowait()
+                    self._pending_keys.discard(oldest[3])
+                    self._stats['dropped'] += 1
+                    logger.warning(f'Background queue {self.name} full, oldest task dropped')
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(item)
+
+            if key is not None:
+                self._pending_keys.add(key)
+            self._stats['submitted'] += 1
+            return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            fn, args, kwargs, key, enqueued_at = item
+            started = time.monotonic()
+            with self._lock:
+                self._pending_keys.discard(key)
+            failed = False
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                logger.error(f'Background task failed in {self.name}: {str(e)}')
+            finished = time.monotonic()
+            with self._lock:
+                self._stats['failed' if failed else 'completed'] += 1
+                self._stats['total_wait_seconds'] += started - enqueued_at
+                self._stats['total_run_seconds'] += finished - started
+                self._stats['max_latency_seconds'] = max(
+                    self._stats['max_latency_seconds'], finished - enqueued_at
+                )
+            self._queue.task_done()
+
+    def shutdown(self, timeout=10.0):
+        """Para de aceitar tarefas e aguarda a fila esvaziar (até `timeout` segundos)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads) if self._pid == os.getpid() else []
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                self._queue.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        remaining = self._queue.qsize()
+        if remaining:
+            logger.warning(f'Background queue {self.name} shut down with {remaining} pending tasks')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        finished = stats['completed'] + stats['failed']
+        return {
+            'name': self.name,
+            'workers': self.workers,
+            'policy': self.policy,
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'submitted': stats['submitted'],
+            'completed': stats['completed'],
+            'failed': stats['failed'],
+            'dropped': stats['dropped'],
+            'coalesced': stats['coalesced'],
+            'avg_wait_ms': round(stats['total_wait_seconds'] / finished * 1000, 3) if finished else 0.0,
+            'avg_run_ms': round(stats['total_run_seconds'] / finished * 1000, 3) if finished else 0.0,
+            'max_latency_ms': round(stats['max_latency_seconds'] * 1000, 3),
+        }
+
+# Executor padrão para tarefas pós-resposta (títulos, logs, etc.)
+background_tasks = BackgroundExecutor(
+    'background',
+    workers=int(os.getenv('BACKGROUND_WORKERS', '2')),
+    queue_size=int(os.getenv('BACKGROUND_QUEUE_SIZE', '200')),
+    policy=os.getenv('BACKGROUND_QUEUE_POLICY', 'drop')
+)
+
+atexit.register(background_tasks.shutdown)
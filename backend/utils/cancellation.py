@@ -0,0 +1,119 @@
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from collections import Counter
+from flask import has_request_context, request
+from models.exceptions import ClientDisconnectedError
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo (segundos) entre verificações de desconexão durante a geração
+CANCEL_CHECK_INTERVAL = float(os.getenv('CANCEL_CHECK_INTERVAL', '0.5'))
+
+def client_disconnected(environ=None):
+    """
+    True se o cliente HTTP já fechou a conexão (aba fechada, botão "parar").
+
+    Espia o socket exposto pelo gunicorn sem consumir dados: um socket legível
+    que devolve b'' foi fechado pelo outro lado. Sem o socket (servidor de
+    desenvolvimento), sempre retorna False.
+    """
+    if environ is None:
+        if not has_request_context():
+            return False
+        environ = request.environ
+    sock = environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        # Socket sem suporte a MSG_PEEK (ex.: TLS terminado no gunicorn)
+        return False
+    except OSError:
+        return True
+
+def collect(chunks, disconnected=client_disconnected, interval=None):
+    """
+    Junta os trechos de um stream do llm_router, para as rotas que respondem
+    em JSON. A cada `interval` segundos verifica se o cliente ainda espera a
+    resposta; se não, fecha o stream (o que encerra a requisição ao provedor)
+    e levanta ClientDisconnectedError com o texto parcial.
+
+    Returns:
+        Texto completo da resposta
+    """
+    interval = CANCEL_CHECK_INTERVAL if interval is None else interval
+    parts = []
+    last_check = time.monotonic()
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            now = time.monotonic()
+            if disconnected and now - last_check >= interval:
+                last_check = now
+                if disconnected():
+                    raise ClientDisconnectedError(''.join(parts))
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+    return ''.join(parts)
+
+class CancellationStats:
+    """
+    Gerações interrompidas porque o cliente desconectou.
+
+    A economia é estimada pela média das gerações completas do mesmo modelo
+    (tokens de saída e duração), descontado o que já tinha sido gerado e o
+    tempo já decorrido no momento do cancelamento.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._completed = {}
+        self._by_model = Counter()
+        self.cancelled = 0
+        self.tokens_generated = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+
+    def record_completed(self, model, seconds, tokens):
+        with self._lock:
+            count, total_seconds, total_tokens = self._completed.get(model, (0, 0.0, 0))
+            self._completed[model] = (count + 1, total_seconds + seconds, total_tokens + tokens)
+
+    def record_cancelled(self, model, seconds, tokens):
+        with self._lock:
+            count, total_seconds, total_tokens = self._completed.get(model, (0, 0.0, 0))
+            saved_tokens = max(0, int(total_tokens / count) - tokens) if count else 0
+            saved_seconds = max(0.0, total_seconds / count - seconds) if count else 0.0
+            self.cancelled += 1
+            self._by_model[model or 'default'] += 1
+            self.tokens_generated += tokens
+            self.tokens_saved += saved_tokens
+            self.seconds_saved += saved_seconds
+        logger.info('Generation cancelled by client', extra={
+            'model': model,
+            'elapsed_seconds': round(seconds, 3),
+            'tokens_generated': tokens,
+            'tokens_saved_estimate': saved_tokens
+        })
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cancelled': self.cancelled,
+                'by_model': dict(self._by_model),
+                'tokens_generated_before_cancel': self.tokens_generated,
+                'tokens_saved_estimate': self.tokens_saved,
+                'seconds_saved_estimate': round(self.seconds_saved, 3)
+            }
+
+cancellations = CancellationStats()
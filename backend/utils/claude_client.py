@@ -1,8 +1,15 @@
+import copy
+import logging
 import os
-from anthropic import Anthropic
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from anthropic import Anthropic, APIConnectionError, APIStatusError
 from dotenv import load_dotenv
 from utils.default_prompt import DEFAULT_SYSTEM_PROMPT
-from config.supabase_config import supabase
+from utils.memory_store import get_memory_store
+from utils.custom_ai_config import get_custom_ai_config
+from utils.model_health import model_health, backoff_delay
 
 load_dotenv()
 
@@ -13,156 +20,388 @@ if not ANTHROPIC_API_KEY:
 
 client = Anthropic(api_key=ANTHROPIC_API_KEY, default_headers={"anthropic-beta": "context-management-2025-06-27"})
 
+# Sem retries internos do SDK: as novas tentativas (429/529) e o fallback entre
+# modelos são decididos aqui, junto com o circuit breaker de cada modelo
+_api = client.with_options(max_retries=0)
+
 
 MODEL_OPTIONS = [
     "claude-sonnet-4-5",
     "claude-opus-4-1",
 ]
 
-MEM_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "memories"))
+MEMORY_TOOL = {"type": "memory_20250818", "name": "memory"}
 
-def ensure_mem_root():
-    try:
-        os.makedirs(MEM_ROOT, exist_ok=True)
-    except Exception:
-        pass
-
-def resolve_mem_path(path):
-    ensure_mem_root()
-    p = str(path or "").strip()
-    if p.startswith("/memories"):
-        p = p[len("/memories"):]
-    p = p.lstrip("/")
-    abspath = os.path.abspath(os.path.join(MEM_ROOT, p))
-    if not abspath.startswith(MEM_ROOT):
-        raise ValueError("Caminho inválido")
-    return abspath
-
-def memory_view(input_obj):
-    path = resolve_mem_path(input_obj.get("path"))
-    view_range = input_obj.get("view_range")
-    if not os.path.exists(path):
-        return "Arquivo ou diretório não existe"
-    if os.path.isdir(path):
-        items = sorted(os.listdir(path))
-        return "Directory: /memories" + ("/" + os.path.relpath(path, MEM_ROOT) if os.path.relpath(path, MEM_ROOT) != "." else "") + "\n" + "\n".join(["- " + i for i in items])
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        lines = f.read().splitlines()
-    if isinstance(view_range, list) and len(view_range) == 2:
-        s = max(1, int(view_range[0]))
-        e = max(s, int(view_range[1]))
-        sel = lines[s-1:e]
-        return "\n".join(sel)
-    return "\n".join(lines)
-
-def memory_create(input_obj):
-    path = resolve_mem_path(input_obj.get("path"))
-    text = input_obj.get("file_text") or ""
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(text)
-    return "OK"
-
-def memory_str_replace(input_obj):
-    path = resolve_mem_path(input_obj.get("path"))
-    old_str = input_obj.get("old_str") or ""
-    new_str = input_obj.get("new_str") or ""
-    if not os.path.exists(path) or os.path.isdir(path):
-        return "Arquivo não encontrado"
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        content = f.read()
-    content = content.replace(old_str, new_str)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
-    return "OK"
-
-def memory_insert(input_obj):
-    path = resolve_mem_path(input_obj.get("path"))
-    insert_line = int(input_obj.get("insert_line") or 1)
-    insert_text = input_obj.get("insert_text") or ""
-    if not os.path.exists(path) or os.path.isdir(path):
-        return "Arquivo não encontrado"
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        lines = f.read().splitlines()
-    idx = max(0, insert_line - 1)
-    lines[idx:idx] = [insert_text]
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
-    return "OK"
-
-def memory_delete(input_obj):
-    path = resolve_mem_path(input_obj.get("path"))
-    if not os.path.exists(path):
-        return "OK"
-    if os.path.isdir(path):
-        for root, dirs, files in os.walk(path, topdown=False):
-            for name in files:
-                try:
-                    os.remove(os.path.join(root, name))
-                except Exception:
-                    pass
-            for name in dirs:
-                try:
-                    os.rmdir(os.path.join(root, name))
-                except Exception:
-                    pass
-        try:
-            os.rmdir(path)
-        except Exception:
-            pass
+# Prompt caching: breakpoints no system prompt, na definição da ferramenta e no
+# prefixo do histórico. Prefixos menores que o mínimo do modelo (~1024 tokens)
+# simplesmente não são cacheados pela API.
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+CACHE_CONTROL = {"type": "ephemeral"}
+
+logger = logging.getLogger(__name__)
+
+# Limite de rodadas de tool_use por resposta; ao atingi-lo, uma última chamada
+# com tool_choice "none" força o modelo a responder em texto
+MAX_TOOL_ROUNDS = int(os.getenv('CLAUDE_MAX_TOOL_ROUNDS', '5'))
+TOOL_WORKERS = int(os.getenv('CLAUDE_TOOL_WORKERS', '4'))
+
+CLAUDE_RETRY_ATTEMPTS = int(os.getenv('CLAUDE_RETRY_ATTEMPTS', '2'))
+
+# Erros que justificam nova tentativa no mesmo modelo e os que levam ao próximo
+RETRYABLE_ERRORS = ('rate_limit', 'overloaded')
+FALLBACK_ERRORS = ('rate_limit', 'overloaded', 'server', 'connection', 'not_found')
+
+_usage_lock = threading.Lock()
+_usage_stats = {
+    'requests': 0,
+    'input_tokens': 0,
+    'output_tokens': 0,
+    'cache_read_input_tokens': 0,
+    'cache_creation_input_tokens': 0,
+}
+_tool_stats = {
+    'loops': 0,
+    'rounds': 0,
+    'tool_calls': 0,
+    'parallel_rounds': 0,
+    'round_cap_hits': 0,
+    'total_model_seconds': 0.0,
+    'total_tool_seconds': 0.0,
+}
+
+def _system_blocks(system_prompt):
+    if not PROMPT_CACHE_ENABLED:
+        return system_prompt
+    return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+def _tools():
+    if not PROMPT_CACHE_ENABLED:
+        return [MEMORY_TOOL]
+    return [dict(MEMORY_TOOL, cache_control=CACHE_CONTROL)]
+
+def _with_history_breakpoint(messages):
+    """
+    Copia as mensagens marcando o último bloco como breakpoint de cache, para
+    que o próximo turno (ou a chamada de continuação da ferramenta) reaproveite
+    todo o prefixo já enviado.
+    """
+    if not PROMPT_CACHE_ENABLED or not messages:
+        return messages
+    marked = list(messages)
+    last = dict(marked[-1])
+    content = last.get("content")
+    if isinstance(content, str):
+        if not content:
+            return messages
+        last["content"] = [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}]
+    elif isinstance(content, list) and content and isinstance(content[-1], dict):
+        blocks = copy.copy(content)
+        blocks[-1] = dict(blocks[-1], cache_control=CACHE_CONTROL)
+        last["content"] = blocks
     else:
-        try:
-            os.remove(path)
-        except Exception:
-            pass
-    return "OK"
-
-def memory_rename(input_obj):
-    old_path = resolve_mem_path(input_obj.get("old_path"))
-    new_path = resolve_mem_path(input_obj.get("new_path"))
-    os.makedirs(os.path.dirname(new_path), exist_ok=True)
-    try:
-        os.replace(old_path, new_path)
-        return "OK"
-    except Exception:
-        return "Falha ao renomear"
-
-def execute_memory_tool(input_obj):
-    cmd = str(input_obj.get("command") or "").strip()
-    if cmd == "view":
-        return memory_view(input_obj)
-    if cmd == "create":
-        return memory_create(input_obj)
-    if cmd == "str_replace":
-        return memory_str_replace(input_obj)
-    if cmd == "insert":
-        return memory_insert(input_obj)
-    if cmd == "delete":
-        return memory_delete(input_obj)
-    if cmd == "rename":
-        return memory_rename(input_obj)
-    return "Comando inválido"
-
-def get_custom_ai_config(custom_ai_id):
+        return messages
+    marked[-1] = last
+    return marked
+
+def _record_usage(model_name, usage):
+    """Acumula os tokens de cada resposta (incluindo leituras/escritas de cache)"""
+    if usage is None:
+        return
+    values = {key: int(getattr(usage, key, 0) or 0) for key in _usage_stats if key != 'requests'}
+    with _usage_lock:
+        _usage_stats['requests'] += 1
+        for key, value in values.items():
+            _usage_stats[key] += value
+    logger.info('Claude usage', extra=dict(values, model=model_name))
+
+def prompt_cache_stats():
+    with _usage_lock:
+        stats = dict(_usage_stats)
+    total_input = stats['input_tokens'] + stats['cache_read_input_tokens'] + stats['cache_creation_input_tokens']
+    stats['enabled'] = PROMPT_CACHE_ENABLED
+    stats['cache_hit_rate'] = round(stats['cache_read_input_tokens'] / total_input, 4) if total_input else 0.0
+    return stats
+
+def execute_memory_tool(input_obj, namespace=None):
+    """Executa um comando do tool `memory` no backend configurado (ver utils.memory_store)"""
+    return get_memory_store().execute(namespace, input_obj)
+
+def classify_error(error):
+    """Classifica um erro da API pelo tipo/status HTTP (e não pelo texto da mensagem)"""
+    if isinstance(error, APIConnectionError):
+        return 'connection'
+    if isinstance(error, APIStatusError):
+        status = getattr(error, 'status_code', None) or 0
+        if status == 429:
+            return 'rate_limit'
+        if status == 529:
+            return 'overloaded'
+        if status >= 500:
+            return 'server'
+        if status == 404:
+            return 'not_found'
+        if status in (401, 403):
+            return 'auth'
+        return 'bad_request'
+    return 'unknown'
+
+def _health_key(model_name):
+    return f'anthropic:{model_name}'
+
+def _retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    return headers.get('retry-after')
+
+def _on_error(model_name, error, started, attempt, can_retry=True):
     """
-    Busca configuração de IA personalizada no Supabase
-    
-    Args:
-        custom_ai_id: ID da IA personalizada
-    
+    Decide se vale tentar de novo e registra o erro no circuit breaker.
+
+    Uma requisição conta no máximo uma falha, só quando desiste do modelo:
+    as novas tentativas de um único usuário limitado (429) não devem abrir
+    o circuito para todos os tenants do processo.
+
     Returns:
-        Dicionário com configurações da IA ou None
+        Segundos de espera antes de repetir, ou None para desistir deste modelo
+    """
+    kind = classify_error(error)
+    key = _health_key(model_name)
+    if can_retry and kind in RETRYABLE_ERRORS and attempt < CLAUDE_RETRY_ATTEMPTS:
+        model_health.release(key)
+        delay = backoff_delay(attempt, retry_after=_retry_after(error))
+        logger.warning(f'Claude {kind} on {model_name}, retrying in {delay:.2f}s')
+        return delay
+    if kind in FALLBACK_ERRORS:
+        model_health.record_failure(key, time.perf_counter() - started, kind)
+    else:
+        model_health.release(key)
+    return None
+
+def _create_message(request):
+    """messages.create com novas tentativas em 429/529 e registro de saúde do modelo"""
+    model_name = request["model"]
+    attempt = 0
+    while True:
+        model_health.acquire(_health_key(model_name))
+        started = time.perf_counter()
+        try:
+            response = _api.messages.create(**request)
+        except Exception as e:
+            delay = _on_error(model_name, e, started, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        model_health.record_success(_health_key(model_name), time.perf_counter() - started)
+        return response
+
+def _candidate_models(model=None):
+    """
+    Modelos Claude a tentar, em ordem. Um modelo pedido explicitamente é o
+    único tentado; sem modelo, os de MODEL_OPTIONS com circuito fechado
+    servem de fallback uns aos outros (o primeiro, se todos estiverem abertos).
+    O modelo que respondeu vai em `served["model"]` (ver get_claude_response).
     """
+    if model:
+        return [model]
+    healthy = model_health.ordered([_health_key(m) for m in MODEL_OPTIONS])
+    return [m for m in MODEL_OPTIONS if _health_key(m) in healthy] or MODEL_OPTIONS[:1]
+
+def _mark_served(served, model_name):
+    if served is not None:
+        served["model"] = model_name
+
+def _tool_paths(input_obj):
+    if str(input_obj.get("command") or "").strip() == "rename":
+        paths = [input_obj.get("old_path"), input_obj.get("new_path")]
+    else:
+        paths = [input_obj.get("path")]
+    return [str(p or "").strip().rstrip("/") for p in paths]
+
+def _independent(calls):
+    """
+    Blocos são independentes quando nenhum caminho é igual ou está dentro do
+    caminho de outro bloco (ex.: criar /memories/a e ler /memories/b)
+    """
+    seen = []
+    for input_obj in calls:
+        for path in _tool_paths(input_obj):
+            for other in seen:
+                if path == other or path.startswith(other + "/") or other.startswith(path + "/"):
+                    return False
+        seen.extend(_tool_paths(input_obj))
+    return True
+
+def _run_tool(block, namespace):
+    if getattr(block, "name", "") != "memory":
+        return "Ferramenta desconhecida", True
     try:
-        result = supabase.table('custom_ais').select('*').eq('id', custom_ai_id).execute()
-        if result.data:
-            return result.data[0]
-        return None
+        return execute_memory_tool(getattr(block, "input", {}) or {}, namespace), False
     except Exception as e:
-        print(f"Erro ao buscar IA personalizada: {str(e)}")
-        return None
+        return f"Erro ao executar ferramenta: {str(e)}", True
 
-def get_claude_response(messages, system_prompt=None, custom_ai_id=None, model=None, temperature=None, max_tokens=4096):
+def _execute_tool_round(content, namespace):
+    """
+    Executa todos os blocos tool_use de uma resposta e devolve a mensagem do
+    usuário com os tool_result na mesma ordem dos blocos
+    """
+    blocks = [
+        item for item in content or []
+        if getattr(item, "type", None) == "tool_use"
+    ]
+    calls = [getattr(item, "input", {}) or {} for item in blocks]
+    parallel = len(calls) > 1 and _independent(calls)
+    if parallel:
+        with ThreadPoolExecutor(max_workers=min(len(blocks), TOOL_WORKERS)) as pool:
+            outcomes = list(pool.map(lambda b: _run_tool(b, namespace), blocks))
+    else:
+        outcomes = [_run_tool(b, namespace) for b in blocks]
+
+    results = []
+    for item, (output, is_error) in zip(blocks, outcomes):
+        result = {"type": "tool_result", "tool_use_id": getattr(item, "id", ""), "content": output}
+        if is_error:
+            result["is_error"] = True
+        results.append(result)
+    return {"role": "user", "content": results}, len(blocks), parallel
+
+def _record_round(round_number, model_seconds, tool_seconds, tool_calls, parallel):
+    with _usage_lock:
+        _tool_stats['rounds'] += 1
+        _tool_stats['tool_calls'] += tool_calls
+        _tool_stats['parallel_rounds'] += 1 if parallel else 0
+        _tool_stats['total_model_seconds'] += model_seconds
+        _tool_stats['total_tool_seconds'] += tool_seconds
+    logger.info('Claude tool round', extra={
+        'round': round_number,
+        'tool_calls': tool_calls,
+        'parallel': parallel,
+        'model_ms': round(model_seconds * 1000, 3),
+        'tools_ms': round(tool_seconds * 1000, 3)
+    })
+
+def _record_loop(cap_hit):
+    with _usage_lock:
+        _tool_stats['loops'] += 1
+        _tool_stats['round_cap_hits'] += 1 if cap_hit else 0
+
+def _text_of(content):
+    parts = []
+    for it in content or []:
+        if getattr(it, "type", None) == "text":
+            parts.append(getattr(it, "text", "") or "")
+    return "\n\n".join(p for p in parts if p)
+
+def _run_tool_loop(params, namespace=None, progress=None):
+    """
+    Chama o Claude até `stop_reason` deixar de ser tool_use, executando as
+    ferramentas de cada rodada (no máximo MAX_TOOL_ROUNDS rodadas).
+    `progress["tool_rounds"]` conta as rodadas já executadas (ver _stream_tool_loop)
+
+    Returns:
+        Texto da resposta final (ou o texto das rodadas anteriores se a final vier vazia)
+    """
+    messages = list(params["messages"])
+    texts = []
+    rounds = 0
+    while True:
+        request = dict(params, messages=_with_history_breakpoint(messages))
+        if rounds >= MAX_TOOL_ROUNDS:
+            request["tool_choice"] = {"type": "none"}
+        started = time.perf_counter()
+        response = _create_message(request)
+        model_seconds = time.perf_counter() - started
+        _record_usage(params["model"], getattr(response, "usage", None))
+
+        text = _text_of(response.content)
+        if text:
+            texts.append(text)
+        if getattr(response, "stop_reason", None) != "tool_use" or rounds >= MAX_TOOL_ROUNDS:
+            _record_loop(rounds >= MAX_TOOL_ROUNDS)
+            return text or "\n\n".join(texts)
+
+        rounds += 1
+        if progress is not None:
+            progress["tool_rounds"] = rounds
+        started = time.perf_counter()
+        tool_message, tool_calls, parallel = _execute_tool_round(response.content, namespace)
+        _record_round(rounds, model_seconds, time.perf_counter() - started, tool_calls, parallel)
+        messages += [{"role": "assistant", "content": response.content}, tool_message]
+
+def _stream_tool_loop(params, namespace=None, progress=None):
+    """
+    Versão em streaming de _run_tool_loop: gera os trechos de texto de todas as rodadas.
+    `progress["tool_rounds"]` conta as rodadas de tools já executadas; depois
+    da primeira não se troca de modelo (o tool `memory` já alterou o estado).
+    """
+    messages = list(params["messages"])
+    rounds = 0
+    emitted = False
+    while True:
+        request = dict(params, messages=_with_history_breakpoint(messages))
+        if rounds >= MAX_TOOL_ROUNDS:
+            request["tool_choice"] = {"type": "none"}
+        attempt = 0
+        while True:
+            model_health.acquire(_health_key(params["model"]))
+            started = time.perf_counter()
+            round_emitted = False
+            try:
+                with _api.messages.stream(**request) as stream:
+                    separate = emitted
+                    for text in stream.text_stream:
+                        if separate and text:
+                            # Separa o texto de rodadas diferentes
+                            yield "\n\n"
+                            separate = False
+                        emitted = emitted or bool(text)
+                        round_emitted = round_emitted or bool(text)
+                        yield text
+                    final = stream.get_final_message()
+            except GeneratorExit:
+                # Cliente desistiu: sair do `with` fecha a conexão e a geração para
+                model_health.release(_health_key(params["model"]))
+                raise
+            except Exception as e:
+                # Só repete se nada desta rodada chegou ao cliente
+                delay = _on_error(params["model"], e, started, attempt, can_retry=not round_emitted)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            model_health.record_success(_health_key(params["model"]), time.perf_counter() - started)
+            break
+        model_seconds = time.perf_counter() - started
+        _record_usage(params["model"], getattr(final, "usage", None))
+
+        if getattr(final, "stop_reason", None) != "tool_use" or rounds >= MAX_TOOL_ROUNDS:
+            _record_loop(rounds >= MAX_TOOL_ROUNDS)
+            return
+
+        rounds += 1
+        if progress is not None:
+            progress["tool_rounds"] = rounds
+        started = time.perf_counter()
+        tool_message, tool_calls, parallel = _execute_tool_round(final.content, namespace)
+        _record_round(rounds, model_seconds, time.perf_counter() - started, tool_calls, parallel)
+        messages += [{"role": "assistant", "content": final.content}, tool_message]
+
+def tool_loop_stats():
+    with _usage_lock:
+        stats = dict(_tool_stats)
+    rounds = stats.pop('rounds')
+    model_seconds = stats.pop('total_model_seconds')
+    tool_seconds = stats.pop('total_tool_seconds')
+    stats.update({
+        'rounds': rounds,
+        'max_rounds': MAX_TOOL_ROUNDS,
+        'avg_model_ms': round(model_seconds / rounds * 1000, 3) if rounds else 0.0,
+        'avg_tools_ms': round(tool_seconds / rounds * 1000, 3) if rounds else 0.0,
+    })
+    return stats
+
+def get_claude_response(messages, system_prompt=None, custom_ai_id=None, model=None, temperature=None, max_tokens=4096, memory_namespace=None, served=None):
     """
     Envia mensagens para Claude e retorna a resposta
     
@@ -173,6 +412,8 @@ def get_claude_response(messages, system_prompt=None, custom_ai_id=None, model=N
         model: Modelo a usar (opcional, usa primeiro disponível se não especificar)
         temperature: Temperatura da resposta (0-1)
         max_tokens: Máximo de tokens na resposta
+        memory_namespace: Namespace do tool `memory` (ver utils.memory_store.memory_namespace)
+        served: Dicionário opcional que recebe em "model" o modelo que respondeu
     
     Returns:
         Resposta do Claude como string
@@ -208,98 +449,60 @@ def get_claude_response(messages, system_prompt=None, custom_ai_id=None, model=N
         final_max_tokens = max_tokens
         final_model = model
         
-        # Se modelo específico fornecido, usar somente esse
-        models_to_try = [final_model] if final_model else MODEL_OPTIONS
+        # Só o modelo pedido; sem modelo, os saudáveis de MODEL_OPTIONS
+        models_to_try = _candidate_models(final_model)
         
         last_error = None
         
         for model_name in models_to_try:
+            progress = {"tool_rounds": 0}
             try:
                 params = {
                     "model": model_name,
                     "max_tokens": final_max_tokens,
                     "temperature": final_temperature,
                     "messages": formatted_messages,
-                    "system": final_system_prompt,
-                    "tools": [{"type": "memory_20250818", "name": "memory"}],
+                    "system": _system_blocks(final_system_prompt),
+                    "tools": _tools(),
                 }
 
-                response = client.messages.create(**params)
-
-                has_tool = False
-                tool_results = []
-                for item in response.content or []:
-                    if hasattr(item, "type") and item.type == "tool_use" and getattr(item, "name", "") == "memory":
-                        has_tool = True
-                        res = execute_memory_tool(getattr(item, "input", {}) or {})
-                        tool_results.append({
-                            "role": "user",
-                            "content": [{
-                                "type": "tool_result",
-                                "tool_use_id": getattr(item, "id", ""),
-                                "content": res
-                            }]
-                        })
-
-                if has_tool and tool_results:
-                    follow_messages = formatted_messages + [{"role": "assistant", "content": response.content}] + tool_results
-                    follow = client.messages.create(
-                        model=model_name,
-                        max_tokens=final_max_tokens,
-                        temperature=final_temperature,
-                        messages=follow_messages,
-                        system=final_system_prompt,
-                        tools=[{"type": "memory_20250818", "name": "memory"}],
-                    )
-                    parts = []
-                    for it in follow.content or []:
-                        if hasattr(it, "type") and it.type == "text":
-                            parts.append(getattr(it, "text", "") or "")
-                    if parts:
-                        return "\n\n".join(parts)
-
-                parts = []
-                for it in response.content or []:
-                    if hasattr(it, "type") and it.type == "text":
-                        parts.append(getattr(it, "text", "") or "")
-                if parts:
-                    return "\n\n".join(parts)
+                text = _run_tool_loop(params, memory_namespace, progress)
+                _mark_served(served, model_name)
+                if text:
+                    return text
                 return "Desculpe, não consegui gerar uma resposta."
                     
             except Exception as model_error:
-                error_str = str(model_error)
-
-                # Se erro for de modelo não encontrado ou erro interno da API, tentar próximo
-                if (
-                    "not_found_error" in error_str.lower()
-                    or "404" in error_str
-                    or "model" in error_str.lower()
-                    or "internal server error" in error_str.lower()
-                    or "api_error" in error_str.lower()
-                ):
+                # Modelo indisponível, sobrecarregado ou com erro interno: tentar o próximo,
+                # desde que nenhuma rodada de tools tenha rodado (não repetir efeitos do `memory`)
+                if progress["tool_rounds"] == 0 and classify_error(model_error) in FALLBACK_ERRORS:
+                    if model_name != models_to_try[-1]:
+                        logger.warning(f'Claude model {model_name} failed ({classify_error(model_error)}), falling back')
                     last_error = model_error
                     continue
-                else:
-                    raise
+                raise
         
         # Se nenhum modelo funcionou
         if last_error:
+            if classify_error(last_error) in RETRYABLE_ERRORS:
+                raise last_error
             raise Exception(f"Nenhum modelo disponível. Verifique sua conta Anthropic. Último erro: {str(last_error)}")
             
     except Exception as e:
         error_msg = str(e)
+        kind = classify_error(e)
         
         # Tratar erros específicos
-        if "api_key" in error_msg.lower() or "authentication" in error_msg.lower():
+        if kind == 'auth':
             raise Exception("Erro de autenticação com a API do Claude. Verifique se ANTHROPIC_API_KEY está correta.")
-        elif "rate_limit" in error_msg.lower() or "rate limit" in error_msg.lower():
+        elif kind == 'rate_limit':
             raise Exception("Limite de requisições excedido. Aguarde alguns minutos.")
-        elif "overloaded" in error_msg.lower():
+        elif kind == 'overloaded':
             raise Exception("Servidor Claude sobrecarregado. Tente novamente em alguns minutos.")
         else:
             raise Exception(f"Erro ao comunicar com Claude: {error_msg}")
 
-def get_streaming_response(messages, system_prompt=None, custom_ai_id=None, model=None, temperature=None, max_tokens=4096):
+def get_streaming_response(messages, system_prompt=None, custom_ai_id=None, model=None, temperature=None, max_tokens=4096, memory_namespace=None, served=None):
     """
     Envia mensagens para Claude e retorna resposta em streaming
     
@@ -310,6 +513,8 @@ def get_streaming_response(messages, system_prompt=None, custom_ai_id=None, mode
         model: Modelo a usar
         temperature: Temperatura
         max_tokens: Máximo de tokens
+        memory_namespace: Namespace do tool `memory`
+        served: Dicionário opcional que recebe em "model" o modelo que respondeu
     
     Yields:
         Chunks de texto da resposta
@@ -338,18 +543,192 @@ def get_streaming_response(messages, system_prompt=None, custom_ai_id=None, mode
         final_system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         final_temperature = temperature if temperature is not None else 0.7
         final_max_tokens = max_tokens
-        final_model = model or MODEL_OPTIONS[0]
         
-        with client.messages.stream(
-            model=final_model,
-            max_tokens=final_max_tokens,
-            temperature=final_temperature,
-            messages=formatted_messages,
-            system=final_system_prompt
-        ) as stream:
-            for text in stream.text_stream:
-                yield text
+        # Mesma ordem de get_claude_response, mas a troca de modelo só vale
+        # antes do primeiro trecho (o cliente não recebe duas respostas)
+        models_to_try = _candidate_models(model)
+        
+        last_error = None
+        
+        for model_name in models_to_try:
+            params = {
+                "model": model_name,
+                "max_tokens": final_max_tokens,
+                "temperature": final_temperature,
+                "messages": formatted_messages,
+                "system": _system_blocks(final_system_prompt),
+                "tools": _tools(),
+            }
+            progress = {"tool_rounds": 0}
+            chunks = _stream_tool_loop(params, memory_namespace, progress)
+            emitted = False
+            try:
+                for text in chunks:
+                    _mark_served(served, model_name)
+                    emitted = emitted or bool(text)
+                    yield text
+                return
+            except Exception as model_error:
+                # Decide pelo erro original, antes de ser reembrulhado abaixo.
+                # Depois de uma rodada de tools não troca: repetiria os efeitos do `memory`
+                started = emitted or progress["tool_rounds"] > 0
+                if not started and classify_error(model_error) in FALLBACK_ERRORS:
+                    if model_name != models_to_try[-1]:
+                        logger.warning(f'Claude model {model_name} failed ({classify_error(model_error)}) before streaming, falling back')
+                    last_error = model_error
+                    continue
+                raise
+            finally:
+                chunks.close()
+        
+        if last_error:
+            raise last_error
                 
     except Exception as e:
         error_msg = str(e)
-        raise Exception(f"Erro ao fazer streaming com Claude: {error_msg}")
\ No newline at end of file
+        raise Exception(f"Erro ao fazer streaming com Claude: {error_msg}")
+
+def _completion_request(messages, model_name, system_prompt=None, temperature=None, max_tokens=1024):
+    request = {
+        "model": model_name,
+        "max_tokens": max_tokens,
+        "messages": [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in messages],
+    }
+    if system_prompt:
+        request["system"] = system_prompt
+    if temperature is not None:
+        request["temperature"] = temperature
+    return request
+
+def get_completion(messages, model=None, system_prompt=None, temperature=None, max_tokens=1024, served=None):
+    """
+    Completion simples (sem prompt padrão e sem ferramentas), usada pelas
+    operações de texto. Usa o mesmo fallback e circuit breaker de get_claude_response.
+
+    Returns:
+        Texto da resposta
+    """
+    last_error = None
+    for model_name in _candidate_models(model):
+        request = _completion_request(messages, model_name, system_prompt, temperature, max_tokens)
+        try:
+            response = _create_message(request)
+            _record_usage(model_name, getattr(response, "usage", None))
+            _mark_served(served, model_name)
+            return _text_of(response.content)
+        except Exception as e:
+            if classify_error(e) in FALLBACK_ERRORS:
+                last_error = e
+                continue
+            raise
+    if last_error:
+        raise last_error
+    raise Exception("Nenhum modelo disponível")
+
+def _stream_text(request):
+    """Trechos de texto de messages.stream, com novas tentativas (429/529) antes do primeiro trecho"""
+    model_name = request["model"]
+    key = _health_key(model_name)
+    attempt = 0
+    while True:
+        model_health.acquire(key)
+        started = time.perf_counter()
+        emitted = False
+        try:
+            with _api.messages.stream(**request) as stream:
+                for text in stream.text_stream:
+                    emitted = emitted or bool(text)
+                    yield text
+                final = stream.get_final_message()
+        except GeneratorExit:
+            # Cliente desistiu: sair do `with` fecha a conexão e a geração para
+            model_health.release(key)
+            raise
+        except Exception as e:
+            delay = _on_error(model_name, e, started, attempt, can_retry=not emitted)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        model_health.record_success(key, time.perf_counter() - started)
+        _record_usage(model_name, getattr(final, "usage", None))
+        return
+
+def stream_completion(messages, model=None, system_prompt=None, temperature=None, max_tokens=1024, served=None):
+    """
+    Versão em streaming de get_completion (messages.stream). Troca de modelo
+    só antes do primeiro trecho; fechar o gerador encerra a requisição à API.
+
+    Yields:
+        Trechos de texto da resposta
+    """
+    last_error = None
+    for model_name in _candidate_models(model):
+        request = _completion_request(messages, model_name, system_prompt, temperature, max_tokens)
+        chunks = _stream_text(request)
+        emitted = False
+        try:
+            for text in chunks:
+                _mark_served(served, model_name)
+                emitted = emitted or bool(text)
+                yield text
+            return
+        except Exception as e:
+            if not emitted and classify_error(e) in FALLBACK_ERRORS:
+                last_error = e
+                continue
+            raise
+        finally:
+            chunks.close()
+    if last_error:
+        raise last_error
+    raise Exception("Nenhum modelo disponível")
+
+def create_message_batch(requests):
+    """
+    Envia um lote para a Message Batches API (processamento assíncrono, em
+    até 24h e com custo menor que chamadas individuais)
+
+    Args:
+        requests: Lista de {"custom_id", "params"} no formato de messages.create
+
+    Returns:
+        Id do lote na Anthropic
+    """
+    batch = client.messages.batches.create(requests=requests)
+    return batch.id
+
+def cancel_message_batch(batch_id):
+    """Cancela um lote em andamento (pedidos ainda não processados não são cobrados)"""
+    client.messages.batches.cancel(batch_id)
+
+def get_message_batch(batch_id):
+    """Estado do lote: {'status': 'in_progress' | 'canceling' | 'ended', 'counts': {...}}"""
+    batch = client.messages.batches.retrieve(batch_id)
+    counts = batch.request_counts
+    return {
+        'status': batch.processing_status,
+        'counts': {
+            key: int(getattr(counts, key, 0) or 0)
+            for key in ('processing', 'succeeded', 'errored', 'canceled', 'expired')
+        }
+    }
+
+def message_batch_results(batch_id):
+    """
+    Resultados de um lote encerrado
+
+    Returns:
+        {custom_id: (texto, None)} para sucessos e {custom_id: (None, tipo)} para
+        erros ('errored', 'canceled' ou 'expired')
+    """
+    results = {}
+    for entry in client.messages.batches.results(batch_id):
+        result = entry.result
+        if result.type == "succeeded":
+            _record_usage(result.message.model, getattr(result.message, "usage", None))
+            results[entry.custom_id] = (_text_of(result.message.content), None)
+        else:
+            results[entry.custom_id] = (None, result.type)
+    return results
@@ -0,0 +1,217 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from config.supabase_config import supabase
+from utils.cache import TTLCache
+from utils import summary_generator
+from utils.background import background_tasks
+
+logger = logging.getLogger(__name__)
+
+# Caracteres por token (estimativa conservadora para texto em português)
+CHARS_PER_TOKEN = {
+    'anthropic': 3.5,
+    'groq': 3.8,
+    'google': 4.0,
+}
+
+# Overhead aproximado de cada mensagem (papel, delimitadores)
+TOKENS_PER_MESSAGE = 4
+
+DEFAULT_CONTEXT_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '24000'))
+
+# Orçamento de tokens de histórico por modelo (entrada, sem o system prompt)
+CONTEXT_BUDGETS = {
+    'claude-sonnet-4-5': DEFAULT_CONTEXT_BUDGET,
+    'claude-opus-4-1': DEFAULT_CONTEXT_BUDGET,
+    'gemini-1.5-pro': DEFAULT_CONTEXT_BUDGET,
+    'gemini-1.5-flash': DEFAULT_CONTEXT_BUDGET,
+    'gemini-3-pro-preview': DEFAULT_CONTEXT_BUDGET,
+    # Limites de tokens por minuto da Groq são bem menores
+    'llama-3.3-70b-versatile': int(os.getenv('GROQ_CONTEXT_TOKEN_BUDGET', '6000')),
+}
+
+# Fração do orçamento reservada para o resumo das mensagens antigas
+SUMMARY_BUDGET_RATIO = 0.2
+
+# O corte do histórico avança em blocos de N mensagens, para que o resumo
+# seja recalculado só de tempos em tempos e não a cada turno
+SUMMARY_STEP = int(os.getenv('CONTEXT_SUMMARY_STEP', '10'))
+
+SUMMARY_PREFIX = '[Resumo da conversa anterior]'
+SUMMARY_ACK = 'Entendido. Vou considerar esse contexto.'
+
+_summary_cache = TTLCache(maxsize=1024, ttl=3600, name='conversation_summaries')
+
+# Conversas com resumo sendo gerado neste worker
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def estimate_tokens(text, provider='anthropic'):
+    """Estimativa de tokens de um texto para o provedor"""
+    ratio = CHARS_PER_TOKEN.get(provider, 4.0)
+    return int(len(text or '') / ratio) + 1
+
+def count_message_tokens(message, provider='anthropic'):
+    content = message.get('content', '')
+    if not isinstance(content, str):
+        content = str(content)
+    return estimate_tokens(content, provider) + TOKENS_PER_MESSAGE
+
+def get_context_budget(model):
+    return CONTEXT_BUDGETS.get(model or '', DEFAULT_CONTEXT_BUDGET)
+
+def _load_summary(conversation_id):
+    cached = _summary_cache.get(conversation_id)
+    if cached is not None:
+        return cached
+    try:
+        res = supabase.table('conversation_summaries') \
+            .select('summary, covered_messages') \
+            .eq('conversation_id', conversation_id) \
+            .limit(1) \
+            .execute()
+    except Exception as e:
+        logger.error(f'Error loading conversation summary: {str(e)}')
+        return None
+    state = None
+    if res.data:
+        state = {
+            'summary': res.data[0].get('summary') or '',
+            'covered': int(res.data[0].get('covered_messages') or 0)
+        }
+        _summary_cache.set(conversation_id, state)
+    return state
+
+def _save_summary(conversation_id, state):
+    _summary_cache.set(conversation_id, state)
+    try:
+        supabase.table('conversation_summaries').upsert({
+            'conversation_id': conversation_id,
+            'summary': state['summary'],
+            'covered_messages': state['covered'],
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }).execute()
+    except Exception as e:
+        logger.error(f'Error saving conversation summary: {str(e)}')
+
+def _refresh_summary(conversation_id, messages):
+    """Estende o resumo salvo até cobrir todas as `messages` (roda em segundo plano)"""
+    with _refreshing_lock:
+        if conversation_id in _refreshing:
+            return
+        _refreshing.add(conversation_id)
+    try:
+        state = _load_summary(conversation_id)
+        if state and state['covered'] >= len(messages):
+            return
+        previous = state['summary'] if state else None
+        start = state['covered'] if state else 0
+        summary = summary_generator.summarize_conversation(messages[start:], previous_summary=previous)
+        if summary:
+            _save_summary(conversation_id, {'summary': summary, 'covered': len(messages)})
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(conversation_id)
+
+def _summary_for(conversation_id, messages, cut):
+    """
+    Retorna (resumo, corte) com o resumo salvo e as mensagens que ele cobre.
+
+    Se o resumo salvo não chega até `cut`, agenda a atualização em segundo
+    plano (uma por conversa) e devolve o resumo anterior com o corte antigo.
+    """
+    state = _load_summary(conversation_id)
+    if state and state['covered'] >= cut:
+        # Resumo salvo já cobre ao menos o corte pedido
+        return state['summary'], min(state['covered'], len(messages) - 1)
+
+    background_tasks.submit(
+        _refresh_summary, conversation_id, messages[:cut],
+        key=('conversation_summary', conversation_id)
+    )
+    if not state:
+        return None, 0
+    return state['summary'], state['covered']
+
+def _window_start(costs, budget):
+    """Índice da primeira mensagem da janela mais recente que cabe em `budget`"""
+    used = 0
+    cut = len(costs) - 1
+    for i in range(len(costs) - 1, -1, -1):
+        if used + costs[i] > budget and i < len(costs) - 1:
+            break
+        used += costs[i]
+        cut = i
+    return cut
+
+def build_context(messages, provider, model=None, conversation_id=None, budget=None):
+    """
+    Ajusta o histórico ao orçamento de tokens do modelo.
+
+    Mantém os turnos mais recentes que cabem no orçamento. Com
+    `conversation_id`, os turnos antigos são substituídos por um resumo
+    acumulado salvo em `conversation_summaries`; sem ele, são descartados.
+    O resumo cobre as N primeiras mensagens, então só passe
+    `conversation_id` para históricos lidos do banco (ordem estável).
+    Quando o corte avança, o resumo é estendido em segundo plano; até lá
+    usa o resumo anterior e uma janela maior (até o orçamento inteiro).
+
+    Returns:
+        Lista de mensagens pronta para o provedor
+    """
+    if not messages:
+        return messages
+
+    budget = budget or get_context_budget(model)
+    costs = [count_message_tokens(m, provider) for m in messages]
+    if sum(costs) <= budget:
+        return messages
+
+    window_budget = budget - int(budget * SUMMARY_BUDGET_RATIO) if conversation_id else budget
+
+    # Janela mais recente que cabe no orçamento (a última mensagem sempre entra)
+    cut = _window_start(costs, window_budget)
+
+    summary = None
+    if conversation_id and cut > 0:
+        # Arredonda o corte para cima em blocos de SUMMARY_STEP
+        step_cut = min(len(messages) - 1, -(-cut // SUMMARY_STEP) * SUMMARY_STEP)
+        summary, covered = _summary_for(conversation_id, messages, step_cut)
+        if summary and covered >= cut:
+            cut = covered
+        else:
+            # Resumo ainda não alcançou o corte: janela maior, com o orçamento
+            # inteiro menos o resumo anterior (se houver)
+            summary_cost = estimate_tokens(summary, provider) if summary else 0
+            cut = max(covered, _window_start(costs, budget - summary_cost))
+
+    # A janela precisa começar com uma mensagem do usuário. Com resumo, recua
+    # (repete no máximo um turno já resumido); sem resumo, avança.
+    if summary:
+        while cut > 0 and messages[cut].get('role') != 'user':
+            cut -= 1
+    else:
+        while cut < len(messages) - 1 and messages[cut].get('role') != 'user':
+            cut += 1
+
+    window = messages[cut:]
+    logger.info('Context trimmed', extra={
+        'conversation_id': conversation_id,
+        'model': model,
+        'dropped_messages': cut,
+        'kept_messages': len(window),
+        'summarized': bool(summary)
+    })
+
+    if not summary:
+        return window
+
+    return [
+        {'role': 'user', 'content': f'{SUMMARY_PREFIX}\n{summary}'},
+        {'role': 'assistant', 'content': SUMMARY_ACK},
+    ] + window
+
+def summary_cache_stats():
+    return _summary_cache.stats()
@@ -0,0 +1,81 @@
+import os
+import threading
+from config.supabase_config import supabase
+from utils.cache import TTLCache
+from utils.pagination import keyset_filter
+
+# Histórico por conversa: {'messages': [{role, content}], 'last_id', 'last_created_at'}
+_history_cache = TTLCache(
+    maxsize=int(os.getenv('HISTORY_CACHE_SIZE', '1024')),
+    ttl=int(os.getenv('HISTORY_CACHE_TTL', '900')),
+    name='conversation_history'
+)
+_lock = threading.Lock()
+
+def _to_turn(row):
+    return {'role': row.get('role'), 'content': row.get('content') or ''}
+
+def _fetch_rows(conversation_id, last_created_at=None, last_id=None):
+    query = supabase.table('messages') \
+        .select('id, role, content, created_at') \
+        .eq('conversation_id', conversation_id)
+    if last_created_at is not None and last_id is not None:
+        query = query.or_(keyset_filter('created_at', last_created_at, last_id, desc=False))
+    return query \
+        .order('created_at', desc=False) \
+        .order('id', desc=False) \
+        .execute().data or []
+
+def _apply_rows(entry, rows):
+    for row in rows:
+        entry['messages'].append(_to_turn(row))
+        entry['last_id'] = row.get('id')
+        entry['last_created_at'] = row.get('created_at')
+
+def load_history(conversation_id):
+    """
+    Retorna o histórico [{role, content}] da conversa.
+
+    Na primeira chamada lê todas as mensagens; depois busca só as mensagens
+    posteriores à última conhecida, o que mantém o cache correto mesmo
+    quando outro worker gravou mensagens na conversa.
+    """
+    entry = _history_cache.get(conversation_id)
+    if entry is None:
+        entry = {'messages': [], 'last_id': None, 'last_created_at': None}
+        rows = _fetch_rows(conversation_id)
+    else:
+        rows = _fetch_rows(conversation_id, entry['last_created_at'], entry['last_id'])
+
+    with _lock:
+        if rows:
+            entry = {
+                'messages': list(entry['messages']),
+                'last_id': entry['last_id'],
+                'last_created_at': entry['last_created_at']
+            }
+            _apply_rows(entry, rows)
+        _history_cache.set(conversation_id, entry)
+        return [dict(m) for m in entry['messages']]
+
+def append_history(conversation_id, rows):
+    """Acrescenta linhas recém-inseridas em `messages` ao histórico em cache"""
+    if not rows:
+        return
+    with _lock:
+        entry = _history_cache.get(conversation_id)
+        if entry is None:
+            return
+        entry = {
+            'messages': list(entry['messages']),
+            'last_id': entry['last_id'],
+            'last_created_at': entry['last_created_at']
+        }
+        _apply_rows(entry, rows)
+        _history_cache.set(conversation_id, entry)
+
+def invalidate_history(conversation_id):
+    _history_cache.invalidate(conversation_id)
+
+def history_cache_stats():
+    return _history_cache.stats()
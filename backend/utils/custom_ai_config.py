@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+from config.supabase_config import supabase
+from utils.cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Configuração de cada IA personalizada (linha de custom_ais), usada por todos
+# os provedores. Invalidada em update/delete; o TTL limita a defasagem entre
+# workers, que não enxergam as invalidações uns dos outros.
+_config_cache = TTLCache(
+    maxsize=int(os.getenv('CUSTOM_AI_CACHE_SIZE', '1024')),
+    ttl=int(os.getenv('CUSTOM_AI_CACHE_TTL', '300')),
+    name='custom_ai_config'
+)
+
+# Versão das configurações, incrementada a cada invalidação. Uma leitura que
+# começou antes de uma invalidação não grava no cache a configuração antiga.
+_version = 0
+_lock = threading.Lock()
+
+def _current_version():
+    with _lock:
+        return _version
+
+def _store(custom_ai_id, config, version):
+    with _lock:
+        if _version != version:
+            return
+        _config_cache.set(str(custom_ai_id), config)
+
+def get_custom_ai_config(custom_ai_id):
+    """
+    Configuração da IA personalizada (cacheada)
+
+    Args:
+        custom_ai_id: ID da IA personalizada
+
+    Returns:
+        Dicionário com a linha de custom_ais ou None
+    """
+    config = _config_cache.get(str(custom_ai_id), MISSING)
+    if config is not MISSING:
+        return config
+
+    version = _current_version()
+    try:
+        result = supabase.table('custom_ais').select('*').eq('id', custom_ai_id).limit(1).execute()
+    except Exception as e:
+        logger.error(f'Error loading custom AI config: {str(e)}')
+        return None
+    config = result.data[0] if result.data else None
+    _store(custom_ai_id, config, version)
+    return config
+
+def get_conversation_with_config(conversation_id):
+    """
+    Conversa de agente e configuração da IA em uma única leitura (embed do
+    PostgREST via custom_ai_conversations.custom_ai_id). A configuração
+    lida entra no cache para as chamadas seguintes.
+
+    Returns:
+        (conversa, configuração) ou (None, None) se a conversa não existe
+    """
+    version = _current_version()
+    res = supabase.table('custom_ai_conversations') \
+        .select('id, custom_ai_id, tenant_id, custom_ais(*)') \
+        .eq('id', conversation_id) \
+        .limit(1) \
+        .execute()
+    if not res.data:
+        return None, None
+
+    conversation = dict(res.data[0])
+    config = conversation.pop('custom_ais', None)
+    # Embed de relação muitos-para-um vem como objeto, mas aceita lista
+    if isinstance(config, list):
+        config = config[0] if config else None
+    if config and conversation.get('custom_ai_id'):
+        _store(conversation['custom_ai_id'], config, version)
+    return conversation, config
+
+def invalidate_custom_ai(custom_ai_id):
+    """Descarta a configuração cacheada (chamar após alterar ou remover a IA)"""
+    global _version
+    with _lock:
+        _version += 1
+        _config_cache.invalidate(str(custom_ai_id))
+
+def custom_ai_cache_stats():
+    return _config_cache.stats()
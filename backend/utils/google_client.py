@@ -1,7 +1,12 @@
 import os
+import hashlib
+import threading
+import time
 import google.generativeai as genai
 from dotenv import load_dotenv
 from utils.default_prompt import DEFAULT_SYSTEM_PROMPT
+from utils.http_clients import get_http_client
+from utils.cache import TTLCache
 
 load_dotenv()
 
@@ -10,7 +15,11 @@ GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 if not GOOGLE_API_KEY:
     raise ValueError("GOOGLE_API_KEY deve estar definida no arquivo .env")
 
-genai.configure(api_key=GOOGLE_API_KEY)
+# 'rest' usa HTTP comum em vez de gRPC; necessário com workers gevent,
+# já que o gRPC não coopera com o monkey patching (ver gunicorn.conf.py)
+GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT') or None
+
+genai.configure(api_key=GOOGLE_API_KEY, transport=GEMINI_TRANSPORT)
 
 # Configurações de segurança padrão
 SAFETY_SETTINGS = [
@@ -32,9 +41,62 @@ SAFETY_SETTINGS = [
     },
 ]
 
-def get_google_response(messages, system_prompt=None, model=None, temperature=None, max_tokens=2048):
+# Instâncias de GenerativeModel reutilizadas entre chamadas, indexadas por
+# (modelo, generation_config, hash do system prompt)
+_model_cache = TTLCache(
+    maxsize=int(os.getenv('GEMINI_MODEL_CACHE_SIZE', '64')),
+    name='gemini_models'
+)
+_model_stats_lock = threading.Lock()
+_model_stats = {'constructed': 0, 'reused': 0, 'construction_seconds': 0.0}
+
+def _get_model_instance(model_name, generation_config, system_prompt):
+    """Retorna um GenerativeModel configurado, construindo-o só no primeiro uso"""
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    key = (model_name, tuple(sorted(generation_config.items())), prompt_hash)
+
+    instance = _model_cache.get(key)
+    if instance is not None:
+        with _model_stats_lock:
+            _model_stats['reused'] += 1
+        return instance
+
+    started = time.perf_counter()
+    instance = genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        system_instruction=system_prompt,
+        safety_settings=SAFETY_SETTINGS
+    )
+    elapsed = time.perf_counter() - started
+
+    with _model_stats_lock:
+        _model_stats['constructed'] += 1
+        _model_stats['construction_seconds'] += elapsed
+    _model_cache.set(key, instance)
+    return instance
+
+def model_cache_stats():
+    """Estatísticas do cache de modelos, incluindo tempo de construção economizado"""
+    with _model_stats_lock:
+        constructed = _model_stats['constructed']
+        reused = _model_stats['reused']
+        total_seconds = _model_stats['construction_seconds']
+    avg_ms = (total_seconds / constructed) * 1000 if constructed else 0.0
+    stats = _model_cache.stats()
+    stats.update({
+        'constructed': constructed,
+        'reused': reused,
+        'avg_construction_ms': round(avg_ms, 3),
+        'construction_ms_saved': round(avg_ms * reused, 3)
+    })
+    return stats
+
+def get_google_response(messages, system_prompt=None, model=None, temperature=None, max_tokens=2048, stream=False):
     """
     Envia mensagens para o Google Gemini e retorna a resposta
+
+    Se stream=True, retorna um gerador com os trechos de texto da resposta
     """
     try:
         final_model = model or 'gemini-1.5-pro'
@@ -56,12 +118,7 @@ def get_google_response(messages, system_prompt=None, model=None, temperature=No
         # Configurar prompt do sistema
         final_system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
         
-        model_instance = genai.GenerativeModel(
-            model_name=final_model,
-            generation_config=generation_config,
-            system_instruction=final_system_prompt,
-            safety_settings=SAFETY_SETTINGS
-        )
+        model_instance = _get_model_instance(final_model, generation_config, final_system_prompt)
 
         # Converter histórico de mensagens para o formato do Gemini
         # Gemini usa: [{'role': 'user', 'parts': ['text']}, {'role': 'model', 'parts': ['text']}]
@@ -86,6 +143,9 @@ def get_google_response(messages, system_prompt=None, model=None, temperature=No
             history=history
         )
 
+        if stream:
+            return _stream_google_response(chat_session, last_user_message)
+
         # Enviar a última mensagem
         response = chat_session.send_message(last_user_message)
         
@@ -94,6 +154,36 @@ def get_google_response(messages, system_prompt=None, model=None, temperature=No
     except Exception as e:
         raise Exception(f"Erro ao comunicar com Google Gemini: {str(e)}")
 
+def _stream_google_response(chat_session, message):
+    """Gera os trechos de texto de uma resposta do Gemini em streaming"""
+    response = None
+    try:
+        response = chat_session.send_message(message, stream=True)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk sem texto (ex.: bloqueado por segurança)
+                continue
+            if text:
+                yield text
+    except GeneratorExit:
+        _cancel_stream(response)
+        raise
+    except Exception as e:
+        raise Exception(f"Erro ao fazer streaming com Google Gemini: {str(e)}")
+
+def _cancel_stream(response):
+    """Encerra o stream do Gemini quando o cliente desiste (melhor esforço: o SDK não expõe cancelamento)"""
+    iterator = getattr(response, '_iterator', None)
+    cancel = getattr(iterator, 'cancel', None) or getattr(iterator, 'close', None)
+    if cancel:
+        try:
+            cancel()
+        except Exception:
+            # A conexão é descartada de qualquer forma quando o iterador sai de escopo
+            pass
+
 def generate_image_with_google(prompt, width=1024, height=1024):
     """
     Gera imagem usando Google Imagen (Nano Banana)
@@ -146,11 +236,11 @@ def generate_image_with_google(prompt, width=1024, height=1024):
         # Atualmente (Nov 2025), a API do Google AI Studio suporta geração de imagens via REST
         # POST https://generativelanguage.googleapis.com/v1beta/models/imagen-4.0-fast-generate-001:predict
         
-        import requests
+        # Cliente HTTP compartilhado (pool de conexões e keep-alive)
+        http_client = get_http_client('google')
         
         # Usando o modelo 'imagen-4.0-fast-generate-001' que está disponível na lista
         model_name = 'imagen-4.0-fast-generate-001'
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:predict?key={GOOGLE_API_KEY}"
         
         headers = {
             "Content-Type": "application/json"
@@ -169,14 +259,13 @@ def generate_image_with_google(prompt, width=1024, height=1024):
             }
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = http_client.post(f"/models/{model_name}:predict", params={"key": GOOGLE_API_KEY}, headers=headers, json=payload)
         
         if response.status_code != 200:
             # Tentar outro modelo se o fast falhar
             if "not found" in response.text.lower():
                  model_name = 'imagen-4.0-generate-001'
-                 url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:predict?key={GOOGLE_API_KEY}"
-                 response = requests.post(url, headers=headers, json=payload)
+                 response = http_client.post(f"/models/{model_name}:predict", params={"key": GOOGLE_API_KEY}, headers=headers, json=payload)
                  
             if response.status_code != 200:
                 raise Exception(f"Erro na API do Google ({model_name}): {response.text}")
@@ -1,6 +1,6 @@
 import os
-import httpx
 from dotenv import load_dotenv
+from utils.http_clients import get_http_client, provider_timeout
 from utils.default_prompt import DEFAULT_SYSTEM_PROMPT
 import json
 
@@ -9,6 +9,7 @@ load_dotenv()
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 LLAMA_GUARD_ENABLED = os.getenv('LLAMA_GUARD_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes')
 LLAMA_GUARD_MODEL = os.getenv('LLAMA_GUARD_MODEL', 'meta-llama/llama-guard-4-12b')
+GROQ_CHAT_PATH = '/chat/completions'
 
 def get_groq_response(messages, system_prompt=None, model=None, temperature=None, max_tokens=1024, top_p=1, stop=None, stream=False):
     if not GROQ_API_KEY:
@@ -41,16 +42,44 @@ def get_groq_response(messages, system_prompt=None, model=None, temperature=None
         'Content-Type': 'application/json'
     }
 
-    with httpx.Client(timeout=120) as client:
-        resp = client.post('https://api.groq.com/openai/v1/chat/completions', json=payload, headers=headers)
+    if stream:
+        return _stream_groq_response(payload, headers)
+
+    client = get_http_client('groq')
+    resp = client.post(GROQ_CHAT_PATH, json=payload, headers=headers)
+    if resp.status_code >= 400:
+        raise Exception(f'Groq API error: {resp.text}')
+    body = resp.json() or {}
+    choices = body.get('choices') or []
+    if not choices:
+        return ''
+    message = choices[0].get('message') or {}
+    return message.get('content') or ''
+
+def _stream_groq_response(payload, headers):
+    """Lê o stream SSE da Groq e gera os trechos de texto conforme chegam"""
+    client = get_http_client('groq')
+    with client.stream('POST', GROQ_CHAT_PATH, json=payload, headers=headers) as resp:
         if resp.status_code >= 400:
+            resp.read()
             raise Exception(f'Groq API error: {resp.text}')
-        body = resp.json() or {}
-        choices = body.get('choices') or []
-        if not choices:
-            return ''
-        message = choices[0].get('message') or {}
-        return message.get('content') or ''
+        for line in resp.iter_lines():
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            choices = chunk.get('choices') or []
+            if not choices:
+                continue
+            delta = choices[0].get('delta') or {}
+            text = delta.get('content')
+            if text:
+                yield text
 
 def llama_guard_check(text):
     """Classifica texto com Llama Guard 4 12B. Retorna dict: { allowed: bool, reason: str, categories: list }"""
@@ -82,28 +111,28 @@ def llama_guard_check(text):
         'Content-Type': 'application/json'
     }
 
-    with httpx.Client(timeout=60) as client:
-        resp = client.post('https://api.groq.com/openai/v1/chat/completions', json=payload, headers=headers)
-        if resp.status_code >= 400:
-            # Em caso de erro na moderação, considere permitido para não bloquear indevidamente
-            return { 'allowed': True, 'reason': 'guard_error', 'categories': [] }
-        body = resp.json() or {}
-        choices = body.get('choices') or []
-        content_str = ''
-        if choices:
-            msg = choices[0].get('message') or {}
-            content_str = (msg.get('content') or '').strip()
-        try:
-            data = json.loads(content_str)
-            allowed = bool(data.get('allowed', True))
-            cats = data.get('categories') or []
-            reason = str(data.get('reason') or '')
-            if not isinstance(cats, list):
-                cats = [str(cats)]
-            return { 'allowed': allowed, 'reason': reason, 'categories': cats }
-        except Exception:
-            # Heurística simples
-            low = content_str.lower()
-            if 'false' in low or 'not allowed' in low or 'blocked' in low or 'unsafe' in low:
-                return { 'allowed': False, 'reason': 'unsafe', 'categories': [] }
-            return { 'allowed': True, 'reason': 'ok', 'categories': [] }
\ No newline at end of file
+    client = get_http_client('groq')
+    resp = client.post(GROQ_CHAT_PATH, json=payload, headers=headers, timeout=provider_timeout('groq', read=60))
+    if resp.status_code >= 400:
+        # Em caso de erro na moderação, considere permitido para não bloquear indevidamente
+        return { 'allowed': True, 'reason': 'guard_error', 'categories': [] }
+    body = resp.json() or {}
+    choices = body.get('choices') or []
+    content_str = ''
+    if choices:
+        msg = choices[0].get('message') or {}
+        content_str = (msg.get('content') or '').strip()
+    try:
+        data = json.loads(content_str)
+        allowed = bool(data.get('allowed', True))
+        cats = data.get('categories') or []
+        reason = str(data.get('reason') or '')
+        if not isinstance(cats, list):
+            cats = [str(cats)]
+        return { 'allowed': allowed, 'reason': reason, 'categories': cats }
+    except Exception:
+        # Heurística simples
+        low = content_str.lower()
+        if 'false' in low or 'not allowed' in low or 'blocked' in low or 'unsafe' in low:
+            return { 'allowed': False, 'reason': 'unsafe', 'categories': [] }
+        return { 'allowed': True, 'reason': 'ok', 'categories': [] }
\ No newline at end of file
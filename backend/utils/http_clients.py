@@ -0,0 +1,106 @@
+import atexit
+import importlib.util
+import logging
+import os
+import threading
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 só é habilitado se o pacote h2 estiver instalado
+HTTP2_ENABLED = (
+    os.getenv('HTTP_CLIENT_HTTP2', 'true').strip().lower() in ('1', 'true', 'yes')
+    and importlib.util.find_spec('h2') is not None
+)
+
+# Configuração por provedor: timeouts (segundos) e limites do pool de conexões
+PROVIDERS = {
+    'groq': {
+        'base_url': 'https://api.groq.com/openai/v1',
+        'connect_timeout': 5.0,
+        'read_timeout': 120.0,
+        'max_connections': 100,
+        'max_keepalive_connections': 20,
+    },
+    'replicate': {
+        'base_url': 'https://api.replicate.com/v1',
+        'connect_timeout': 5.0,
+        'read_timeout': 60.0,
+        'max_connections': 20,
+        'max_keepalive_connections': 5,
+    },
+    'google': {
+        'base_url': 'https://generativelanguage.googleapis.com/v1beta',
+        'connect_timeout': 5.0,
+        'read_timeout': 120.0,
+        'max_connections': 20,
+        'max_keepalive_connections': 5,
+    },
+}
+
+KEEPALIVE_EXPIRY = 30.0
+
+# Sobrescritas por ambiente, ex.: GROQ_BASE_URL, GROQ_MAX_CONNECTIONS
+# (com workers gevent um processo mantém muito mais requisições em andamento)
+for _name, _conf in PROVIDERS.items():
+    _prefix = _name.upper()
+    _conf['base_url'] = os.getenv(f'{_prefix}_BASE_URL', _conf['base_url'])
+    _conf['max_connections'] = int(os.getenv(f'{_prefix}_MAX_CONNECTIONS', _conf['max_connections']))
+    _conf['max_keepalive_connections'] = int(
+        os.getenv(f'{_prefix}_MAX_KEEPALIVE_CONNECTIONS', _conf['max_keepalive_connections'])
+    )
+
+_lock = threading.Lock()
+_clients = {}
+_pid = os.getpid()
+
+def provider_timeout(provider, read=None):
+    """Timeout do provedor, opcionalmente com outro limite de leitura"""
+    conf = PROVIDERS[provider]
+    return httpx.Timeout(read or conf['read_timeout'], connect=conf['connect_timeout'])
+
+def _create_client(provider):
+    conf = PROVIDERS[provider]
+    return httpx.Client(
+        base_url=conf['base_url'],
+        http2=HTTP2_ENABLED,
+        timeout=provider_timeout(provider),
+        limits=httpx.Limits(
+            max_connections=conf['max_connections'],
+            max_keepalive_connections=conf['max_keepalive_connections'],
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+
+def get_http_client(provider):
+    """
+    Retorna o cliente HTTP compartilhado (com pool e keep-alive) do provedor
+
+    Os clientes são criados sob demanda e recriados após um fork, para que
+    workers do gunicorn nunca compartilhem conexões do processo pai.
+    """
+    global _pid
+    if provider not in PROVIDERS:
+        raise ValueError(f'Provedor HTTP desconhecido: {provider}')
+
+    with _lock:
+        if _pid != os.getpid():
+            _clients.clear()
+            _pid = os.getpid()
+        client = _clients.get(provider)
+        if client is None or client.is_closed:
+            client = _create_client(provider)
+            _clients[provider] = client
+        return client
+
+def close_http_clients():
+    """Fecha todos os clientes (chamado ao encerrar o processo)"""
+    with _lock:
+        for provider, client in list(_clients.items()):
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f'Error closing HTTP client {provider}: {str(e)}')
+        _clients.clear()
+
+atexit.register(close_http_clients)
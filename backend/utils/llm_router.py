@@ -0,0 +1,319 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from functools import partial
+from models.exceptions import ValidationError, ClientDisconnectedError
+from utils.claude_client import (
+    get_claude_response,
+    get_streaming_response,
+    get_completion,
+    stream_completion
+)
+from utils.custom_ai_config import get_custom_ai_config
+from utils.groq_client import get_groq_response
+from utils.google_client import get_google_response
+from utils import context_builder
+from utils.model_health import model_health
+from utils.cancellation import cancellations, client_disconnected
+from utils.single_flight import SingleFlight
+from utils.model_registry import MODEL_REGISTRY, TIERS, AUTO_MODELS
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_routed = Counter()
+_auto_choices = Counter()
+
+# Chamadas idênticas e simultâneas com temperatura 0 compartilham uma única
+# requisição ao provedor (opt-in: `coalesce=True` ou custom_ais.coalesce_requests)
+_single_flight = SingleFlight(name='llm')
+
+def is_auto(model):
+    return model in AUTO_MODELS
+
+def provider_for(model):
+    """Provedor responsável pelo modelo ('anthropic', 'google' ou 'groq')"""
+    if not model:
+        return 'anthropic'
+    entry = MODEL_REGISTRY.get(model)
+    if entry:
+        return entry['provider']
+    # Modelos fora do registro seguem o prefixo (ids da Groq não têm prefixo fixo)
+    if model.startswith('claude'):
+        return 'anthropic'
+    if model.startswith('gemini'):
+        return 'google'
+    return 'groq'
+
+def _health_key(model):
+    return f'{provider_for(model)}:{model}'
+
+def _tier_candidates(tier):
+    """Modelos do tier com circuito fechado, do mais rápido (p50) ao mais lento"""
+    models = [m for m, entry in MODEL_REGISTRY.items() if entry['tier'] == tier]
+    healthy = set(model_health.ordered([_health_key(m) for m in models]))
+    candidates = [m for m in models if _health_key(m) in healthy]
+
+    def rank(model):
+        p50 = model_health.latency(_health_key(model))
+        # Sem amostras: vai primeiro, para que a latência passe a ser medida
+        return (p50 is not None, p50 or 0.0)
+
+    return sorted(candidates, key=rank)
+
+def resolve_models(model):
+    """
+    Lista de modelos a tentar, em ordem
+
+    Um modelo explícito resulta em [model]; "auto"/"auto:<tier>" resulta nos
+    modelos saudáveis do tier, do mais rápido ao mais lento.
+    """
+    if not is_auto(model):
+        return [model]
+    tier = AUTO_MODELS[model]
+    candidates = _tier_candidates(tier)
+    if not candidates:
+        raise ValidationError(f'Nenhum modelo disponível no tier {tier}')
+    return candidates
+
+def resolve_model(model):
+    """Modelo concreto que atenderá a requisição (resolve "auto")"""
+    return resolve_models(model)[0]
+
+def _record_served(model, served_model, served):
+    """Guarda o modelo que respondeu em `served` e conta as escolhas do auto"""
+    if served is not None:
+        served['model'] = served_model
+    if is_auto(model):
+        with _stats_lock:
+            _auto_choices[f'{AUTO_MODELS[model]}:{served_model}'] += 1
+
+def prepare_context(messages, model, conversation_id=None):
+    """Ajusta o histórico ao orçamento de tokens do modelo (com resumo das mensagens antigas)"""
+    return context_builder.build_context(messages, provider_for(model), model=model, conversation_id=conversation_id)
+
+def _custom_ai_settings(custom_ai_id):
+    config = get_custom_ai_config(custom_ai_id) if custom_ai_id else None
+    if not config:
+        return {}
+    return {
+        'model': config.get('modelo'),
+        'system_prompt': config.get('sistema_prompt'),
+        'temperature': config.get('temperatura'),
+        'max_tokens': config.get('max_tokens'),
+        'coalesce': bool(config.get('coalesce_requests')),
+    }
+
+def _call(provider, model, messages, system_prompt, temperature, max_tokens, memory_namespace, plain, served=None):
+    if provider == 'google':
+        kwargs = {'max_tokens': max_tokens} if max_tokens else {}
+        return get_google_response(messages, system_prompt=system_prompt, model=model, temperature=temperature, **kwargs)
+    if provider == 'groq':
+        kwargs = {'max_tokens': max_tokens} if max_tokens else {}
+        return get_groq_response(messages, system_prompt=system_prompt, model=model, temperature=temperature, **kwargs)
+    if plain:
+        return get_completion(messages, model=model, system_prompt=system_prompt,
+                              temperature=temperature, max_tokens=max_tokens or 1024, served=served)
+    return get_claude_response(messages, system_prompt=system_prompt, model=model, temperature=temperature,
+                               max_tokens=max_tokens or 4096, memory_namespace=memory_namespace, served=served)
+
+def _coalesce_key(provider, model, messages, system_prompt, temperature, max_tokens, memory_namespace, plain):
+    # O tool `memory` (sempre ativo no Claude sem `plain`) lê os arquivos do
+    # namespace: nesses casos, inclusive IAs personalizadas, só compartilha
+    # dentro do mesmo tenant e usuário. Entre usuários, só Gemini/Groq e `plain`
+    # agrupam
+    namespace = memory_namespace if provider == 'anthropic' and not plain else None
+    payload = json.dumps(
+        [provider, model, system_prompt, messages, temperature, max_tokens, plain, namespace],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _should_coalesce(coalesce, temperature):
+    # Só respostas determinísticas podem ser compartilhadas entre requisições
+    return bool(coalesce) and temperature is not None and float(temperature) == 0.0
+
+def _record(provider, model, started, ok):
+    # O cliente do Claude registra a saúde de cada chamada à API por conta própria
+    if provider == 'anthropic':
+        return
+    if ok:
+        model_health.record_success(_health_key(model), time.perf_counter() - started)
+    else:
+        model_health.record_failure(_health_key(model), time.perf_counter() - started, 'error')
+
+def _attempt(provider, model, messages, system_prompt, temperature, max_tokens, memory_namespace, plain):
+    """Returns: (resposta, modelo que respondeu) — o Claude sem modelo escolhe o seu"""
+    started = time.perf_counter()
+    served = {}
+    try:
+        response = _call(provider, model, messages, system_prompt, temperature,
+                         max_tokens, memory_namespace, plain, served)
+    except Exception:
+        _record(provider, model, started, False)
+        raise
+    _record(provider, model, started, True)
+    return response, served.get('model') or model
+
+def complete(messages, model=None, system_prompt=None, temperature=None, max_tokens=None,
+             custom_ai_id=None, memory_namespace=None, plain=False, coalesce=False, served=None):
+    """
+    Resposta completa do modelo, qualquer que seja o provedor
+
+    Args:
+        messages: Lista de mensagens [{"role", "content"}]
+        model: Id do modelo, "auto" ou "auto:<tier>" (None: padrão do Claude)
+        custom_ai_id: Usa prompt, modelo, temperatura e max_tokens da IA personalizada
+        memory_namespace: Namespace do tool `memory` (só Claude)
+        plain: Claude sem o prompt padrão e sem ferramentas (operações de texto)
+        coalesce: Com temperatura 0, chamadas idênticas simultâneas compartilham
+            uma requisição ao provedor (também ativado pela IA personalizada)
+        served: Dicionário opcional que recebe em "model" o modelo que respondeu
+
+    Returns:
+        Texto da resposta
+    """
+    settings = _custom_ai_settings(custom_ai_id)
+    model = model or settings.get('model')
+    system_prompt = system_prompt or settings.get('system_prompt')
+    temperature = temperature if temperature is not None else settings.get('temperature')
+    max_tokens = max_tokens or settings.get('max_tokens')
+    coalesce = _should_coalesce(coalesce or settings.get('coalesce'), temperature)
+
+    candidates = resolve_models(model)
+    last_error = None
+    for candidate in candidates:
+        provider = provider_for(candidate)
+        with _stats_lock:
+            _routed[candidate or 'default'] += 1
+        attempt = partial(_attempt, provider, candidate, messages, system_prompt, temperature,
+                          max_tokens, memory_namespace, plain)
+        try:
+            if coalesce:
+                key = _coalesce_key(provider, candidate, messages, system_prompt, temperature,
+                                    max_tokens, memory_namespace, plain)
+                (response, served_model), _ = _single_flight.do(key, attempt, cancelled=client_disconnected)
+            else:
+                response, served_model = attempt()
+        except ClientDisconnectedError:
+            # Seguidor cujo cliente desistiu: a chamada compartilhada continua para os demais
+            raise
+        except Exception as e:
+            last_error = e
+            if len(candidates) > 1:
+                logger.warning(f'Auto routing: {candidate} failed, trying next model: {str(e)}')
+            continue
+        _record_served(model, served_model, served)
+        return response
+    raise last_error
+
+def _timed_stream(provider, model, chunks):
+    started = time.perf_counter()
+    chars = 0
+    try:
+        for chunk in chunks:
+            chars += len(chunk or '')
+            yield chunk
+    except GeneratorExit:
+        # Cliente desconectou: o fechamento abaixo encerra a requisição ao provedor
+        cancellations.record_cancelled(model, time.perf_counter() - started, _output_tokens(provider, chars))
+        raise
+    except Exception:
+        _record(provider, model, started, False)
+        raise
+    finally:
+        # Repassa o cancelamento ao gerador do provedor, que fecha a conexão
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+    _record(provider, model, started, True)
+    cancellations.record_completed(model, time.perf_counter() - started, _output_tokens(provider, chars))
+
+def _output_tokens(provider, chars):
+    if not chars:
+        return 0
+    return int(chars / context_builder.CHARS_PER_TOKEN.get(provider, 4.0)) + 1
+
+def _open_stream(model, messages, system_prompt, temperature, max_tokens, memory_namespace, plain, served=None):
+    provider = provider_for(model)
+    with _stats_lock:
+        _routed[model or 'default'] += 1
+    kwargs = {'max_tokens': max_tokens} if max_tokens else {}
+    started = time.perf_counter()
+    try:
+        if provider == 'google':
+            chunks = get_google_response(messages, system_prompt=system_prompt, model=model,
+                                         temperature=temperature, stream=True, **kwargs)
+        elif provider == 'groq':
+            chunks = get_groq_response(messages, system_prompt=system_prompt, model=model,
+                                       temperature=temperature, stream=True, **kwargs)
+        elif plain:
+            chunks = stream_completion(messages, model=model, system_prompt=system_prompt,
+                                       temperature=temperature, max_tokens=max_tokens or 1024, served=served)
+        else:
+            chunks = get_streaming_response(messages, system_prompt=system_prompt, model=model,
+                                            temperature=temperature, memory_namespace=memory_namespace,
+                                            served=served, **kwargs)
+    except Exception:
+        _record(provider, model, started, False)
+        raise
+    return _timed_stream(provider, model, chunks)
+
+def stream(messages, model=None, system_prompt=None, temperature=None, max_tokens=None,
+           custom_ai_id=None, memory_namespace=None, plain=False, coalesce=False, served=None):
+    """
+    Gerador de trechos de texto da resposta, qualquer que seja o provedor.
+    Com "auto", tenta os modelos do tier em ordem até um deles começar a
+    responder (sem troca no meio do stream).
+    Fechar o gerador (cliente desconectou) encerra a requisição ao provedor.
+
+    Chamadas agrupadas (ver `complete`) recebem a resposta inteira em um
+    único trecho, e a desconexão de um cliente não interrompe os demais.
+    `served["model"]` é preenchido com o modelo que respondeu, no primeiro trecho.
+    """
+    settings = _custom_ai_settings(custom_ai_id)
+    model = model or settings.get('model')
+    system_prompt = system_prompt or settings.get('system_prompt')
+    temperature = temperature if temperature is not None else settings.get('temperature')
+    max_tokens = max_tokens or settings.get('max_tokens')
+
+    if _should_coalesce(coalesce or settings.get('coalesce'), temperature):
+        yield complete(messages, model=model, system_prompt=system_prompt, temperature=temperature,
+                       max_tokens=max_tokens, memory_namespace=memory_namespace, plain=plain,
+                       coalesce=True, served=served)
+        return
+
+    candidates = resolve_models(model)
+
+    for position, candidate in enumerate(candidates):
+        chunks = None
+        emitted = False
+        provider_served = {}
+        try:
+            chunks = _open_stream(candidate, messages, system_prompt, temperature,
+                                  max_tokens, memory_namespace, plain, provider_served)
+            for chunk in chunks:
+                if not emitted:
+                    _record_served(model, provider_served.get('model') or candidate, served)
+                emitted = True
+                yield chunk
+            return
+        except Exception as e:
+            if emitted or position == len(candidates) - 1:
+                raise
+            logger.warning(f'Auto routing: {candidate} failed before streaming, trying next model: {str(e)}')
+        finally:
+            if chunks is not None:
+                chunks.close()
+
+def router_stats():
+    with _stats_lock:
+        return {
+            'routed': dict(_routed),
+            'auto_choices': dict(_auto_choices),
+            'cancellations': cancellations.stats(),
+            'coalescing': _single_flight.stats()
+        }
@@ -0,0 +1,494 @@
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "memories"))
+MEMORY_BACKEND = os.getenv('MEMORY_BACKEND', 'filesystem')
+MEMORY_ROOT = os.getenv('MEMORY_ROOT', DEFAULT_MEMORY_ROOT)
+MEMORY_SQLITE_PATH = os.getenv('MEMORY_SQLITE_PATH', os.path.join(MEMORY_ROOT, 'memories.db'))
+
+SHARED_NAMESPACE = 'shared'
+
+_SAFE_ID = re.compile(r'[^A-Za-z0-9_-]')
+
+def memory_namespace(tenant_id=None, user_id=None):
+    """
+    Namespace de memória isolado por tenant e usuário
+
+    Returns:
+        Ex.: 'tenant-<tenant_id>.user-<user_id>' (um único nível, para que um
+        namespace nunca contenha outro)
+    """
+    parts = []
+    if tenant_id:
+        parts.append('tenant-' + _SAFE_ID.sub('', str(tenant_id)))
+    if user_id:
+        parts.append('user-' + _SAFE_ID.sub('', str(user_id)))
+    return '.'.join(parts) or SHARED_NAMESPACE
+
+def normalize_path(path):
+    """
+    Converte um caminho do tool ('/memories/a/b.md') em caminho relativo
+    ('a/b.md'); '' é a raiz. Ignora '.' e barras repetidas e rejeita
+    componentes iniciados por '.' ('..' e arquivos internos como '.version').
+    """
+    p = str(path or "").strip()
+    if p.startswith("/memories"):
+        p = p[len("/memories"):]
+    parts = [part for part in p.split("/") if part not in ("", ".")]
+    if any(part.startswith(".") for part in parts):
+        raise ValueError("Caminho inválido")
+    return "/".join(parts)
+
+def _display_dir(rel):
+    return "/memories" + ("/" + rel if rel else "")
+
+def _select_lines(text, view_range):
+    lines = text.splitlines()
+    if isinstance(view_range, list) and len(view_range) == 2:
+        s = max(1, int(view_range[0]))
+        e = max(s, int(view_range[1]))
+        return "\n".join(lines[s - 1:e])
+    return "\n".join(lines)
+
+def _insert_line(text, insert_line, insert_text):
+    lines = text.splitlines()
+    idx = max(0, int(insert_line or 1) - 1)
+    lines[idx:idx] = [insert_text]
+    return "\n".join(lines)
+
+class MemoryStore(ABC):
+    """
+    Interface do backend da ferramenta `memory` do Claude.
+
+    Cada operação recebe o namespace (ver `memory_namespace`) e o caminho
+    relativo já normalizado; as respostas seguem o texto esperado pelo tool.
+    """
+
+    @abstractmethod
+    def view(self, namespace, path, view_range=None):
+        pass
+
+    @abstractmethod
+    def create(self, namespace, path, text):
+        pass
+
+    @abstractmethod
+    def str_replace(self, namespace, path, old_str, new_str):
+        pass
+
+    @abstractmethod
+    def insert(self, namespace, path, insert_line, insert_text):
+        pass
+
+    @abstractmethod
+    def delete(self, namespace, path):
+        pass
+
+    @abstractmethod
+    def rename(self, namespace, old_path, new_path):
+        pass
+
+    def execute(self, namespace, input_obj):
+        """Executa um comando do tool `memory`"""
+        cmd = str(input_obj.get("command") or "").strip()
+        namespace = namespace or SHARED_NAMESPACE
+        if cmd == "view":
+            return self.view(namespace, normalize_path(input_obj.get("path")), input_obj.get("view_range"))
+        if cmd == "create":
+            return self.create(namespace, normalize_path(input_obj.get("path")), input_obj.get("file_text") or "")
+        if cmd == "str_replace":
+            return self.str_replace(
+                namespace, normalize_path(input_obj.get("path")),
+                input_obj.get("old_str") or "", input_obj.get("new_str") or ""
+            )
+        if cmd == "insert":
+            return self.insert(
+                namespace, normalize_path(input_obj.get("path")),
+                input_obj.get("insert_line"), input_obj.get("insert_text") or ""
+            )
+        if cmd == "delete":
+            return self.delete(namespace, normalize_path(input_obj.get("path")))
+        if cmd == "rename":
+            return self.rename(
+                namespace, normalize_path(input_obj.get("old_path")), normalize_path(input_obj.get("new_path"))
+            )
+        return "Comando inválido"
+
+class FileSystemMemoryStore(MemoryStore):
+    """
+    Memórias em arquivos, um diretório por namespace.
+
+    - Escritas vão para um arquivo temporário e entram com `os.replace`
+      (atômico), sob um `flock` do namespace para que workers diferentes
+      não percam atualizações de str_replace/insert.
+    - `view` de diretórios usa um índice em memória da árvore. Toda mudança
+      de estrutura grava um token novo em `.version`; o índice é refeito só
+      quando o token lido difere do que está em memória.
+    """
+
+    VERSION_FILE = '.version'
+    LOCK_FILE = '.lock'
+    LEGACY_MARKER = '.legacy-migrated'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._indexes = {}
+        # Um lock por namespace; o do registro só protege o dicionário
+        self._ns_locks = {}
+        self._registry_lock = threading.Lock()
+        self._adopt_legacy_files()
+
+    def _adopt_legacy_files(self):
+        """
+        Migração única do layout antigo, em que as memórias ficavam direto na
+        raiz e eram compartilhadas por todos os usuários: move esses arquivos
+        para o namespace `shared` (os namespaces de tenant/usuário não os veem,
+        já que podem conter dados de outros usuários).
+        """
+        marker = os.path.join(self.root, self.LEGACY_MARKER)
+        if not os.path.isdir(self.root) or os.path.exists(marker):
+            return
+        reserved = {SHARED_NAMESPACE, os.path.basename(MEMORY_SQLITE_PATH)}
+        shared = self._ns_root(SHARED_NAMESPACE)
+        moved = 0
+        for name in os.listdir(self.root):
+            if name.startswith('.') or name.startswith(('tenant-', 'user-')) \
+                    or name in reserved or name.startswith(os.path.basename(MEMORY_SQLITE_PATH) + '-'):
+                continue
+            target = os.path.join(shared, name)
+            if os.path.exists(target):
+                logger.warning(f'Legacy memory {name} not migrated: already exists in {SHARED_NAMESPACE}')
+                continue
+            try:
+                os.replace(os.path.join(self.root, name), target)
+                moved += 1
+            except OSError:
+                # Outro worker migrou ao mesmo tempo
+                continue
+        if moved:
+            self._bump_version(SHARED_NAMESPACE)
+            logger.info(f'Moved {moved} legacy memory entries to namespace {SHARED_NAMESPACE}')
+        self._write_atomic(marker, datetime.now(timezone.utc).isoformat())
+
+    def _ns_root(self, namespace):
+        base = os.path.abspath(os.path.join(self.root, namespace))
+        if os.path.dirname(base) != self.root:
+            raise ValueError("Namespace inválido")
+        os.makedirs(base, exist_ok=True)
+        return base
+
+    def _abspath(self, namespace, rel):
+        return os.path.join(self._ns_root(namespace), rel) if rel else self._ns_root(namespace)
+
+    def _ns_lock(self, namespace):
+        with self._registry_lock:
+            lock = self._ns_locks.get(namespace)
+            if lock is None:
+                lock = self._ns_locks[namespace] = threading.Lock()
+            return lock
+
+    @contextmanager
+    def _locked(self, namespace):
+        # Serializa só o namespace: threads do worker pelo lock, processos pelo flock
+        with self._ns_lock(namespace):
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self._ns_root(namespace), self.LOCK_FILE), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_atomic(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _read(self, path):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+
+    # Índice da árvore
+    def _version(self, namespace):
+        try:
+            return self._read(os.path.join(self._ns_root(namespace), self.VERSION_FILE))
+        except OSError:
+            return None
+
+    def _bump_version(self, namespace):
+        self._write_atomic(os.path.join(self._ns_root(namespace), self.VERSION_FILE), uuid.uuid4().hex)
+
+    def _build_index(self, namespace):
+        base = self._ns_root(namespace)
+        tree = {}
+        for dirpath, dirnames, filenames in os.walk(base):
+            rel = os.path.relpath(dirpath, base)
+            rel = '' if rel == '.' else rel.replace(os.sep, '/')
+            tree[rel] = sorted(
+                [d for d in dirnames] +
+                [f for f in filenames if not f.startswith('.')]
+            )
+        return tree
+
+    def _index(self, namespace):
+        version = self._version(namespace)
+        cached = self._indexes.get(namespace)
+        if cached and cached[0] == version:
+            return cached[1]
+        tree = self._build_index(namespace)
+        self._indexes[namespace] = (version, tree)
+        return tree
+
+    # Operações
+    def view(self, namespace, path, view_range=None):
+        tree = self._index(namespace)
+        if path in tree:
+            return "Directory: " + _display_dir(path) + "\n" + "\n".join(["- " + i for i in tree[path]])
+        abspath = self._abspath(namespace, path)
+        if not os.path.isfile(abspath):
+            return "Arquivo ou diretório não existe"
+        return _select_lines(self._read(abspath), view_range)
+
+    def create(self, namespace, path, text):
+        if not path:
+            return "Caminho inválido"
+        abspath = self._abspath(namespace, path)
+        with self._locked(namespace):
+            existed = os.path.exists(abspath)
+            self._write_atomic(abspath, text)
+            if not existed:
+                self._bump_version(namespace)
+        return "OK"
+
+    def _modify(self, namespace, path, change):
+        abspath = self._abspath(namespace, path)
+        with self._locked(namespace):
+            if not path or not os.path.isfile(abspath):
+                return "Arquivo não encontrado"
+            self._write_atomic(abspath, change(self._read(abspath)))
+        return "OK"
+
+    def str_replace(self, namespace, path, old_str, new_str):
+        return self._modify(namespace, path, lambda content: content.replace(old_str, new_str))
+
+    def insert(self, namespace, path, insert_line, insert_text):
+        return self._modify(namespace, path, lambda content: _insert_line(content, insert_line, insert_text))
+
+    def delete(self, namespace, path):
+        if not path:
+            return "Caminho inválido"
+        abspath = self._abspath(namespace, path)
+        with self._locked(namespace):
+            if not os.path.exists(abspath):
+                return "OK"
+            try:
+                if os.path.isdir(abspath):
+                    shutil.rmtree(abspath, ignore_errors=True)
+                else:
+                    os.remove(abspath)
+            except OSError:
+                pass
+            self._bump_version(namespace)
+        return "OK"
+
+    def rename(self, namespace, old_path, new_path):
+        if not old_path or not new_path:
+            return "Falha ao renomear"
+        old_abs = self._abspath(namespace, old_path)
+        new_abs = self._abspath(namespace, new_path)
+        with self._locked(namespace):
+            try:
+                os.makedirs(os.path.dirname(new_abs), exist_ok=True)
+                os.replace(old_abs, new_abs)
+            except OSError:
+                return "Falha ao renomear"
+            self._bump_version(namespace)
+        return "OK"
+
+class SQLiteMemoryStore(MemoryStore):
+    """
+    Memórias em uma tabela SQLite (namespace, path, content).
+
+    Diretórios são implícitos (prefixos dos caminhos). As escritas usam
+    `BEGIN IMMEDIATE`, o que serializa workers que compartilham o arquivo.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS memory_files ('
+            ' namespace TEXT NOT NULL,'
+            ' path TEXT NOT NULL,'
+            ' content TEXT NOT NULL,'
+            ' updated_at TEXT NOT NULL,'
+            ' PRIMARY KEY (namespace, path))'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _prefix_range(path):
+        # Todos os caminhos dentro de `path/` ('0' é o caractere seguinte a '/')
+        return (path + '/', path + '0') if path else ('', '\uffff')
+
+    def _get(self, conn, namespace, path):
+        row = conn.execute(
+            'SELECT content FROM memory_files WHERE namespace = ? AND path = ?', (namespace, path)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _put(self, conn, namespace, path, content):
+        conn.execute(
+            'INSERT INTO memory_files (namespace, path, content, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (namespace, path) DO UPDATE SET content = excluded.content, updated_at = excluded.updated_at',
+            (namespace, path, content, datetime.now(timezone.utc).isoformat())
+        )
+
+    def _children(self, conn, namespace, path):
+        low, high = self._prefix_range(path)
+        rows = conn.execute(
+            'SELECT path FROM memory_files WHERE namespace = ? AND path >= ? AND path < ?',
+            (namespace, low, high)
+        ).fetchall()
+        return sorted({row[0][len(low):].split('/', 1)[0] for row in rows})
+
+    def view(self, namespace, path, view_range=None):
+        conn = self._conn()
+        content = self._get(conn, namespace, path) if path else None
+        if content is not None:
+            return _select_lines(content, view_range)
+        children = self._children(conn, namespace, path)
+        if not children and path:
+            return "Arquivo ou diretório não existe"
+        return "Directory: " + _display_dir(path) + "\n" + "\n".join(["- " + i for i in children])
+
+    def create(self, namespace, path, text):
+        if not path:
+            return "Caminho inválido"
+        with self._transaction() as conn:
+            self._put(conn, namespace, path, text)
+        return "OK"
+
+    def _modify(self, namespace, path, change):
+        with self._transaction() as conn:
+            content = self._get(conn, namespace, path)
+            if content is None:
+                return "Arquivo não encontrado"
+            self._put(conn, namespace, path, change(content))
+        return "OK"
+
+    def str_replace(self, namespace, path, old_str, new_str):
+        return self._modify(namespace, path, lambda content: content.replace(old_str, new_str))
+
+    def insert(self, namespace, path, insert_line, insert_text):
+        return self._modify(namespace, path, lambda content: _insert_line(content, insert_line, insert_text))
+
+    def delete(self, namespace, path):
+        # A raiz é o namespace inteiro: mesmo comportamento do backend em arquivos
+        if not path:
+            return "Caminho inválido"
+        low, high = self._prefix_range(path)
+        with self._transaction() as conn:
+            conn.execute(
+                'DELETE FROM memory_files WHERE namespace = ? AND (path = ? OR (path >= ? AND path < ?))',
+                (namespace, path, low, high)
+            )
+        return "OK"
+
+    def rename(self, namespace, old_path, new_path):
+        if not old_path or not new_path:
+            return "Falha ao renomear"
+        low, high = self._prefix_range(old_path)
+        with self._transaction() as conn:
+            if self._get(conn, namespace, old_path) is not None:
+                conn.execute('DELETE FROM memory_files WHERE namespace = ? AND path = ?', (namespace, new_path))
+                conn.execute(
+                    'UPDATE memory_files SET path = ? WHERE namespace = ? AND path = ?',
+                    (new_path, namespace, old_path)
+                )
+                return "OK"
+            rows = conn.execute(
+                'SELECT path FROM memory_files WHERE namespace = ? AND path >= ? AND path < ?',
+                (namespace, low, high)
+            ).fetchall()
+            if not rows:
+                return "Falha ao renomear"
+            for (path,) in rows:
+                target = new_path + path[len(old_path):]
+                conn.execute('DELETE FROM memory_files WHERE namespace = ? AND path = ?', (namespace, target))
+                conn.execute(
+                    'UPDATE memory_files SET path = ? WHERE namespace = ? AND path = ?',
+                    (target, namespace, path)
+                )
+        return "OK"
+
+_store = None
+_store_lock = threading.Lock()
+
+def create_memory_store():
+    """Cria o backend configurado em MEMORY_BACKEND ('filesystem' ou 'sqlite')"""
+    if MEMORY_BACKEND == 'sqlite':
+        return SQLiteMemoryStore(MEMORY_SQLITE_PATH)
+    if MEMORY_BACKEND != 'filesystem':
+        logger.warning(f'Unknown MEMORY_BACKEND {MEMORY_BACKEND}, using filesystem')
+    return FileSystemMemoryStore(MEMORY_ROOT)
+
+def get_memory_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_memory_store()
+    return _store
+
+def set_memory_store(store):
+    global _store
+    _store = store
@@ -0,0 +1,177 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class _ModelState:
+    def __init__(self, window):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.outcomes = deque(maxlen=window)
+        self.last_error = None
+
+class ModelHealthRegistry:
+    """
+    Circuit breaker por modelo (chave 'provedor:modelo').
+
+    - closed: o modelo recebe tráfego normalmente
+    - open: o modelo é pulado até o fim do cooldown
+    - half_open: após o cooldown, uma única requisição de teste decide se o
+      circuito fecha (sucesso) ou reabre com o cooldown dobrado (falha)
+
+    O circuito abre após `failure_threshold` falhas seguidas ou quando a taxa
+    de erro da janela recente passa de `error_rate_threshold`.
+    """
+
+    def __init__(self, failure_threshold=3, error_rate_threshold=0.5, min_samples=10,
+                 window=50, cooldown=30.0, max_cooldown=300.0, probe_timeout=60.0):
+        self.failure_threshold = int(failure_threshold)
+        self.error_rate_threshold = float(error_rate_threshold)
+        self.min_samples = int(min_samples)
+        self.window = int(window)
+        self.base_cooldown = float(cooldown)
+        self.max_cooldown = float(max_cooldown)
+        self.probe_timeout = float(probe_timeout)
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _get(self, key):
+        state = self._models.get(key)
+        if state is None:
+            state = self._models[key] = _ModelState(self.window)
+        return state
+
+    def _open(self, key, state, now):
+        state.cooldown = min(self.max_cooldown, state.cooldown * 2 if state.cooldown else self.base_cooldown)
+        state.state = OPEN
+        state.opened_at = now
+        state.probing = False
+        logger.warning(f'Circuit opened for {key} ({state.cooldown:.0f}s)')
+
+    def _available(self, state, now):
+        if state.state == OPEN and now - state.opened_at >= state.cooldown:
+            state.state = HALF_OPEN
+            state.probing = False
+        if state.state == HALF_OPEN:
+            # Teste sem resposta há muito tempo não bloqueia o modelo para sempre
+            return not state.probing or now - state.probe_started >= self.probe_timeout
+        return state.state == CLOSED
+
+    def ordered(self, keys):
+        """
+        Chaves disponíveis na ordem original. Se todas estiverem com o circuito
+        aberto, devolve a que reabre primeiro (melhor que falhar sem tentar).
+        """
+        now = time.monotonic()
+        with self._lock:
+            available = [k for k in keys if self._available(self._get(k), now)]
+            if available or not keys:
+                return available
+            return [min(keys, key=lambda k: self._get(k).opened_at + self._get(k).cooldown)]
+
+    def acquire(self, key):
+        """Marca o início de uma tentativa (em half_open, ela é a requisição de teste)"""
+        with self._lock:
+            state = self._get(key)
+            if state.state == HALF_OPEN:
+                state.probing = True
+                state.probe_started = time.monotonic()
+
+    def release(self, key):
+        """Encerra uma tentativa que não diz nada sobre a saúde do modelo (ex.: erro 400)"""
+        with self._lock:
+            self._get(key).probing = False
+
+    def record_success(self, key, latency):
+        with self._lock:
+            state = self._get(key)
+            state.outcomes.append((True, latency))
+            state.consecutive_failures = 0
+            if state.state != CLOSED:
+                logger.info(f'Circuit closed for {key}')
+            state.state = CLOSED
+            state.cooldown = 0.0
+            state.probing = False
+
+    def record_failure(self, key, latency, kind=None):
+        now = time.monotonic()
+        with self._lock:
+            state = self._get(key)
+            state.outcomes.append((False, latency))
+            state.consecutive_failures += 1
+            state.last_error = kind
+            if state.state == HALF_OPEN:
+                self._open(key, state, now)
+                return
+            failures = sum(1 for ok, _ in state.outcomes if not ok)
+            error_rate = failures / len(state.outcomes)
+            if state.state == CLOSED and (
+                state.consecutive_failures >= self.failure_threshold
+                or (len(state.outcomes) >= self.min_samples and error_rate >= self.error_rate_threshold)
+            ):
+                self._open(key, state, now)
+
+    def latency(self, key, q=0.5):
+        """Percentil de latência (segundos) das respostas bem-sucedidas recentes, ou None"""
+        with self._lock:
+            state = self._models.get(key)
+            values = sorted(lat for ok, lat in state.outcomes if ok) if state else []
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for key, state in self._models.items():
+                latencies = sorted(lat for ok, lat in state.outcomes if ok)
+                total = len(state.outcomes)
+                failures = sum(1 for ok, _ in state.outcomes if not ok)
+                result[key] = {
+                    'state': state.state,
+                    'samples': total,
+                    'error_rate': round(failures / total, 4) if total else 0.0,
+                    'consecutive_failures': state.consecutive_failures,
+                    'last_error': state.last_error,
+                    'retry_in_seconds': round(max(0.0, state.opened_at + state.cooldown - now), 1)
+                        if state.state == OPEN else 0.0,
+                    'p50_ms': _percentile_ms(latencies, 0.5),
+                    'p95_ms': _percentile_ms(latencies, 0.95),
+                }
+            return result
+
+def _percentile_ms(sorted_values, q):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[idx] * 1000, 3)
+
+def backoff_delay(attempt, base=0.5, cap=8.0, retry_after=None):
+    """Atraso com 'full jitter' para a tentativa `attempt` (0, 1, ...), respeitando Retry-After"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = max(delay, min(cap, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+model_health = ModelHealthRegistry(
+    failure_threshold=int(os.getenv('MODEL_BREAKER_FAILURES', '3')),
+    error_rate_threshold=float(os.getenv('MODEL_BREAKER_ERROR_RATE', '0.5')),
+    cooldown=float(os.getenv('MODEL_BREAKER_COOLDOWN', '30')),
+    max_cooldown=float(os.getenv('MODEL_BREAKER_MAX_COOLDOWN', '300'))
+)
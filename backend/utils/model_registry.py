@@ -0,0 +1,16 @@
+# Modelos conhecidos: provedor e faixa de qualidade (tier). Fonte única para
+# o roteamento (utils.llm_router) e para a validação dos pedidos (models.schemas)
+MODEL_REGISTRY = {
+    'claude-opus-4-1': {'provider': 'anthropic', 'tier': 'premium'},
+    'gemini-3-pro-preview': {'provider': 'google', 'tier': 'premium'},
+    'claude-sonnet-4-5': {'provider': 'anthropic', 'tier': 'standard'},
+    'gemini-1.5-pro': {'provider': 'google', 'tier': 'standard'},
+    'gemini-1.5-flash': {'provider': 'google', 'tier': 'fast'},
+    'llama-3.3-70b-versatile': {'provider': 'groq', 'tier': 'fast'},
+}
+
+TIERS = ('premium', 'standard', 'fast')
+
+# "auto" escolhe o modelo saudável mais rápido do tier (padrão: standard)
+AUTO_MODELS = {'auto': 'standard'}
+AUTO_MODELS.update({f'auto:{tier}': tier for tier in TIERS})
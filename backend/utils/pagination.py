@@ -0,0 +1,149 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from config.supabase_config import supabase
+from models.exceptions import ValidationError
+
+MAX_MESSAGE_WINDOW = 200
+
+def encode_cursor(values):
+    """Codifica a posição da paginação em um cursor opaco (base64 url-safe)"""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decodifica um cursor gerado por encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(values, dict):
+            raise ValueError('cursor inválido')
+        return values
+    except (ValueError, TypeError):
+        raise ValidationError('Cursor de paginação inválido')
+
+def _quote(value):
+    # Valores entre aspas para o filtro `or` do PostgREST (timestamps têm ':' e '.')
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def keyset_filter(column, value, row_id, desc=True):
+    """
+    Monta o filtro `or` do PostgREST para paginação por keyset em (column, id)
+
+    Args:
+        column: Coluna principal de ordenação (ex.: 'updated_at')
+        value: Valor de `column` na última linha da página anterior
+        row_id: id da última linha da página anterior
+        desc: True se a ordenação é decrescente
+
+    Returns:
+        String para usar em `query.or_(...)`
+    """
+    op = 'lt' if desc else 'gt'
+    v = _quote(value)
+    i = _quote(row_id)
+    return f'{column}.{op}.{v},and({column}.eq.{v},id.{op}.{i})'
+
+def parse_bool_arg(value, default=False):
+    """Interpreta um parâmetro de query string como booleano"""
+    if value is None:
+        return default
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _parse_timestamp(value):
+    # Exige data com '-' para não confundir ids numéricos com datas compactas
+    if '-' not in str(value):
+        return False
+    try:
+        datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        return True
+    except ValueError:
+        return False
+
+def _resolve_anchor(table, conversation_id, after):
+    """Converte `after` (id de mensagem ou timestamp ISO) em (created_at, id)"""
+    if _parse_timestamp(after):
+        return after, None
+    # Sem validar, um id malformado chega ao PostgREST e vira erro 500 (22P02)
+    try:
+        after = str(uuid.UUID(str(after)))
+    except ValueError:
+        raise ValidationError('Parâmetro after deve ser um id de mensagem ou um timestamp ISO')
+    res = supabase.table(table) \
+        .select('id, created_at') \
+        .eq('conversation_id', conversation_id) \
+        .eq('id', after) \
+        .limit(1) \
+        .execute()
+    if not res.data:
+        raise ValidationError('Mensagem de referência (after) não encontrada')
+    return res.data[0]['created_at'], res.data[0]['id']
+
+def fetch_message_window(table, conversation_id, columns, limit=None, before=None, after=None):
+    """
+    Busca mensagens de uma conversa em janelas.
+
+    - sem parâmetros: todas as mensagens (comportamento original)
+    - `limit`: as N mensagens mais recentes
+    - `before`: cursor (`next_before`) para carregar mensagens mais antigas
+    - `after`: id de mensagem ou timestamp; só as mensagens mais novas
+
+    Returns:
+        (mensagens em ordem cronológica, dict de paginação ou None)
+    """
+    if limit is not None:
+        limit = max(1, min(MAX_MESSAGE_WINDOW, int(limit)))
+
+    query = supabase.table(table) \
+        .select(columns) \
+        .eq('conversation_id', conversation_id)
+
+    if after:
+        created_at, anchor_id = _resolve_anchor(table, conversation_id, after)
+        if anchor_id is not None:
+            query = query.or_(keyset_filter('created_at', created_at, anchor_id, desc=False))
+        else:
+            query = query.gt('created_at', created_at)
+        query = query.order('created_at', desc=False).order('id', desc=False)
+        if limit:
+            query = query.limit(limit + 1)
+        rows = query.execute().data or []
+        has_more = bool(limit) and len(rows) > limit
+        rows = rows[:limit] if limit else rows
+        return rows, {
+            'has_more_newer': has_more,
+            'next_after': rows[-1]['id'] if rows else after
+        }
+
+    if limit is None and not before:
+        rows = query.order('created_at', desc=False).execute().data or []
+        return rows, None
+
+    limit = limit or 50
+    if before:
+        position = decode_cursor(before)
+        query = query.or_(keyset_filter('created_at', position.get('c'), position.get('i'), desc=True))
+    rows = query \
+        .order('created_at', desc=True) \
+        .order('id', desc=True) \
+        .limit(limit + 1) \
+        .execute().data or []
+    has_more = len(rows) > limit
+    rows = list(reversed(rows[:limit]))
+    next_before = None
+    if has_more and rows:
+        next_before = encode_cursor({'c': rows[0].get('created_at'), 'i': rows[0].get('id')})
+    return rows, {
+        'has_more_older': has_more,
+        'next_before': next_before
+    }
+
+def message_window_args(args):
+    """Extrai limit/before/after da query string"""
+    limit = args.get('limit', type=int)
+    return {
+        'limit': limit,
+        'before': args.get('before') or None,
+        'after': args.get('after') or None
+    }
@@ -0,0 +1,50 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool para etapas independentes dentro de uma requisição (ex.: checagens de
+# quota e leitura do histórico). Com workers gevent as threads viram greenlets.
+REQUEST_POOL_WORKERS = int(os.getenv('REQUEST_POOL_WORKERS', '16'))
+
+_lock = threading.Lock()
+_pool = None
+_pid = None
+
+def get_request_pool():
+    """Pool compartilhado do processo (recriado após fork, como os clientes HTTP)"""
+    global _pool, _pid
+    with _lock:
+        if _pool is None or _pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=REQUEST_POOL_WORKERS, thread_name_prefix='request')
+            _pid = os.getpid()
+        return _pool
+
+def submit(fn, *args, **kwargs):
+    return get_request_pool().submit(fn, *args, **kwargs)
+
+def run_parallel(tasks):
+    """
+    Executa as funções em paralelo e devolve os resultados na mesma ordem
+    (posições com None no lugar da função ficam com None)
+
+    Se alguma falhar, aguarda as demais e relança a primeira exceção (na ordem
+    de `tasks`), para que erros como QuotaExceededError cheguem ao handler.
+    """
+    pending = [t for t in tasks if t is not None]
+    if len(pending) <= 1:
+        return [t() if t is not None else None for t in tasks]
+    futures = [submit(t) if t is not None else None for t in tasks]
+    results = []
+    error = None
+    for future in futures:
+        if future is None:
+            results.append(None)
+            continue
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(None)
+            error = error or e
+    if error:
+        raise error
+    return results
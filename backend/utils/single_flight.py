@@ -0,0 +1,109 @@
+import threading
+from models.exceptions import ClientDisconnectedError
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Agrupa chamadas concorrentes com a mesma chave: a primeira executa a
+    função e as demais esperam e recebem o mesmo resultado. Não é um cache:
+    a chave é liberada assim que a chamada termina.
+
+    Quem espera não herda a falha nem o cancelamento do líder: nesses casos
+    ele se desliga e tenta uma vez por conta própria (agrupado de novo com os
+    demais que se desligaram). Um seguidor cujo cliente desconectou para de
+    esperar sem afetar a chamada em andamento.
+
+    Args:
+        name: Nome usado nas métricas
+        poll_interval: Intervalo (segundos) entre verificações de `cancelled`
+    """
+
+    def __init__(self, name=None, poll_interval=0.5):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.leaders = 0
+        self.collapsed = 0
+        self.detached = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, cancelled=None):
+        """
+        Executa `fn()` ou espera a execução em andamento com a mesma chave
+
+        Args:
+            cancelled: Função opcional; se retornar True durante a espera, o
+                seguidor desiste com ClientDisconnectedError
+
+        Returns:
+            (resultado, shared) — shared é True se o resultado veio de outra chamada
+        """
+        detached = False
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.leaders += 1
+                else:
+                    self.collapsed += 1
+
+            if leader:
+                return self._lead(key, call, fn)
+
+            self._wait(call, cancelled)
+            if call.error is None:
+                return call.result, True
+            if detached:
+                raise call.error
+            # Líder falhou ou foi interrompido: tenta de novo, uma vez
+            detached = True
+            with self._lock:
+                self.detached += 1
+
+    def _wait(self, call, cancelled):
+        if cancelled is None:
+            call.event.wait()
+            return
+        while not call.event.wait(self.poll_interval):
+            if cancelled():
+                raise ClientDisconnectedError()
+
+    def _lead(self, key, call, fn):
+        done = False
+        try:
+            call.result = fn()
+            done = True
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            if not done and call.error is None:
+                # Interrompida sem exceção comum (ex.: GeneratorExit): quem espera não fica sem resposta
+                call.error = RuntimeError('Chamada compartilhada interrompida')
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.collapsed
+            return {
+                'name': self.name,
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'collapsed': self.collapsed,
+                'detached': self.detached,
+                'errors': self.errors,
+                'collapse_rate': round(self.collapsed / total, 4) if total else 0.0
+            }
@@ -0,0 +1,32 @@
+import json
+from flask import Response, stream_with_context
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',  # Evita buffering em proxies (nginx/render)
+    'Connection': 'keep-alive',
+}
+
+def sse_event(data, event=None):
+    """
+    Formata um evento Server-Sent Events
+
+    Args:
+        data: Payload do evento (serializado como JSON)
+        event: Nome do evento (opcional)
+
+    Returns:
+        String pronta para ser enviada ao cliente
+    """
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    if event:
+        return f'event: {event}\ndata: {payload}\n\n'
+    return f'data: {payload}\n\n'
+
+def sse_response(generator):
+    """Cria uma resposta text/event-stream mantendo o contexto da request"""
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
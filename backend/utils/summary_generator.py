@@ -1,8 +1,12 @@
 import logging
-from utils.google_client import get_google_response
+import os
+from utils import llm_router
 
 logger = logging.getLogger(__name__)
 
+# Modelo usado para títulos e resumos (aceita "auto:fast")
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'gemini-1.5-flash')
+
 def generate_conversation_title(messages):
     """
     Gera um título curto e descritivo para a conversa usando o modelo Gemini Flash.
@@ -31,10 +35,13 @@ def generate_conversation_title(messages):
             content = msg.get("content", "")
             prompt += f"\n{role}: {content}"
             
-        # Chamada direta ao modelo Flash para rapidez e baixo custo
-        response = get_google_response(
-            messages=[{"role": "user", "content": prompt}],
-            model="gemini-1.5-flash"
+        # Modelo rápido e barato (Flash por padrão). Com temperatura 0, aberturas
+        # idênticas geradas ao mesmo tempo compartilham uma única chamada
+        response = llm_router.complete(
+            [{"role": "user", "content": prompt}],
+            model=SUMMARY_MODEL,
+            temperature=0,
+            coalesce=True
         )
         
         # Limpar resposta
@@ -49,3 +56,48 @@ def generate_conversation_title(messages):
     except Exception as e:
         logger.error(f"Erro ao gerar título da conversa: {str(e)}")
         return None
+
+
+def summarize_conversation(messages, previous_summary=None, max_chars=4000):
+    """
+    Gera um resumo acumulado de mensagens antigas da conversa.
+
+    Args:
+        messages (list): Mensagens ainda não cobertas pelo resumo anterior.
+        previous_summary (str): Resumo já existente (opcional).
+        max_chars (int): Tamanho máximo do resumo.
+
+    Returns:
+        str: Resumo atualizado ou None se falhar.
+    """
+    try:
+        prompt = """
+        Atualize o resumo da conversa abaixo. Preserve fatos, decisões, preferências do usuário,
+        nomes, números e pendências. Seja objetivo e escreva em Português, em no máximo 3 parágrafos.
+        Responda apenas com o resumo.
+        """
+
+        if previous_summary:
+            prompt += f"\nResumo até agora:\n{previous_summary}\n"
+
+        prompt += "\nNovas mensagens:"
+        for msg in messages:
+            role = "Usuário" if msg.get("role") == "user" else "Assistente"
+            content = msg.get("content", "")
+            prompt += f"\n{role}: {content}"
+
+        response = llm_router.complete(
+            [{"role": "user", "content": prompt}],
+            model=SUMMARY_MODEL,
+            temperature=0,
+            max_tokens=1024
+        )
+
+        summary = (response or "").strip()
+        if not summary:
+            return None
+        return summary[:max_chars]
+
+    except Exception as e:
+        logger.error(f"Erro ao resumir conversa: {str(e)}")
+        return None
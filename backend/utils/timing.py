@@ -0,0 +1,45 @@
+import threading
+import time
+from contextlib import contextmanager
+
+class StepTimer:
+    """
+    Mede o tempo de cada etapa de uma requisição.
+
+    Etapas executadas em paralelo (em outras threads) também são registradas;
+    o header Server-Timing mostra cada etapa e o total da requisição.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._steps[name] = self._steps.get(name, 0.0) + seconds
+
+    def timed(self, name, fn, *args, **kwargs):
+        """Envolve `fn` para que sua execução seja registrada como a etapa `name`"""
+        def run():
+            with self.step(name):
+                return fn(*args, **kwargs)
+        return run
+
+    def as_dict(self):
+        with self._lock:
+            steps = {name: round(seconds * 1000, 3) for name, seconds in self._steps.items()}
+        steps['total'] = round((time.perf_counter() - self.started) * 1000, 3)
+        return steps
+
+    def server_timing(self):
+        """Valor do header Server-Timing (ex.: 'quota;dur=12.1, llm;dur=840.2, total;dur=870.5')"""
+        return ', '.join(f'{name};dur={ms:.1f}' for name, ms in self.as_dict().items())
@@ -0,0 +1,205 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from config.supabase_config import supabase
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """
+    Agrupa escritas não críticas e as envia ao Supabase em lote.
+
+    - `insert(table, row)`: acumula linhas e grava com um insert em massa
+    - `touch(table, row_id)`: marca `updated_at` (ou outra coluna) com o
+      horário do toque, não o do flush; vários toques na mesma linha viram
+      uma única atualização, com o horário mais recente
+
+    O buffer é esvaziado quando atinge `max_batch` itens ou a cada
+    `flush_interval` segundos, e também ao encerrar o processo.
+    """
+
+    def __init__(self, name, max_batch=100, flush_interval=2.0, max_pending=10000):
+        self.name = name
+        self.max_batch = max(1, int(max_batch))
+        self.flush_interval = float(flush_interval)
+        self.max_pending = int(max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._inserts = defaultdict(list)
+        self._touches = defaultdict(dict)
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._stats = {
+            'rows_inserted': 0,
+            'rows_touched': 0,
+            'flushes': 0,
+            'errors': 0,
+            'dropped': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-flusher', daemon=True)
+        self._thread.start()
+
+    def _size(self):
+        return sum(len(v) for v in self._inserts.values()) + sum(len(v) for v in self._touches.values())
+
+    def insert(self, table, row):
+        """Enfileira uma linha para insert em lote"""
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._ensure_started()
+                self._inserts[table].append(row)
+                full = self._size() >= self.max_batch
+        if closed:
+            self._write_direct(table, [row])
+        elif full:
+            self._wakeup.set()
+
+    def touch(self, table, row_id, column='updated_at'):
+        """Enfileira a atualização do timestamp de uma linha"""
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._ensure_started()
+                touched = self._touches[(table, column)]
+                # ISO 8601 em UTC: a comparação de strings segue a ordem temporal
+                touched[row_id] = max(touched.get(row_id, now), now)
+                full = self._size() >= self.max_batch
+        if closed:
+            self._update_direct(table, column, row_id, now)
+        elif full:
+            self._wakeup.set()
+
+    def pending_rows(self, table, predicate=None):
+        """Conta linhas ainda não gravadas (ex.: para semear contadores de quota)"""
+        with self._lock:
+            rows = self._inserts.get(table, [])
+            if predicate is None:
+                return len(rows)
+            return sum(1 for r in rows if predicate(r))
+
+    @contextmanager
+    def paused(self):
+        """
+        Segura os flushes durante o bloco: uma contagem no banco somada a
+        `pending_rows` não conta duas vezes (nem nenhuma) as linhas que um
+        flush moveria do buffer para o banco no meio do caminho
+        """
+        with self._flush_lock:
+            yield
+
+    # Após o shutdown, as escritas vão direto ao banco para não perder dados
+    def _write_direct(self, table, rows):
+        try:
+            supabase.table(table).insert(rows).execute()
+        except Exception as e:
+            logger.error(f'Error writing {table} after shutdown: {str(e)}')
+
+    def _update_direct(self, table, column, row_id, touched_at):
+        try:
+            supabase.table(table).update({column: touched_at}).eq('id', row_id).execute()
+        except Exception as e:
+            logger.error(f'Error touching {table} after shutdown: {str(e)}')
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if self._closed:
+                return
+
+    def flush(self):
+        """Grava tudo o que estiver pendente"""
+        with self._flush_lock:
+            with self._lock:
+                inserts, self._inserts = self._inserts, defaultdict(list)
+                touches, self._touches = self._touches, defaultdict(dict)
+            if not inserts and not touches:
+                return
+
+            started = time.perf_counter()
+            for table, rows in inserts.items():
+                for i in range(0, len(rows), self.max_batch):
+                    chunk = rows[i:i + self.max_batch]
+                    try:
+                        supabase.table(table).insert(chunk).execute()
+                        self._count('rows_inserted', len(chunk))
+                    except Exception as e:
+                        logger.error(f'Error flushing {len(chunk)} rows into {table}: {str(e)}')
+                        self._count('errors', 1)
+                        self._requeue(table, chunk)
+
+            for (table, column), touched in touches.items():
+                # Um update por horário distinto, com os ids tocados naquele instante
+                by_time = defaultdict(list)
+                for row_id, touched_at in touched.items():
+                    by_time[touched_at].append(row_id)
+                for touched_at, ids in by_time.items():
+                    for i in range(0, len(ids), self.max_batch):
+                        chunk = ids[i:i + self.max_batch]
+                        try:
+                            supabase.table(table).update({column: touched_at}).in_('id', chunk).execute()
+                            self._count('rows_touched', len(chunk))
+                        except Exception as e:
+                            logger.error(f'Error touching {len(chunk)} rows in {table}: {str(e)}')
+                            self._count('errors', 1)
+
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def _requeue(self, table, rows):
+        with self._lock:
+            if self._closed or self._size() + len(rows) > self.max_pending:
+                self._stats['dropped'] += len(rows)
+                logger.error(f'Dropping {len(rows)} rows for {table} after failed flush')
+                return
+            self._inserts[table][:0] = rows
+
+    def _count(self, stat, amount):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def shutdown(self):
+        """Grava o que estiver pendente e para o flusher"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._size()
+        stats.update({
+            'name': self.name,
+            'max_batch': self.max_batch,
+            'flush_interval': self.flush_interval
+        })
+        return stats
+
+# Buffer padrão para quota_logs e toques de updated_at
+write_behind = WriteBehindBuffer(
+    'write_behind',
+    max_batch=int(os.getenv('WRITE_BEHIND_MAX_BATCH', '100')),
+    flush_interval=float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '2.0'))
+)
+
+atexit.register(write_behind.shutdown)